@@ -3,15 +3,18 @@ Business logic layer for Activity operations.
 """
 import time
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Optional
 from fastapi import HTTPException, UploadFile
-from datetime import datetime
 
 from activity.repositories.activity_repository import ActivityRepository, FirestoreError
 from activity.models.activity import ActivityStatus
 from user.services.image_service import ImageService
 
 from user.services.alert_service import AlertService
+from jobs.cascade import CascadeDeleter
+from jobs import outbox as events
+from jobs.outbox import AlertOutbox
+from activity.services.chat_hub import ACTIVITY_CANCELLED, ACTIVITY_GONE, ChatHub
 
 class ActivityController:
     """
@@ -19,10 +22,17 @@ class ActivityController:
     joining, and searching activities.
     """
     
-    def __init__(self):
-        self.repo = ActivityRepository()
-        self.image_service = ImageService()  
-        self.alert_service = AlertService()
+    def __init__(self, repo: Optional[ActivityRepository] = None, image_service: Optional[ImageService] = None,
+                 alert_service: Optional[AlertService] = None, cascade: Optional[CascadeDeleter] = None,
+                 outbox: Optional[AlertOutbox] = None, chat_hub: Optional[ChatHub] = None):
+        self.repo = repo or ActivityRepository()
+        self.image_service = image_service or ImageService()
+        self.alert_service = alert_service or AlertService()
+        self.cascade = cascade or CascadeDeleter(self.repo.db)
+        # Alerts are recorded as outbox events with each change and delivered in the background
+        self.outbox = outbox or AlertOutbox(self.repo.db, self.alert_service)
+        # Open chat sockets follow membership changes made here
+        self.chat_hub = chat_hub or ChatHub()
 
     def create_activity(self, creator_id: str, data: Dict) -> Dict:
         """
@@ -33,6 +43,7 @@ class ActivityController:
         data["creator_id"] = creator_id
         data["status"] = ActivityStatus.AVAILABLE.value
         data["participants"] = []  # Initialize empty participants list
+        data["participantCount"] = 0  # Maintained with Increment alongside participants
         data["joinRequests"] = []  # Initialize empty join requests list
         
         try:
@@ -44,6 +55,7 @@ class ActivityController:
     def delete_activity(self, activity_id: str, current_user: str) -> Dict:
         """
         Deletes an existing activity if the current user is the creator.
+        Its messages and alerts are removed in the background.
         """
         activity = self.repo.get_by_id(activity_id)
         if not activity:
@@ -52,10 +64,11 @@ class ActivityController:
             raise HTTPException(status_code=403, detail="Not authorized to delete this activity")
         
         try:
-            self.repo.delete(activity_id)
-            return {"message": "Activity deleted successfully"}
-        except FirestoreError as e:
-            raise HTTPException(status_code=500, detail=str(e))
+            job_id = self.cascade.delete_activity(activity_id)
+            self.chat_hub.close_thread(activity_id, ACTIVITY_GONE, "Activity deleted")
+            return {"message": "Activity deleted successfully", "cleanupJobId": job_id}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to delete activity {activity_id}: {str(e)}")
     
     def update_activity(self, activity_id: str, data: Dict, current_user: str) -> Dict:
         """
@@ -74,16 +87,15 @@ class ActivityController:
                 del data[field]
         
         try:
-            self.repo.update(activity_id, data)
-
-            for user_id in activity.participants:
-                if user_id != current_user:
-                    self.alert_service.create_activity_updated_alert(
-                        participant_id=user_id,
-                        creator_id=current_user,
-                        activity_id=activity_id,
-                        activity_name=activity.activityName
-                    )
+            event = self.outbox.event(
+                events.ACTIVITY_UPDATED,
+                activity_id=activity_id,
+                activity_name=data.get("activityName", activity.activityName),
+                creator_id=current_user,
+                participants=activity.participants
+            )
+            self.repo.update(activity_id, data, outbox=[event])
+            self.outbox.dispatch([event])
 
             return {"message": "Activity updated successfully"}
         except FirestoreError as e:
@@ -106,28 +118,24 @@ class ActivityController:
         if user_id == activity.creator_id:
             raise HTTPException(status_code=400, detail="You cannot join your own activity as a participant")
             
-        if activity.status != ActivityStatus.AVAILABLE:
-            raise HTTPException(status_code=400, detail=f"Activity is not available (status: {activity.status.value})")
+        if activity.effective_status() != ActivityStatus.AVAILABLE:
+            raise HTTPException(status_code=400, detail=f"Activity is not available (status: {activity.effective_status().value})")
             
         if activity.is_full():
             raise HTTPException(status_code=400, detail="Activity is already full")
         
         try:
-            # Update using transaction for safety
-            def update_func(activity):
-                if activity.add_join_request(user_id):
-                    return {"joinRequests": activity.joinRequests}
-                return None
-                
-            self.repo.update_activity_with_transaction(activity_id, update_func)
-
-            # Create alert for the creator
-            self.alert_service.create_join_request_alert(
-                creator_id=activity.creator_id,
-                requester_id=user_id,
+            # Alert for the creator, recorded with the request
+            event = self.outbox.event(
+                events.JOIN_REQUESTED,
                 activity_id=activity_id,
-                activity_name=activity.activityName
+                activity_name=activity.activityName,
+                creator_id=activity.creator_id,
+                requester_id=user_id
             )
+            # ArrayUnion is applied server-side, so concurrent joins don't contend
+            self.repo.add_join_request(activity_id, user_id, outbox=[event])
+            self.outbox.dispatch([event])
 
             return {"message": "Join request sent successfully"}
         except FirestoreError as e:
@@ -145,20 +153,15 @@ class ActivityController:
             raise HTTPException(status_code=400, detail="You don't have a pending request for this activity")
         
         try:
-            # Update using transaction for safety
-            def update_func(activity):
-                if activity.cancel_join_request(user_id):
-                    return {"joinRequests": activity.joinRequests}
-                return None
-                
-            self.repo.update_activity_with_transaction(activity_id, update_func)
-
             # Delete the join request alert sent to the creator
-            self.alert_service.delete_join_request_alert(
+            event = self.outbox.event(
+                events.JOIN_REQUEST_CANCELLED,
+                activity_id=activity_id,
                 creator_id=activity.creator_id,
-                requester_id=user_id,
-                activity_id=activity_id
+                requester_id=user_id
             )
+            self.repo.remove_join_request(activity_id, user_id, outbox=[event])
+            self.outbox.dispatch([event])
 
             return {"message": "Join request cancelled successfully"}
         except FirestoreError as e:
@@ -182,40 +185,20 @@ class ActivityController:
             raise HTTPException(status_code=400, detail="Activity is already full")
         
         try:
-            # Update using transaction for safety
-            def update_func(activity):
-                if activity.approve_join_request(new_user_id):
-                    return {
-                        "joinRequests": activity.joinRequests,
-                        "participants": activity.participants
-                    }
-                return None
-                
-            self.repo.update_activity_with_transaction(activity_id, update_func)
-
-            # Find and update the join request alert
-            # Get alerts for the current user that match this activity and sender
-            alerts_query = self.alert_service.repository.collection.where("user_id", "==", current_user)\
-                                            .where("sender_id", "==", new_user_id)\
-                                            .where("activity_id", "==", activity_id)\
-                                            .where("type", "==", "join_request")\
-                                            .limit(1)
-            
-            alerts = list(alerts_query.stream())
-            if alerts:
-                alert_id = alerts[0].id
-                # Update the alert status
-                self.alert_service.repository.set_response_status(alert_id, "accepted")
-
-            # Create alert for requester
-            self.alert_service.create_request_response_alert(
-                user_id=new_user_id,
-                creator_id=current_user,
+            # Marks the join request alert accepted and notifies the requester
+            event = self.outbox.event(
+                events.JOIN_RESPONDED,
                 activity_id=activity_id,
                 activity_name=activity.activityName,
+                creator_id=current_user,
+                requester_id=new_user_id,
                 approved=True
             )
-
+            # Capacity is re-checked against the latest document before writing
+            if not self.repo.approve_join_request(activity_id, new_user_id, outbox=[event]):
+                raise HTTPException(status_code=400, detail="Activity is already full or the request was withdrawn")
+            self.outbox.dispatch([event])
+            self.chat_hub.add_member(activity_id, new_user_id)
 
             return {"message": "Join request approved successfully"}
         except FirestoreError as e:
@@ -236,36 +219,17 @@ class ActivityController:
             raise HTTPException(status_code=400, detail="User does not have a pending join request")
         
         try:
-            # Update using transaction for safety
-            def update_func(activity):
-                if activity.reject_join_request(user_id):
-                    return {"joinRequests": activity.joinRequests}
-                return None
-                
-            self.repo.update_activity_with_transaction(activity_id, update_func)
-
-            # Find and update the join request alert
-            # Get alerts for the current user that match this activity and sender
-            alerts_query = self.alert_service.repository.collection.where("user_id", "==", current_user)\
-                                            .where("sender_id", "==", user_id)\
-                                            .where("activity_id", "==", activity_id)\
-                                            .where("type", "==", "join_request")\
-                                            .limit(1)
-            
-            alerts = list(alerts_query.stream())
-            if alerts:
-                alert_id = alerts[0].id
-                # Update the alert status
-                self.alert_service.repository.set_response_status(alert_id, "accepted")
-
-            # Create alert for requester
-            self.alert_service.create_request_response_alert(
-                user_id=user_id,
-                creator_id=current_user, 
+            # Marks the join request alert rejected and notifies the requester
+            event = self.outbox.event(
+                events.JOIN_RESPONDED,
                 activity_id=activity_id,
                 activity_name=activity.activityName,
+                creator_id=current_user,
+                requester_id=user_id,
                 approved=False
             )
+            self.repo.remove_join_request(activity_id, user_id, outbox=[event])
+            self.outbox.dispatch([event])
 
             return {"message": "Join request rejected successfully"}
         except FirestoreError as e:
@@ -286,20 +250,16 @@ class ActivityController:
             raise HTTPException(status_code=400, detail="User is not a participant in this activity")
         
         try:
-            # Update using transaction for safety
-            def update_func(activity):
-                if activity.remove_participant(user_id):
-                    return {"participants": activity.participants}
-                return None
-                
-            self.repo.update_activity_with_transaction(activity_id, update_func)
-
-            self.alert_service.create_user_removed_alert(
-                participant_id=user_id,
-                creator_id=current_user,
+            event = self.outbox.event(
+                events.PARTICIPANT_REMOVED,
                 activity_id=activity_id,
-                activity_name=activity.activityName
+                activity_name=activity.activityName,
+                creator_id=current_user,
+                participant_id=user_id
             )
+            if self.repo.remove_participant(activity_id, user_id, outbox=[event]):
+                self.outbox.dispatch([event])
+            self.chat_hub.remove_member(activity_id, user_id)
 
             return {"message": "Participant removed successfully"}
         except FirestoreError as e:
@@ -320,20 +280,16 @@ class ActivityController:
             raise HTTPException(status_code=400, detail="You are not a participant in this activity")
         
         try:
-            # Update using transaction for safety
-            def update_func(activity):
-                if activity.remove_participant(user_id):
-                    return {"participants": activity.participants}
-                return None
-                
-            self.repo.update_activity_with_transaction(activity_id, update_func)
-
-            self.alert_service.create_user_left_alert(
-                creator_id=activity.creator_id,
-                user_id=user_id,
+            event = self.outbox.event(
+                events.PARTICIPANT_LEFT,
                 activity_id=activity_id,
-                activity_name=activity.activityName
+                activity_name=activity.activityName,
+                creator_id=activity.creator_id,
+                participant_id=user_id
             )
+            if self.repo.remove_participant(activity_id, user_id, outbox=[event]):
+                self.outbox.dispatch([event])
+            self.chat_hub.remove_member(activity_id, user_id)
 
             return {"message": "Left activity successfully"}
         except FirestoreError as e:
@@ -350,21 +306,21 @@ class ActivityController:
         if activity.creator_id != current_user:
             raise HTTPException(status_code=403, detail="Only the creator can cancel this activity")
             
-        if activity.status != ActivityStatus.AVAILABLE:
-            raise HTTPException(status_code=400, detail=f"Activity is already {activity.status.value}")
+        if activity.effective_status() != ActivityStatus.AVAILABLE:
+            raise HTTPException(status_code=400, detail=f"Activity is already {activity.effective_status().value}")
         
         try:
-            self.repo.update(activity_id, {"status": ActivityStatus.CANCELLED.value})
-
             # Notify all participants about the cancellation
-            for participant_id in activity.participants:
-                if participant_id != current_user:
-                    self.alert_service.create_activity_cancelled_alert(
-                        participant_id=participant_id,
-                        creator_id=current_user,
-                        activity_id=activity_id,
-                        activity_name=activity.activityName
-                    )
+            event = self.outbox.event(
+                events.ACTIVITY_CANCELLED,
+                activity_id=activity_id,
+                activity_name=activity.activityName,
+                creator_id=current_user,
+                participants=activity.participants
+            )
+            self.repo.update(activity_id, {"status": ActivityStatus.CANCELLED.value}, outbox=[event])
+            self.outbox.dispatch([event])
+            self.chat_hub.close_thread(activity_id, ACTIVITY_CANCELLED, "Activity cancelled")
 
             return {"message": "Activity cancelled successfully"}
         except FirestoreError as e:
@@ -481,15 +437,16 @@ class ActivityController:
                 - location: Dict with latitude and longitude
                 - maxDistance: Maximum distance in kilometers for location search
                 - placeName: Filter by place name
+                - exclude_participant: Drop activities this user is participating in
                 - limit: Max number of results to return
                 - start_after: Activity ID to start after (pagination)
                 
         Returns:
-            List of activity dictionaries that match the criteria
+            List of activity summary dictionaries that match the criteria
         """
         try:
             # If no filters provided, return all activities (with limit)
-            if not any(k != 'limit' and k != 'start_after' for k in filters.keys()):
+            if not any(k not in ('limit', 'start_after', 'exclude_participant') for k in filters.keys()):
                 # Default to showing only available activities when no filters are specified
                 filters["status"] = ActivityStatus.AVAILABLE.value
                 
@@ -505,12 +462,8 @@ class ActivityController:
         Administrative method to run the expiration job for activities.
         """
         try:
-            processed, expired = self.repo.expire_activities()
-            return {
-                "message": "Activity expiration job completed",
-                "processed": processed,
-                "expired": expired
-            }
+            report = self.repo.expire_activities()
+            return {"message": "Activity expiration job completed", **report}
         except FirestoreError as e:
             raise HTTPException(status_code=500, detail=str(e))
         
@@ -2,7 +2,7 @@
 Domain model classes and enums for Activity objects in Firestore.
 """
 
-from datetime import datetime
+from datetime import datetime, timezone
 from dataclasses import dataclass
 from firebase_admin import firestore
 from enum import Enum
@@ -46,6 +46,18 @@ class Location:
         return firestore.GeoPoint(self.latitude, self.longitude)
 
 
+def has_passed(date_time: Optional[datetime], now: Optional[datetime] = None) -> bool:
+    """
+    Check whether a datetime is in the past.
+    Naive datetimes are treated as UTC, which is how Firestore stores them.
+    """
+    if not isinstance(date_time, datetime):
+        return False
+    if date_time.tzinfo is None:
+        date_time = date_time.replace(tzinfo=timezone.utc)
+    return date_time < (now or datetime.now(timezone.utc))
+
+
 class ActivityError(Exception):
     """Base exception for Activity-related errors."""
     pass
@@ -142,7 +154,7 @@ class Activity:
 
     def can_join(self, user_id: str) -> bool:
         """Determines if a user can join this activity."""
-        return (self.status == ActivityStatus.AVAILABLE and 
+        return (self.effective_status() == ActivityStatus.AVAILABLE and 
                 not self.is_full() and
                 user_id not in self.participants and
                 user_id != self.creator_id and
@@ -219,11 +231,20 @@ class Activity:
     
     def is_expired(self) -> bool:
         """Check if the activity date has passed."""
-        return self.dateTime < datetime.now()
+        return has_passed(self.dateTime)
     
     def should_expire(self) -> bool:
         """Check if the activity should be marked as expired based on date."""
         return self.is_expired() and self.status == ActivityStatus.AVAILABLE
+    
+    def effective_status(self) -> ActivityStatus:
+        """
+        The status as of now: an AVAILABLE activity whose dateTime has passed reads
+        as EXPIRED even before the stored status has been updated.
+        """
+        if self.should_expire():
+            return ActivityStatus.EXPIRED
+        return self.status
 
     @classmethod
     def from_dict(cls, activity_id: str, data: Dict[str, Any]) -> 'Activity':
@@ -289,9 +310,10 @@ class Activity:
             "placeName": self.placeName,  # Add the placeName field
             "dateTime": date_time_str,  # Use the string representation
             "participants": self.participants,
+            "participantCount": len(self.participants),
             "joinRequests": self.joinRequests,
             "maxParticipants": self.maxParticipants,
-            "status": self.status.value
+            "status": self.effective_status().value
         }
         
     @classmethod
@@ -306,4 +328,91 @@ class Activity:
     def __repr__(self) -> str:
         """Detailed string representation."""
         return (f"Activity(id={self.id!r}, activityName={self.activityName!r}, "
-                f"sport={self.sport!r}, status={self.status.value!r})")
\ No newline at end of file
+                f"sport={self.sport!r}, status={self.status.value!r})")
+
+
+class ActivitySummary:
+    """
+    Lightweight projection of an activity for list views.
+    
+    Carries only the fields an activity card displays, with the participant
+    count in place of the participant and join request arrays. Load the full
+    Activity only when a single activity is opened.
+    """
+    
+    # Field mask passed to Firestore select() for list queries
+    FIELDS = [
+        "activityName", "bannerImageUrl", "type", "price", "sport", "skillLevel",
+        "creator_id", "location", "placeName", "dateTime", "maxParticipants",
+        "participantCount", "status"
+    ]
+    
+    def __init__(self, activity_id: str, data: Dict[str, Any]):
+        self.id = activity_id
+        self.activityName = data.get("activityName", "")
+        self.bannerImageUrl = data.get("bannerImageUrl", "")
+        self.type = data.get("type", ActivityType.EVENT.value)
+        self.price = data.get("price", 0)
+        self.sport = data.get("sport", "")
+        self.skillLevel = data.get("skillLevel", SkillLevel.BEGINNER.value)
+        self.creator_id = data.get("creator_id", "")
+        self.location = data.get("location")
+        self.placeName = data.get("placeName", "")
+        self.dateTime = data.get("dateTime")
+        self.maxParticipants = data.get("maxParticipants", 0)
+        self.participantCount = data.get("participantCount", 0)
+        self.status = data.get("status", ActivityStatus.AVAILABLE.value)
+        # Only present when the query selected it (e.g. for text search); never serialized
+        self.description = data.get("description", "")
+    
+    @classmethod
+    def from_dict(cls, activity_id: str, data: Dict[str, Any]) -> 'ActivitySummary':
+        """Create an ActivitySummary from a (possibly field-masked) document."""
+        return cls(activity_id, data or {})
+    
+    def get_location_as_object(self) -> Optional[Location]:
+        """Get the location as a Location object."""
+        if isinstance(self.location, firestore.GeoPoint):
+            return Location.from_geo_point(self.location)
+        if isinstance(self.location, dict):
+            return Location(latitude=self.location["latitude"], longitude=self.location["longitude"])
+        return None
+    
+    def should_expire(self) -> bool:
+        """Check if the activity should be marked as expired based on date."""
+        return self.status == ActivityStatus.AVAILABLE.value and has_passed(self.dateTime)
+    
+    def effective_status(self) -> str:
+        """The status as of now, treating past AVAILABLE activities as EXPIRED."""
+        if self.should_expire():
+            return ActivityStatus.EXPIRED.value
+        return getattr(self.status, "value", self.status)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the summary into a response dictionary."""
+        location_obj = self.get_location_as_object()
+        location_dict = None
+        if location_obj:
+            location_dict = {"latitude": location_obj.latitude, "longitude": location_obj.longitude}
+        
+        return {
+            "id": self.id,
+            "activityName": self.activityName,
+            "bannerImageUrl": self.bannerImageUrl,
+            "type": getattr(self.type, "value", self.type),
+            "price": self.price,
+            "sport": self.sport,
+            "skillLevel": getattr(self.skillLevel, "value", self.skillLevel),
+            "creator_id": self.creator_id,
+            "location": location_dict,
+            "placeName": self.placeName,
+            "dateTime": self.dateTime.isoformat() if isinstance(self.dateTime, datetime) else self.dateTime,
+            "maxParticipants": self.maxParticipants,
+            "participantCount": self.participantCount,
+            "status": self.effective_status()
+        }
+    
+    def __repr__(self) -> str:
+        """Detailed string representation."""
+        return (f"ActivitySummary(id={self.id!r}, activityName={self.activityName!r}, "
+                f"sport={self.sport!r}, status={self.status!r})")
@@ -2,11 +2,40 @@
 Data access layer for Activity documents in Firestore.
 """
 
-from typing import Optional, List, Dict, Any, Tuple
-from datetime import datetime
+import math
+from typing import Optional, List, Dict, Any, Sequence, Tuple
+from datetime import datetime, timezone
 from firebase_admin import firestore
 from fastapi import HTTPException
-from activity.models.activity import Activity, ActivityStatus, Location
+from google.api_core.exceptions import FailedPrecondition
+from database.client import get_client
+from database.bulk import BulkCommitter
+from utils.write_coalescer import PendingWrite, get_coalescer
+from database.query_shapes import QueryShape, register_shape
+from database.telemetry import run_query
+from activity.models.activity import Activity, ActivitySummary, ActivityStatus, Location, has_passed
+
+# Query shapes emitted by this repository (see database.indexes)
+BY_CREATOR = register_shape(QueryShape("activities.by_creator", "activities", equality=("creator_id",)))
+SEARCH = register_shape(QueryShape(
+    "activities.search", "activities",
+    equality=("status",),
+    optional_equality=("sport", "skillLevel", "type"),
+    range="dateTime", optional_range=True
+))
+BY_PARTICIPANT = register_shape(QueryShape("activities.by_participant", "activities", array_contains="participants"))
+BY_JOIN_REQUEST = register_shape(QueryShape("activities.by_join_request", "activities", array_contains="joinRequests"))
+PENDING_APPROVALS = register_shape(QueryShape(
+    "activities.pending_approvals", "activities", equality=("creator_id",), range="joinRequests"
+))
+EXPIRING = register_shape(QueryShape(
+    "activities.expiring", "activities", equality=("status",), range="dateTime",
+    order_by=(("dateTime", "ASCENDING"),)
+))
+
+# Where resumable jobs keep their progress
+CHECKPOINT_COLLECTION = "job_checkpoints"
+EXPIRE_CHECKPOINT_ID = "expire_activities"
 
 class FirestoreError(Exception):
     """Custom exception for Firestore errors."""
@@ -15,8 +44,11 @@ class FirestoreError(Exception):
 class ActivityRepository:
     """Interacts with the 'activities' collection in Firestore."""
     
-    def __init__(self):
-        self.db = firestore.client()
+    # How many times a conditional write re-reads the activity after losing a race
+    MAX_CONDITIONAL_ATTEMPTS = 5
+
+    def __init__(self, db=None):
+        self.db = db or get_client()
         self.collection = self.db.collection('activities')
     
     def create(self, activity_id: str, data: dict) -> Activity:
@@ -50,23 +82,26 @@ class ActivityRepository:
             doc = self.collection.document(activity_id).get()
             if not doc.exists:
                 return None
-            return Activity.from_dict(doc.id, doc.to_dict())
+            activity = Activity.from_dict(doc.id, doc.to_dict())
+            self._write_back_expired([activity], [doc])
+            return activity
         except Exception as e:
             raise FirestoreError(f"Failed to retrieve activity {activity_id}: {str(e)}")
     
-    def update(self, activity_id: str, data: dict) -> bool:
+    def update(self, activity_id: str, data: dict, outbox: Sequence[PendingWrite] = ()) -> bool:
         """
         Updates an existing activity document by ID.
         
         Args:
             activity_id (str): The ID of the activity document.
             data (dict): Fields to update in the activity.
+            outbox (list): Outbox events committed atomically with the update.
         
         Returns:
             bool: True if successful.
         """
         try:
-            self.collection.document(activity_id).update(data)
+            self._write(self.collection.document(activity_id), data, outbox)
             return True
         except Exception as e:
             raise FirestoreError(f"Failed to update activity {activity_id}: {str(e)}")
@@ -87,7 +122,7 @@ class ActivityRepository:
         except Exception as e:
             raise FirestoreError(f"Failed to delete activity {activity_id}: {str(e)}")
     
-    def list_by_creator(self, creator_id: str, limit: int = 50, start_after: str = None) -> List[Activity]:
+    def list_by_creator(self, creator_id: str, limit: int = 50, start_after: str = None) -> List[ActivitySummary]:
         """
         Retrieves activities created by a specific user with pagination.
         
@@ -97,10 +132,10 @@ class ActivityRepository:
             start_after (str): Document ID to start after for pagination.
             
         Returns:
-            List[Activity]: A list of activity objects.
+            List[ActivitySummary]: A list of activity summaries.
         """
         try:
-            query = self.collection.where("creator_id", "==", creator_id)
+            query = self.collection.where("creator_id", "==", creator_id).select(ActivitySummary.FIELDS)
             
             # Apply pagination
             if start_after:
@@ -110,12 +145,12 @@ class ActivityRepository:
                     query = query.start_after(doc)
                     
             query = query.limit(limit)
-            docs = query.stream()
-            return [Activity.from_dict(doc.id, doc.to_dict()) for doc in docs]
+            docs = run_query(query, BY_CREATOR)
+            return self._write_back_expired([ActivitySummary.from_dict(doc.id, doc.to_dict()) for doc in docs], docs)
         except Exception as e:
             raise FirestoreError(f"Failed to list activities by creator: {str(e)}")
     
-    def search_activities(self, filters: Dict) -> List[Activity]:
+    def search_activities(self, filters: Dict) -> List[ActivitySummary]:
         """
         Search for activities based on given criteria.
         
@@ -123,43 +158,61 @@ class ActivityRepository:
             filters: Dictionary of filter criteria
             
         Returns:
-            List of Activity objects that match the criteria
+            List of ActivitySummary objects that match the criteria
         """
-        query = self.collection
+        # Only fetch the card fields, plus the description when it is needed for text search
+        fields = list(ActivitySummary.FIELDS)
+        if filters.get("query"):
+            fields.append("description")
+        query = self.collection.select(fields)
+        equality_fields = []
+        range_field = None
         
         # Start with a base query for non-expired, non-cancelled activities unless specified
-        if "status" in filters:
-            query = query.where("status", "==", filters["status"])
-        else:
-            # Default: Only show available activities
-            query = query.where("status", "==", ActivityStatus.AVAILABLE.value)
+        status = filters.get("status", ActivityStatus.AVAILABLE.value)
+        query = query.where("status", "==", status)
+        
+        # AVAILABLE activities whose time has passed are effectively expired, so
+        # exclude them in the query rather than waiting for the expiry job
+        if status == ActivityStatus.AVAILABLE.value:
+            now = datetime.now(timezone.utc)
+            date_from = filters.get("dateFrom")
+            if date_from is None or has_passed(date_from, now):
+                filters = {**filters, "dateFrom": now}
         
         # Filter by sport
         if "sport" in filters:
             query = query.where("sport", "==", filters["sport"])
+            equality_fields.append("sport")
         
         # Filter by skill level
         if "skillLevel" in filters:
             query = query.where("skillLevel", "==", filters["skillLevel"])
+            equality_fields.append("skillLevel")
         
         # Filter by activity type
         if "type" in filters:
             query = query.where("type", "==", filters["type"])
+            equality_fields.append("type")
         
         # Filter by dateTime range
         if "dateFrom" in filters:
             date_from = filters["dateFrom"]
             query = query.where("dateTime", ">=", date_from)
+            range_field = "dateTime"
         
         if "dateTo" in filters:
             date_to = filters["dateTo"]
             query = query.where("dateTime", "<=", date_to)
+            range_field = "dateTime"
         
         # Get results
-        results = query.limit(filters.get("limit", 50)).get()
+        shape = SEARCH.variant(equality=tuple(equality_fields), range_field=range_field)
+        results = run_query(query.limit(filters.get("limit", 50)), shape)
         
-        # Convert to Activity objects
-        activities = [Activity.from_dict(doc.id, doc.to_dict()) for doc in results]
+        # Convert to ActivitySummary objects
+        activities = self._write_back_expired([ActivitySummary.from_dict(doc.id, doc.to_dict()) for doc in results],
+                                              results)
         
         # Post-processing filters (these can't be done efficiently in Firestore queries)
         filtered_activities = activities
@@ -221,9 +274,30 @@ class ActivityRepository:
                 ) <= max_distance
             ]
         
+        # Drop activities the viewer has already joined (keys-only lookup, no arrays fetched)
+        if filters.get("exclude_participant"):
+            joined = self.get_participating_ids(filters["exclude_participant"])
+            filtered_activities = [a for a in filtered_activities if a.id not in joined]
+        
         return filtered_activities
     
-    def get_activities_by_participants(self, user_id: str) -> List[Activity]:
+    def get_participating_ids(self, user_id: str) -> set:
+        """
+        Retrieves the IDs of activities where the given user is a participant.
+        
+        Args:
+            user_id (str): The user's ID.
+            
+        Returns:
+            set: Activity document IDs.
+        """
+        try:
+            query = self.collection.where("participants", "array_contains", user_id).select([])
+            return {doc.id for doc in run_query(query, BY_PARTICIPANT)}
+        except Exception as e:
+            raise FirestoreError(f"Failed to get participating activity IDs: {str(e)}")
+    
+    def get_activities_by_participants(self, user_id: str) -> List[ActivitySummary]:
         """
         Retrieves all activities where the given user is a participant.
         
@@ -231,16 +305,16 @@ class ActivityRepository:
             user_id (str): The user's ID.
             
         Returns:
-            List[Activity]: Activities where the user is a participant.
+            List[ActivitySummary]: Activities where the user is a participant.
         """
         try:
-            query = self.collection.where("participants", "array_contains", user_id)
-            docs = query.stream()
-            return [Activity.from_dict(doc.id, doc.to_dict()) for doc in docs]
+            query = self.collection.where("participants", "array_contains", user_id).select(ActivitySummary.FIELDS)
+            docs = run_query(query, BY_PARTICIPANT)
+            return self._write_back_expired([ActivitySummary.from_dict(doc.id, doc.to_dict()) for doc in docs], docs)
         except Exception as e:
             raise FirestoreError(f"Failed to get activities by participant: {str(e)}")
     
-    def get_pending_join_requests(self, user_id: str) -> List[Activity]:
+    def get_pending_join_requests(self, user_id: str) -> List[ActivitySummary]:
         """
         Retrieves all activities where the given user has a pending join request.
         
@@ -248,12 +322,12 @@ class ActivityRepository:
             user_id (str): The user's ID.
             
         Returns:
-            List[Activity]: Activities with pending join requests from user.
+            List[ActivitySummary]: Activities with pending join requests from user.
         """
         try:
-            query = self.collection.where("joinRequests", "array_contains", user_id)
-            docs = query.stream()
-            return [Activity.from_dict(doc.id, doc.to_dict()) for doc in docs]
+            query = self.collection.where("joinRequests", "array_contains", user_id).select(ActivitySummary.FIELDS)
+            docs = run_query(query, BY_JOIN_REQUEST)
+            return self._write_back_expired([ActivitySummary.from_dict(doc.id, doc.to_dict()) for doc in docs], docs)
         except Exception as e:
             raise FirestoreError(f"Failed to get pending join requests: {str(e)}")
         
@@ -272,48 +346,271 @@ class ActivityRepository:
             query = self.collection.where("creator_id", "==", creator_id)
             # Only include activities with at least one join request
             query = query.where("joinRequests", "!=", [])
-            docs = query.stream()
-            return [Activity.from_dict(doc.id, doc.to_dict()) for doc in docs]
+            docs = run_query(query, PENDING_APPROVALS)
+            return self._write_back_expired([Activity.from_dict(doc.id, doc.to_dict()) for doc in docs], docs)
         except Exception as e:
             raise FirestoreError(f"Failed to get activities with pending requests: {str(e)}")
     
-    def expire_activities(self) -> Tuple[int, int]:
+    def _write_back_expired(self, activities: List[Any], docs: Sequence[Any]) -> List[Any]:
         """
-        Mark activities as EXPIRED if their dateTime is in the past.
+        Persist EXPIRED for activities read as effectively expired.
+        
+        The writes are queued on a shared coalescer and committed in the background,
+        so reads stay fast and the expiry job has less left to do. Each write is
+        conditional on the activity not having changed since it was read, so a
+        concurrent cancel or reschedule wins and the write is dropped.
+        
+        Args:
+            activities: Activities or summaries that were just read.
+            docs: The snapshots they were read from, in the same order.
+        
+        Returns:
+            The same list, for chaining.
+        """
+        stale = [(activity, doc) for activity, doc in zip(activities, docs) if activity.should_expire()]
+        if stale:
+            writer = get_coalescer("activity-status", self.db)
+            for activity, doc in stale:
+                writer.submit([PendingWrite("update", doc.reference, {"status": ActivityStatus.EXPIRED.value},
+                                            option=self.db.write_option(last_update_time=doc.update_time))])
+        return activities
+    
+    def add_join_request(self, activity_id: str, user_id: str, outbox: Sequence[PendingWrite] = ()) -> bool:
+        """
+        Adds a user to the activity's join requests as a server-side transform.
         
+        ArrayUnion is idempotent and needs no read, so concurrent join requests
+        on a popular activity do not contend with each other.
+        
+        Args:
+            activity_id (str): The activity document ID.
+            user_id (str): The requesting user's ID.
+            outbox (list): Outbox events committed atomically with the update.
+            
         Returns:
-            tuple: (number_processed, number_expired)
+            bool: True if successful.
         """
         try:
-            # Get activities that are still marked as AVAILABLE
-            query = self.collection.where("status", "==", ActivityStatus.AVAILABLE.value)
-            docs = query.stream()
+            self._write(self.collection.document(activity_id), {
+                "joinRequests": firestore.ArrayUnion([user_id])
+            }, outbox)
+            return True
+        except Exception as e:
+            raise FirestoreError(f"Failed to add join request for activity {activity_id}: {str(e)}")
+    
+    def remove_join_request(self, activity_id: str, user_id: str, outbox: Sequence[PendingWrite] = ()) -> bool:
+        """
+        Removes a user from the activity's join requests as a server-side transform.
+        Used both when the requester cancels and when the creator rejects.
+        
+        Args:
+            activity_id (str): The activity document ID.
+            user_id (str): The requesting user's ID.
+            outbox (list): Outbox events committed atomically with the update.
             
-            batch = self.db.batch()
-            processed = 0
-            expired = 0
+        Returns:
+            bool: True if successful.
+        """
+        try:
+            self._write(self.collection.document(activity_id), {
+                "joinRequests": firestore.ArrayRemove([user_id])
+            }, outbox)
+            return True
+        except Exception as e:
+            raise FirestoreError(f"Failed to remove join request for activity {activity_id}: {str(e)}")
+    
+    def approve_join_request(self, activity_id: str, user_id: str, outbox: Sequence[PendingWrite] = ()) -> bool:
+        """
+        Moves a user from join requests to participants while enforcing capacity.
+        
+        Args:
+            activity_id (str): The activity document ID.
+            user_id (str): The user whose request is approved.
+            outbox (list): Outbox events committed only if the approval is.
             
-            now = datetime.now()
-            for doc in docs:
-                processed += 1
-                data = doc.to_dict()
+        Returns:
+            bool: True if approved, False if the request is gone or the activity is full.
+        """
+        def build_update(activity: Activity) -> Optional[dict]:
+            if not activity.has_join_request(user_id) or activity.is_full():
+                return None
+            return {
+                "joinRequests": firestore.ArrayRemove([user_id]),
+                "participants": firestore.ArrayUnion([user_id]),
+                "participantCount": firestore.Increment(1)
+            }
+        
+        return self._conditional_update(activity_id, build_update, outbox)
+    
+    def remove_participant(self, activity_id: str, user_id: str, outbox: Sequence[PendingWrite] = ()) -> bool:
+        """
+        Removes a user from the activity's participants and decrements the counter.
+        
+        Args:
+            activity_id (str): The activity document ID.
+            user_id (str): The participant to remove.
+            outbox (list): Outbox events committed only if the removal is.
+            
+        Returns:
+            bool: True if removed, False if the user was not a participant.
+        """
+        def build_update(activity: Activity) -> Optional[dict]:
+            if not activity.has_participant(user_id):
+                return None
+            return {
+                "participants": firestore.ArrayRemove([user_id]),
+                "participantCount": firestore.Increment(-1)
+            }
+        
+        return self._conditional_update(activity_id, build_update, outbox)
+    
+    def _write(self, doc_ref, update_data: dict, outbox: Sequence[PendingWrite] = (), option=None) -> None:
+        """
+        Update an activity, committing any outbox events in the same batch so
+        the change and the notifications it owes are recorded together.
+        """
+        if not outbox:
+            doc_ref.update(update_data, option=option)
+            return
+        batch = self.db.batch()
+        batch.update(doc_ref, update_data, option=option)
+        for write in outbox:
+            batch.set(write.reference, write.data, merge=write.merge)
+        batch.commit()
+    
+    def _conditional_update(self, activity_id: str, build_update, outbox: Sequence[PendingWrite] = ()) -> bool:
+        """
+        Applies a transform update guarded by a last-update-time precondition.
+        
+        Unlike a transaction this is a plain read followed by a single write, so it
+        holds no locks; if the document changed in between, the write is rejected
+        and the checks are re-run against a fresh read.
+        
+        Args:
+            activity_id (str): The activity document ID.
+            build_update (callable): Function that takes the activity and returns the
+                                     update data, or None if the change is not allowed.
+            outbox (list): Outbox events committed in the same batch as the update.
+        
+        Returns:
+            bool: True if the update was written, False if build_update declined it.
+        """
+        doc_ref = self.collection.document(activity_id)
+        try:
+            for _ in range(self.MAX_CONDITIONAL_ATTEMPTS):
+                doc = doc_ref.get()
+                if not doc.exists:
+                    raise HTTPException(status_code=404, detail="Activity not found")
                 
-                # Check if dateTime is in the past
-                date_time = data.get("dateTime")
-                if isinstance(date_time, dict) and "seconds" in date_time:
-                    date_time = datetime.fromtimestamp(date_time["seconds"])
+                update_data = build_update(Activity.from_dict(doc.id, doc.to_dict()))
+                if not update_data:
+                    return False
                 
-                if date_time < now:
-                    # Update status to EXPIRED
-                    doc_ref = self.collection.document(doc.id)
-                    batch.update(doc_ref, {"status": ActivityStatus.EXPIRED.value})
-                    expired += 1
-            
-            # Execute batch update
-            if expired > 0:
+                try:
+                    self._write(doc_ref, update_data, outbox,
+                                option=self.db.write_option(last_update_time=doc.update_time))
+                    return True
+                except FailedPrecondition:
+                    # Someone else wrote the activity first; re-check against the new state
+                    continue
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise FirestoreError(f"Conditional update failed for activity {activity_id}: {str(e)}")
+        
+        raise FirestoreError(f"Activity {activity_id} is under heavy contention, please retry")
+    
+    def backfill_participant_counts(self) -> int:
+        """
+        Sets participantCount on activities created before the counter existed.
+        
+        Returns:
+            int: Number of activities updated.
+        """
+        try:
+            batch = self.db.batch()
+            pending = 0
+            updated = 0
+            for doc in self.collection.stream():
+                data = doc.to_dict()
+                if "participantCount" in data:
+                    continue
+                batch.update(doc.reference, {"participantCount": len(data.get("participants", []))})
+                pending += 1
+                updated += 1
+                # Firestore batches are capped at 500 writes
+                if pending == 500:
+                    batch.commit()
+                    batch = self.db.batch()
+                    pending = 0
+            if pending:
                 batch.commit()
-                
-            return processed, expired
+            return updated
+        except Exception as e:
+            raise FirestoreError(f"Failed to backfill participant counts: {str(e)}")
+    
+    def expire_activities(self, page_size: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Mark activities as EXPIRED if their dateTime is in the past.
+        
+        Only AVAILABLE activities with dateTime < now are read (filtered server-side),
+        a page at a time. Each page is committed as parallel batches of at most 500
+        writes, then a checkpoint is saved so an interrupted run resumes from the
+        last committed page with the same cutoff.
+        
+        Args:
+            page_size (int): Activities read per page; defaults to one batch per commit worker.
+        
+        Returns:
+            dict: processed, expired, commits, duration_ms and whether the run resumed.
+        """
+        checkpoint_ref = self.db.collection(CHECKPOINT_COLLECTION).document(EXPIRE_CHECKPOINT_ID)
+        try:
+            checkpoint = checkpoint_ref.get()
+            checkpoint_data = checkpoint.to_dict() if checkpoint.exists else {}
+            resumed = bool(checkpoint_data)
+            cutoff = checkpoint_data.get("cutoff") or datetime.now(timezone.utc)
+            last_id = checkpoint_data.get("last_id")
+            
+            processed = 0
+            committer = BulkCommitter(self.db)
+            page_size = page_size or committer.chunk_size * committer.parallelism
+            
+            with committer:
+                while True:
+                    query = (self.collection
+                             .where("status", "==", ActivityStatus.AVAILABLE.value)
+                             .where("dateTime", "<", cutoff)
+                             .order_by("dateTime")
+                             .select([]))
+                    if last_id:
+                        cursor = self.collection.document(last_id).get()
+                        if cursor.exists:
+                            query = query.start_after(cursor)
+                    docs = run_query(query.limit(page_size), EXPIRING)
+                    if not docs:
+                        break
+                    
+                    for doc in docs:
+                        committer.update(doc.reference, {"status": ActivityStatus.EXPIRED.value})
+                    committer.flush()
+                    
+                    processed += len(docs)
+                    last_id = docs[-1].id
+                    checkpoint_ref.set({"cutoff": cutoff, "last_id": last_id, "updated_at": datetime.now(timezone.utc)})
+                    
+                    if len(docs) < page_size:
+                        break
+            
+            checkpoint_ref.delete()
+            result = committer.result()
+            return {
+                "processed": processed,
+                "expired": result.count,
+                "commits": result.commits,
+                "duration_ms": round(result.duration * 1000, 1),
+                "resumed": resumed
+            }
         except Exception as e:
             raise FirestoreError(f"Failed to expire activities: {str(e)}")
     
@@ -1,30 +1,269 @@
-from typing import List, Optional
-from activity.models.message import Message
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from firebase_admin import firestore
+from activity.models.message import Message
+from database.client import get_client
+from database.query_shapes import QueryShape, register_shape
+from database.telemetry import run_query
+import config
+
+# Message storage modes, chosen with config.MESSAGE_STORAGE
+DOCUMENTS = "documents"  # messages/{message_id}, one document per message
+BUCKETS = "buckets"      # activities/{activity_id}/message_buckets/{seq}, many messages per document
+
+# Query shapes emitted by this repository (see database.indexes)
+BY_ACTIVITY = register_shape(QueryShape(
+    "messages.by_activity", "messages", equality=("activity_id",), order_by=(("created_at", "ASCENDING"),)
+))
+LATEST_BY_ACTIVITY = register_shape(QueryShape(
+    "messages.latest_by_activity", "messages", equality=("activity_id",), order_by=(("created_at", "DESCENDING"),)
+))
+BUCKETS_NEWEST_FIRST = register_shape(QueryShape(
+    "message_buckets.newest_first", "message_buckets", range="seq", optional_range=True,
+    order_by=(("seq", "DESCENDING"),)
+))
+BUCKETS_OLDEST_FIRST = register_shape(QueryShape(
+    "message_buckets.oldest_first", "message_buckets", range="seq", optional_range=True,
+    order_by=(("seq", "ASCENDING"),)
+))
+BUCKETS_BY_SENDER = register_shape(QueryShape(
+    "message_buckets.by_sender", "message_buckets", array_contains="sender_ids", collection_group=True
+))
+
+# Rough per-field overhead Firestore adds to a stored message (names, types, the array slot)
+MESSAGE_OVERHEAD_BYTES = 64
+
+
+def message_buckets(db, activity_id: str):
+    """Collection holding an activity's message buckets."""
+    return db.collection("activities").document(activity_id).collection("message_buckets")
+
+
+def bucket_id(seq: int) -> str:
+    """Document ID of a bucket; zero-padded so IDs sort like sequence numbers."""
+    return f"{seq:08d}"
+
+
+def message_bytes(data: Dict[str, Any]) -> int:
+    """Approximate stored size of a message inside a bucket."""
+    return MESSAGE_OVERHEAD_BYTES + sum(len(key) + len(str(value).encode("utf-8")) for key, value in data.items())
+
+
+def anonymize_bucket(db, bucket_ref, user_id: str, sender_id: str, sender_name: str) -> int:
+    """
+    Replace a sender on every message they left in a bucket, in a transaction
+    so messages appended concurrently are not lost. Returns the messages changed.
+    """
+    @firestore.transactional
+    def rewrite(transaction) -> int:
+        doc = bucket_ref.get(transaction=transaction)
+        if not doc.exists:
+            return 0
+        messages = doc.to_dict().get("messages", [])
+        changed = 0
+        for message in messages:
+            if message.get("sender_id") == user_id:
+                message.update(sender_id=sender_id, sender_name=sender_name, sender_profile_pic=None)
+                changed += 1
+        transaction.update(bucket_ref, {
+            "messages": messages,
+            "sender_ids": sorted({m.get("sender_id") for m in messages}),
+        })
+        return changed
+
+    return rewrite(db.transaction())
+
+
+@dataclass
+class MessagePage:
+    """
+    One page of a thread, oldest message first.
+    
+    Attributes:
+        messages: The page's messages in chronological order.
+        before: Cursor for the page of older messages, or None if there are none.
+        after: Cursor for catching up on newer messages (the newest message seen).
+    """
+    messages: List[Message]
+    before: Optional[str]
+    after: Optional[str]
+
 
 class MessageRepository:
-    """Repository for message operations."""
+    """
+    Repository for message operations.
     
-    def __init__(self):
-        self.db = firestore.client()
+    Messages are stored either one document each in the top-level messages
+    collection, or appended to per-activity bucket documents (see DOCUMENTS and
+    BUCKETS). A bucket holds up to MESSAGE_BUCKET_MAX_MESSAGES messages or
+    about MESSAGE_BUCKET_MAX_BYTES, so a chat screen loads in one or two reads.
+    """
+    
+    def __init__(self, db=None, storage: Optional[str] = None):
+        self.db = db or get_client()
         self.collection = self.db.collection('messages')
+        self.storage = storage or config.MESSAGE_STORAGE
     
     def create(self, message: Message) -> Message:
         """Create a new message."""
+        if self.storage == BUCKETS:
+            self._append(message)
+            return message
         doc_ref = self.collection.document(message.id)
         doc_ref.set(message.to_dict())
         return message
     
-    def get_by_activity(self, activity_id: str, limit: int = 50) -> List[Message]:
-        """Get messages for a specific activity, sorted by created_at asc."""
-        query = (self.collection
-                 .where("activity_id", "==", activity_id)
-                 .order_by("created_at")
-                 .limit(limit))
+    def get_by_activity(self, activity_id: str, limit: int = 50,
+                        before: Optional[str] = None, after: Optional[str] = None) -> MessagePage:
+        """
+        Get a page of an activity's messages.
+        
+        Without a cursor this is the newest `limit` messages. Cursors come from
+        earlier pages: `before` pages back through older messages, `after`
+        returns the messages sent since (oldest first, so a client catching up
+        never skips any). Either way the page is returned in chronological order.
         
-        messages = []
-        for doc in query.stream():
-            message = Message.from_dict(doc.id, doc.to_dict())
-            messages.append(message)
+        Raises:
+            ValueError: If both cursors are given or a cursor is not a message of this activity.
+        """
+        if before and after:
+            raise ValueError("Pass either before or after, not both")
+        if self.storage == BUCKETS:
+            return self._get_from_buckets(activity_id, limit, before, after)
         
-        return messages
\ No newline at end of file
+        query = self.collection.where("activity_id", "==", activity_id)
+        cursor = self._cursor(activity_id, before or after)
+        if after:
+            query = query.order_by("created_at").start_after(cursor)
+            shape = BY_ACTIVITY
+        else:
+            query = query.order_by("created_at", direction=firestore.Query.DESCENDING)
+            if cursor:
+                query = query.start_after(cursor)
+            shape = LATEST_BY_ACTIVITY
+        
+        # One extra document tells whether there is another page
+        docs = run_query(query.limit(limit + 1), shape)
+        has_more = len(docs) > limit
+        messages = [Message.from_dict(doc.id, doc.to_dict()) for doc in docs[:limit]]
+        if not after:
+            messages.reverse()
+        
+        older = messages[0].id if messages and has_more and not after else None
+        newest = messages[-1].id if messages else after
+        return MessagePage(messages, older, newest)
+    
+    def _cursor(self, activity_id: str, message_id: Optional[str]):
+        """Snapshot of the message a cursor points at, to resume the query after it."""
+        if not message_id:
+            return None
+        doc = self.collection.document(message_id).get()
+        if not doc.exists or doc.get("activity_id") != activity_id:
+            raise ValueError(f"Unknown message cursor: {message_id}")
+        return doc
+    
+    # ---- Bucketed storage ----
+    
+    def _append(self, message: Message) -> None:
+        """
+        Append a message to its activity's newest bucket, starting a new bucket
+        when that one is full. The transaction also reads the next bucket's
+        document, so two writers starting it at once conflict and one retries.
+        """
+        buckets = message_buckets(self.db, message.activity_id)
+        data = message.to_dict()
+        size = message_bytes(data)
+        
+        @firestore.transactional
+        def append(transaction) -> None:
+            newest = list(buckets.order_by("seq", direction=firestore.Query.DESCENDING)
+                                 .limit(1)
+                                 .select(["seq", "count", "bytes"])
+                                 .stream(transaction=transaction))
+            if newest:
+                head = newest[0].to_dict()
+                if (head.get("count", 0) < config.MESSAGE_BUCKET_MAX_MESSAGES
+                        and head.get("bytes", 0) + size <= config.MESSAGE_BUCKET_MAX_BYTES):
+                    transaction.update(newest[0].reference, {
+                        "messages": firestore.ArrayUnion([data]),
+                        "sender_ids": firestore.ArrayUnion([message.sender_id]),
+                        "count": firestore.Increment(1),
+                        "bytes": firestore.Increment(size),
+                        "last_at": message.created_at,
+                    })
+                    return
+                seq = head["seq"] + 1
+            else:
+                seq = 0
+            bucket_ref = buckets.document(bucket_id(seq))
+            bucket_ref.get(transaction=transaction)
+            transaction.set(bucket_ref, {
+                "activity_id": message.activity_id,
+                "seq": seq,
+                "messages": [data],
+                "sender_ids": [message.sender_id],
+                "count": 1,
+                "bytes": size,
+                "first_at": message.created_at,
+                "last_at": message.created_at,
+            })
+        
+        append(self.db.transaction())
+    
+    def _get_from_buckets(self, activity_id: str, limit: int,
+                          before: Optional[str], after: Optional[str]) -> MessagePage:
+        """
+        Page through buckets newest first (or oldest first for `after`), reading
+        one bucket at a time until the page is full. Cursors are "{seq}:{message_id}".
+        """
+        cursor_seq, cursor_id = self._bucket_cursor(before or after)
+        collected: List[Tuple[int, Dict]] = []
+        has_more = False
+        for seq, messages in self._walk_buckets(activity_id, newest_first=not after, from_seq=cursor_seq):
+            if seq == cursor_seq:
+                ids = [m.get("id") for m in messages]
+                if cursor_id not in ids:
+                    raise ValueError(f"Unknown message cursor: {before or after}")
+                position = ids.index(cursor_id)
+                messages = messages[position + 1:] if after else messages[:position]
+            if not after:
+                messages = list(reversed(messages))
+            room = limit - len(collected)
+            collected += [(seq, m) for m in messages[:room]]
+            if len(collected) == limit:
+                # Buckets are never empty, so anything left here or a lower seq means older messages
+                has_more = len(messages) > room or (not after and seq > 0)
+                break
+        if not after:
+            collected.reverse()
+        
+        messages = [Message.from_dict(m.get("id"), m) for _, m in collected]
+        older = f"{collected[0][0]}:{collected[0][1].get('id')}" if collected and has_more and not after else None
+        newest = f"{collected[-1][0]}:{collected[-1][1].get('id')}" if collected else after
+        return MessagePage(messages, older, newest)
+    
+    def _walk_buckets(self, activity_id: str, newest_first: bool,
+                      from_seq: Optional[int]) -> Iterator[Tuple[int, List[Dict]]]:
+        """Yield (seq, messages) per bucket, reading one bucket per query."""
+        direction = firestore.Query.DESCENDING if newest_first else firestore.Query.ASCENDING
+        query = message_buckets(self.db, activity_id).order_by("seq", direction=direction)
+        if from_seq is not None:
+            query = query.where("seq", "<=" if newest_first else ">=", from_seq)
+        shape = (BUCKETS_NEWEST_FIRST if newest_first else BUCKETS_OLDEST_FIRST)\
+            .variant(range_field="seq" if from_seq is not None else None)
+        while True:
+            docs = run_query(query.limit(1), shape)
+            if not docs:
+                return
+            data = docs[0].to_dict()
+            yield data["seq"], data.get("messages", [])
+            query = query.start_after(docs[0])
+    
+    @staticmethod
+    def _bucket_cursor(cursor: Optional[str]) -> Tuple[Optional[int], Optional[str]]:
+        if not cursor:
+            return None, None
+        seq, _, message_id = cursor.partition(":")
+        if not seq.isdigit() or not message_id:
+            raise ValueError(f"Unknown message cursor: {cursor}")
+        return int(seq), message_id
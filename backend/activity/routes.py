@@ -3,28 +3,27 @@ FastAPI routes for managing activities. Includes creation,
 deletion, update, joining, and searching of activities.
 """
 
-from typing import Optional, List, Dict
-from fastapi import APIRouter, HTTPException, Depends, Body, Path, Query, File, UploadFile
+from typing import Optional, List, Dict, Iterable
+from fastapi import APIRouter, HTTPException, Depends, Body, Path, Query, File, UploadFile, Response, WebSocket
 from datetime import datetime
 
-
-
 from activity.controllers.activity_controller import ActivityController
 from activity.schemas import ActivityCreate, ActivityUpdate
-from activity.models.activity import ActivityStatus, ActivityType, SkillLevel, Location
+from activity.models.activity import Activity, ActivityStatus
 from user.services.auth_service import AuthService
 from activity.repositories.message_repository import MessageRepository
 from activity.models.message import Message
+from activity.services.chat_hub import ChatHub, chat_socket
 from user.services.alert_service import AlertService
+from user.models.alert import AlertType
 from activity.repositories.activity_repository import ActivityRepository
 from user.repositories.user_repository import UserRepository
+from container import (
+    get_activity_controller, get_activity_repository, get_alert_service, get_chat_hub,
+    get_container, get_message_repository, get_user_repository,
+)
 
 router = APIRouter()
-activity_controller = ActivityController()
-message_repository = MessageRepository()
-alert_service = AlertService()
-activity_repository = ActivityRepository()
-user_repository = UserRepository()
 
 # ================= Search & Filter =================
 @router.get("/search", summary="Search and filter activities", response_model=List[Dict])
@@ -36,6 +35,7 @@ async def search_activities(
     activityType: Optional[str] = Query(None, description="Filter by activity type (event/coaching session)"),
     status: Optional[str] = Query(None, description="Filter by activity status"),
     placeName: Optional[str] = Query(None, description="Search by place name"),
+    excludeJoined: bool = Query(False, description="Exclude activities the current user is participating in"),
     
     # Date range parameters
     dateFrom: Optional[datetime] = Query(None, description="Filter activities after this date"),
@@ -51,7 +51,8 @@ async def search_activities(
     start_after: Optional[str] = Query(None, description="Activity ID to start after for pagination"),
     
     # User authentication
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    activity_controller: ActivityController = Depends(get_activity_controller)
 ):
     """
     Search for activities with various filtering options.
@@ -62,6 +63,7 @@ async def search_activities(
     - Can search by place name
     
     If no parameters are provided, returns all available activities.
+    Results are activity summaries; fetch `/activity/{activity_id}` for the full document.
     """
     print(f"Search request received with filters: {query}, {sport}, {skillLevel}")
     # Build filters dictionary
@@ -93,6 +95,9 @@ async def search_activities(
         # If maxDistance is not specified, use a reasonable default
         filters["maxDistance"] = maxDistance if maxDistance is not None else 50.0
     
+    if excludeJoined:
+        filters["exclude_participant"] = current_user["uid"]
+    
     # Pagination parameters
     filters["limit"] = limit
     if start_after:
@@ -106,7 +111,8 @@ async def search_activities(
 @router.post("/", summary="Create a new activity", response_model=Dict)
 async def create_activity(
     data: ActivityCreate, 
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    activity_controller: ActivityController = Depends(get_activity_controller)
 ):
     """
     Creates a new activity with the given data.
@@ -117,7 +123,8 @@ async def create_activity(
 @router.get("/{activity_id}", summary="Get activity details", response_model=Dict)
 async def get_activity(
     activity_id: str = Path(..., description="The ID of the activity"),
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    activity_controller: ActivityController = Depends(get_activity_controller)
 ):
     """
     Retrieves details of a specific activity.
@@ -131,7 +138,8 @@ async def get_activity(
 async def update_activity(
     activity_id: str = Path(..., description="The ID of the activity to update"),
     data: ActivityUpdate = Body(...),
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    activity_controller: ActivityController = Depends(get_activity_controller)
 ):
     """
     Updates the specified activity if the current user is the creator.
@@ -145,7 +153,8 @@ async def update_activity(
 @router.delete("/{activity_id}", summary="Delete an activity", response_model=Dict)
 async def delete_activity(
     activity_id: str = Path(..., description="The ID of the activity to delete"),
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    activity_controller: ActivityController = Depends(get_activity_controller)
 ):
     """
     Deletes the specified activity if the current user is the creator.
@@ -155,7 +164,8 @@ async def delete_activity(
 @router.post("/{activity_id}/cancel", summary="Cancel an activity", response_model=Dict)
 async def cancel_activity(
     activity_id: str = Path(..., description="The ID of the activity to cancel"),
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    activity_controller: ActivityController = Depends(get_activity_controller)
 ):
     """
     Cancels the specified activity if the current user is the creator.
@@ -165,7 +175,8 @@ async def cancel_activity(
 @router.post("/upload-banner", summary="Upload banner image")
 async def upload_banner_image(
     file: UploadFile = File(...),
-    current_user: Dict = Depends(AuthService.get_current_user)
+    current_user: Dict = Depends(AuthService.get_current_user),
+    activity_controller: ActivityController = Depends(get_activity_controller)
 ):
     """
     Upload an activity banner image to Cloudinary and return the URL.
@@ -184,7 +195,8 @@ async def upload_banner_image(
 @router.post("/{activity_id}/join", summary="Send join request", response_model=Dict)
 async def join_activity(
     activity_id: str = Path(..., description="The ID of the activity to join"),
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    activity_controller: ActivityController = Depends(get_activity_controller)
 ):
     """
     Sends a join request to an activity.
@@ -194,7 +206,8 @@ async def join_activity(
 @router.post("/{activity_id}/cancel-request", summary="Cancel a join request", response_model=Dict)
 async def cancel_join_request(
     activity_id: str = Path(..., description="The ID of the activity"),
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    activity_controller: ActivityController = Depends(get_activity_controller)
 ):
     """
     Cancels a pending join request made by the current user.
@@ -205,7 +218,8 @@ async def cancel_join_request(
 async def approve_join(
     activity_id: str = Path(..., description="The ID of the activity"),
     user_id: str = Path(..., description="The ID of the user to approve"),
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    activity_controller: ActivityController = Depends(get_activity_controller)
 ):
     """
     Approves a pending join request.
@@ -216,7 +230,8 @@ async def approve_join(
 async def reject_join(
     activity_id: str = Path(..., description="The ID of the activity"),
     user_id: str = Path(..., description="The ID of the user to reject"),
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    activity_controller: ActivityController = Depends(get_activity_controller)
 ):
     """
     Rejects a pending join request.
@@ -227,7 +242,8 @@ async def reject_join(
 async def remove_participant(
     activity_id: str = Path(..., description="The ID of the activity"),
     user_id: str = Path(..., description="The ID of the user to remove"),
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    activity_controller: ActivityController = Depends(get_activity_controller)
 ):
     """
     Removes a participant from an activity.
@@ -237,7 +253,8 @@ async def remove_participant(
 @router.post("/{activity_id}/leave", summary="Leave an activity", response_model=Dict)
 async def leave_activity(
     activity_id: str = Path(..., description="The ID of the activity to leave"),
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    activity_controller: ActivityController = Depends(get_activity_controller)
 ):
     """
     Allows the current user to leave an activity.
@@ -250,7 +267,8 @@ async def leave_activity(
 async def get_my_activities(
     limit: int = Query(50, description="Maximum number of activities to return"),
     start_after: Optional[str] = Query(None, description="Activity ID to start after for pagination"),
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    activity_controller: ActivityController = Depends(get_activity_controller)
 ):
     """
     Returns all activities created by the current user.
@@ -260,7 +278,8 @@ async def get_my_activities(
 @router.get("/{user_id}/created", summary="Get user's created activities", response_model=List[Dict])
 async def get_my_activities(
     user_id: str = Path(..., description="The user ID of the creator"),
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    activity_controller: ActivityController = Depends(get_activity_controller)
 ):
     """
     Returns all activities created by the specified user.
@@ -272,7 +291,8 @@ async def get_my_activities(
 
 @router.get("/my/participating", summary="Get activities I'm participating in", response_model=List[Dict])
 async def get_my_participations(
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    activity_controller: ActivityController = Depends(get_activity_controller)
 ):
     """
     Returns all activities in which the current user is a participant.
@@ -281,7 +301,8 @@ async def get_my_participations(
 
 @router.get("/my/requests", summary="Get my pending join requests", response_model=List[Dict])
 async def get_my_requests(
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    activity_controller: ActivityController = Depends(get_activity_controller)
 ):
     """
     Returns all activities for which the current user has pending join requests.
@@ -290,7 +311,8 @@ async def get_my_requests(
 
 @router.get("/my/pending-approvals", summary="Get activities with pending approval requests", response_model=List[Dict])
 async def get_my_pending_approvals(
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    activity_controller: ActivityController = Depends(get_activity_controller)
 ):
     """
     Returns all activities created by the user that have pending join requests.
@@ -305,7 +327,12 @@ async def get_my_pending_approvals(
 async def send_message(
     activity_id: str,
     content: str = Body(..., embed=True),
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    message_repository: MessageRepository = Depends(get_message_repository),
+    alert_service: AlertService = Depends(get_alert_service),
+    activity_repository: ActivityRepository = Depends(get_activity_repository),
+    user_repository: UserRepository = Depends(get_user_repository),
+    chat_hub: ChatHub = Depends(get_chat_hub)
 ):
     """
     Send a message to an activity's thread.
@@ -323,53 +350,76 @@ async def send_message(
             detail="Only participants or the creator can send messages"
         )
     
-    # Get user info
-    user = user_repository.get_by_id(user_id)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    # Create new message
-    sender_name = f"{user.first_name} {user.last_name}"
-    message = Message(
-        activity_id=activity_id,
-        sender_id=user_id,
-        sender_name=sender_name,
-        sender_profile_pic=user.profile_pic_url,
-        content=content
-    )
-    
-    # Save message
-    message = message_repository.create(message)
+    message = _post_message(activity, activity.participants + [activity.creator_id], user_id, content,
+                            message_repository, alert_service, user_repository, chat_hub)
+    return message.to_dict()
+
+@router.websocket("/{activity_id}/messages/ws")
+async def message_socket(websocket: WebSocket, activity_id: str, token: Optional[str] = Query(None)):
+    """
+    Live thread: pushes new messages to every connected member and accepts sends.
     
-    # Send alert to all participants except sender
-    recipients = activity.participants.copy()
-    if activity.creator_id != user_id:
-        recipients.append(activity.creator_id)
+    Authenticate with `?token=<ID token>` (browsers can't set headers on a
+    socket) or an Authorization header. Membership is checked once, on connect;
+    the socket is closed when its user leaves or is removed, or the activity
+    is cancelled or deleted. Send {"content": "..."}; receive {"type": "message", "data": message} for
+    every new message (including your own), {"type": "error", "data": {"detail"}}
+    for a rejected send, and {"type": "resync"} if you fell behind and should
+    fetch /messages with the `after` cursor. Close codes 4401, 4403, 4404 and
+    4410 mean unauthenticated, not a member, no such activity and cancelled.
+    """
+    await websocket.accept()
+    container = get_container(websocket)
+    authorization = websocket.headers.get("authorization", "")
+    token = token or (authorization[7:] if authorization.lower().startswith("bearer ") else None)
+    try:
+        user_id = AuthService.verify_id_token(token)["uid"] if token else None
+    except Exception:
+        user_id = None
+    if not user_id:
+        await websocket.close(code=4401, reason="Invalid authentication token")
+        return
     
-    # Remove sender from recipients
-    if user_id in recipients:
-        recipients.remove(user_id)
+    activity = container.activity_repository.get_by_id(activity_id)
+    if not activity:
+        await websocket.close(code=4404, reason="Activity not found")
+        return
+    if user_id != activity.creator_id and user_id not in activity.participants:
+        await websocket.close(code=4403, reason="Only participants or the creator can view messages")
+        return
+    if activity.status == ActivityStatus.CANCELLED:
+        await websocket.close(code=4410, reason="Activity cancelled")
+        return
     
-    # Create alerts
-    for recipient_id in recipients:
-        alert_service.create_new_message_alert(
-            user_id=recipient_id,
-            sender_id=user_id,
-            activity_id=activity_id,
-            activity_name=activity.activityName,
-            message_preview=content[:50] + ('...' if len(content) > 50 else '')
-        )
+    def post(content: str) -> Message:
+        # Members are kept current by the hub (see chat_hub), so sends need no permission read
+        members = container.chat_hub.members(activity_id)
+        if user_id not in members:
+            raise HTTPException(status_code=403, detail="Only participants or the creator can send messages")
+        return _post_message(activity, members, user_id, content, container.message_repository,
+                             container.alert_service, container.user_repository, container.chat_hub)
     
-    return message.to_dict()
+    connection = container.chat_hub.connect(activity_id, user_id, activity.participants + [activity.creator_id])
+    await chat_socket(websocket, connection, container.chat_hub, post)
 
 @router.get("/{activity_id}/messages", summary="Get activity thread messages")
 async def get_messages(
     activity_id: str,
-    limit: int = Query(50, description="Maximum number of messages to return"),
-    current_user: dict = Depends(AuthService.get_current_user)
+    response: Response,
+    limit: int = Query(50, ge=1, le=200, description="Maximum number of messages to return"),
+    before: Optional[str] = Query(None, description="Cursor: only messages older than this one"),
+    after: Optional[str] = Query(None, description="Cursor: only messages newer than this one"),
+    current_user: dict = Depends(AuthService.get_current_user),
+    message_repository: MessageRepository = Depends(get_message_repository),
+    activity_repository: ActivityRepository = Depends(get_activity_repository)
 ):
     """
-    Get messages for an activity's thread.
+    Get messages for an activity's thread, oldest first.
+    
+    Returns the newest `limit` messages. The X-Before-Cursor header (absent once
+    the start of the thread is reached) is passed as `before` to load older
+    messages; X-After-Cursor is passed as `after` to fetch only messages sent
+    since this response.
     """
     # Get activity to check if user is a participant
     activity = activity_repository.get_by_id(activity_id)
@@ -385,15 +435,57 @@ async def get_messages(
         )
     
     # Get messages
-    messages = message_repository.get_by_activity(activity_id, limit=limit)
+    try:
+        page = message_repository.get_by_activity(activity_id, limit=limit, before=before, after=after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if page.before:
+        response.headers["X-Before-Cursor"] = page.before
+    if page.after:
+        response.headers["X-After-Cursor"] = page.after
+    return [message.to_dict() for message in page.messages]
+
+def _post_message(activity: Activity, members: Iterable[str], user_id: str, content: str,
+                  message_repository: MessageRepository, alert_service: AlertService,
+                  user_repository: UserRepository, chat_hub: ChatHub) -> Message:
+    """Store a message from a member, push it to open sockets and alert the other members."""
+    # Get user info
+    user = user_repository.get_by_id(user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
     
-    return [message.to_dict() for message in messages]
+    # Create new message
+    sender_name = f"{user.first_name} {user.last_name}"
+    message = Message(
+        activity_id=activity.id,
+        sender_id=user_id,
+        sender_name=sender_name,
+        sender_profile_pic=user.profile_pic_url,
+        content=content
+    )
+    
+    # Save message and push it to the thread's sockets
+    message = message_repository.create(message)
+    chat_hub.publish(activity.id, message.to_dict())
+    
+    # Send alert to all participants and the creator, except the sender
+    alert_service.fan_out(
+        AlertType.NEW_MESSAGE,
+        members,
+        sender_id=user_id,
+        activity_id=activity.id,
+        activity_name=activity.activityName,
+        data={"message_preview": content[:50] + ('...' if len(content) > 50 else '')}
+    )
+    return message
 
 # ============== Admin Operations ==============
 
 # @router.post("/admin/expire", summary="Run activity expiration job", response_model=Dict)
 # async def expire_activities(
-#     current_user: dict = Depends(AuthService.get_admin_user)  # Assumes admin middleware
+#     current_user: dict = Depends(AuthService.get_admin_user),  # Assumes admin middleware
+#     activity_controller: ActivityController = Depends(get_activity_controller)
 # ):
 #     """
 #     Administrative endpoint to expire activities with dates in the past.
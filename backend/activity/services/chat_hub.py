@@ -0,0 +1,378 @@
+"""
+In-process fan-out of new thread messages to WS /activity/{id}/messages/ws.
+
+Messages posted on this worker (over the socket or POST /messages) are
+published to the hub as soon as they are stored. On the Firestore backend a
+ThreadSnapshotBridge also listens to the messages of every activity with a
+socket open on this worker, so messages posted through other replicas reach
+the sockets too.
+
+The hub also keeps the members of every thread with an open socket, read
+once on connect and updated as they change (by ActivityController on this
+worker, and by the bridge's listener on the activity for other replicas), so
+sends need no permission read and sockets of users who stop being members
+are closed.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+
+import config
+from activity.models.activity import ActivityStatus
+from activity.models.message import Message
+from activity.repositories.message_repository import BUCKETS, message_buckets
+from database.query_shapes import QueryShape, register_shape, ASCENDING, DESCENDING
+
+# Query the bridge listens to (see database.indexes)
+THREAD_STREAM = register_shape(QueryShape(
+    "messages.stream", "messages",
+    equality=("activity_id",), range="created_at",
+    order_by=(("created_at", ASCENDING),)
+))
+
+logger = logging.getLogger(__name__)
+
+# Event kinds sent to clients
+MESSAGE = "message"  # data: the message
+ERROR = "error"      # data: {"detail": ...}, for a send that was rejected
+RESYNC = "resync"    # sent when a client fell behind; it should refetch with the `after` cursor
+CLOSED = "closed"    # internal: end the session; data: (close code, reason) to send, or None if the client left
+
+# Close codes sent when a thread changes under an open socket
+NOT_A_MEMBER = 4403
+ACTIVITY_GONE = 4404
+ACTIVITY_CANCELLED = 4410
+
+
+@dataclass
+class ChatEvent:
+    kind: str
+    data: Any = None
+
+
+class ChatConnection:
+    """One open socket: a bounded queue of events on the event loop serving it."""
+
+    def __init__(self, activity_id: str, user_id: str, maxsize: int):
+        self.activity_id = activity_id
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+        self.closed = False
+
+    def deliver(self, event: ChatEvent) -> None:
+        """Queue an event; must run on the connection's loop."""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Drop everything queued and tell the client to refetch instead
+            self.overflowed = True
+
+    def close(self, code: Optional[int] = None, reason: str = "") -> None:
+        """Wake the sender to end the session, closing the socket with `code` if given; must run on the connection's loop."""
+        self.closed = True
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(ChatEvent(CLOSED, (code, reason) if code else None))
+
+    async def next(self, timeout: float) -> Optional[ChatEvent]:
+        """Wait up to `timeout` seconds for the next event."""
+        if self.closed and self.overflowed:
+            return ChatEvent(CLOSED)
+        if self.overflowed:
+            self.overflowed = False
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            return ChatEvent(RESYNC)
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class ChatHub:
+    """
+    Routes new messages to the sockets open on their activity's thread.
+
+    publish() and the membership methods may be called from any thread
+    (request threads, snapshot listeners); events are handed to each
+    connection's event loop. Nothing is kept for threads with no open socket.
+    """
+
+    def __init__(self, queue_size: Optional[int] = None):
+        self.queue_size = queue_size or config.CHAT_SOCKET_QUEUE_SIZE
+        self.bridge: Optional["ThreadSnapshotBridge"] = None
+        self._connections: Dict[str, Set[ChatConnection]] = {}
+        self._members: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def connect(self, activity_id: str, user_id: str, members: Iterable[str]) -> ChatConnection:
+        """
+        Register a socket on a thread; call from the event loop serving it.
+        `members` (creator and participants) was read just before, so it
+        replaces what the hub knew about the thread.
+        """
+        connection = ChatConnection(activity_id, user_id, self.queue_size)
+        with self._lock:
+            first = activity_id not in self._connections
+            self._connections.setdefault(activity_id, set()).add(connection)
+            self._members[activity_id] = set(members)
+        if first and self.bridge:
+            self.bridge.watch(activity_id)
+        return connection
+
+    def disconnect(self, connection: ChatConnection) -> None:
+        with self._lock:
+            connections = self._connections.get(connection.activity_id, set())
+            connections.discard(connection)
+            last = not connections
+            if last:
+                self._connections.pop(connection.activity_id, None)
+                self._members.pop(connection.activity_id, None)
+        if last and self.bridge:
+            self.bridge.unwatch(connection.activity_id)
+
+    def publish(self, activity_id: str, message: Dict) -> None:
+        """Send a new message to every socket open on its thread. Thread-safe."""
+        with self._lock:
+            connections = list(self._connections.get(activity_id, ()))
+        if not connections:
+            return
+        self.published += 1
+        event = ChatEvent(MESSAGE, jsonable_encoder(message))
+        for connection in connections:
+            try:
+                connection.loop.call_soon_threadsafe(connection.deliver, event)
+            except RuntimeError:
+                # The socket's loop has closed; it will disconnect itself
+                pass
+
+    def members(self, activity_id: str) -> Set[str]:
+        """Current members of a thread with an open socket (empty if none is open)."""
+        with self._lock:
+            return set(self._members.get(activity_id, ()))
+
+    def add_member(self, activity_id: str, user_id: str) -> None:
+        with self._lock:
+            if activity_id in self._members:
+                self._members[activity_id].add(user_id)
+
+    def remove_member(self, activity_id: str, user_id: str) -> None:
+        """Drop a user from a thread and close their sockets on it."""
+        self.set_members(activity_id, self.members(activity_id) - {user_id})
+
+    def set_members(self, activity_id: str, members: Iterable[str]) -> None:
+        """Record a thread's members; sockets of users no longer among them are closed."""
+        members = set(members)
+        with self._lock:
+            if activity_id not in self._connections:
+                return
+            self._members[activity_id] = members
+            revoked = [c for c in self._connections[activity_id] if c.user_id not in members]
+        self._close(revoked, NOT_A_MEMBER, "No longer a member of this activity")
+
+    def close_thread(self, activity_id: str, code: int, reason: str) -> None:
+        """Close every socket on a thread, e.g. once its activity is cancelled or deleted."""
+        with self._lock:
+            connections = list(self._connections.get(activity_id, ()))
+        self._close(connections, code, reason)
+
+    @staticmethod
+    def _close(connections: Iterable[ChatConnection], code: int, reason: str) -> None:
+        for connection in connections:
+            try:
+                connection.loop.call_soon_threadsafe(connection.close, code, reason)
+            except RuntimeError:
+                # The socket's loop has closed; it will disconnect itself
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "threads": len(self._connections),
+                "connections": sum(len(c) for c in self._connections.values()),
+                "published": self.published,
+                "watched": self.bridge.watched() if self.bridge else 0,
+            }
+
+    def close(self) -> None:
+        if self.bridge:
+            self.bridge.close()
+
+
+class ThreadSnapshotBridge:
+    """
+    Forwards changes made through other replicas to the local hub.
+
+    While a thread has a socket open on this worker, one snapshot listener
+    runs on its messages created since, or with bucketed storage on its newest
+    bucket, and one on its activity document to follow membership. Messages
+    posted on this worker arrive both ways; sockets drop the duplicate.
+    """
+
+    def __init__(self, db, hub: ChatHub, storage: Optional[str] = None):
+        self.db = db
+        self.hub = hub
+        self.storage = storage or config.MESSAGE_STORAGE
+        self._watches: Dict[str, List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def watch(self, activity_id: str) -> None:
+        with self._lock:
+            if activity_id in self._watches:
+                return
+            if self.storage == BUCKETS:
+                query = message_buckets(self.db, activity_id).order_by("seq", direction=DESCENDING).limit(1)
+                messages = query.on_snapshot(self._on_bucket(activity_id))
+            else:
+                query = self.db.collection("messages")\
+                               .where("activity_id", "==", activity_id)\
+                               .where("created_at", ">=", datetime.now(timezone.utc))\
+                               .order_by("created_at")
+                messages = query.on_snapshot(self._on_messages(activity_id))
+            activity = self.db.collection("activities").document(activity_id).on_snapshot(self._on_activity(activity_id))
+            self._watches[activity_id] = [messages, activity]
+
+    def unwatch(self, activity_id: str) -> None:
+        with self._lock:
+            watches = self._watches.pop(activity_id, [])
+        for watch in watches:
+            watch.unsubscribe()
+
+    def watched(self) -> int:
+        with self._lock:
+            return len(self._watches)
+
+    def close(self) -> None:
+        with self._lock:
+            activities = list(self._watches)
+        for activity_id in activities:
+            self.unwatch(activity_id)
+
+    def _on_messages(self, activity_id: str) -> Callable:
+        def callback(snapshots, changes, read_time) -> None:
+            for change in changes:
+                if change.type.name == "ADDED":
+                    doc = change.document
+                    self.hub.publish(activity_id, Message.from_dict(doc.id, doc.to_dict()).to_dict())
+        return callback
+
+    def _on_activity(self, activity_id: str) -> Callable:
+        def callback(snapshots, changes, read_time) -> None:
+            for snapshot in snapshots:
+                data = snapshot.to_dict() if snapshot.exists else None
+                if data is None:
+                    self.hub.close_thread(activity_id, ACTIVITY_GONE, "Activity not found")
+                elif data.get("status") == ActivityStatus.CANCELLED.value:
+                    self.hub.close_thread(activity_id, ACTIVITY_CANCELLED, "Activity cancelled")
+                else:
+                    self.hub.set_members(activity_id, [data.get("creator_id")] + (data.get("participants") or []))
+        return callback
+
+    def _on_bucket(self, activity_id: str) -> Callable:
+        # Messages of the newest bucket already seen; the first snapshot only records them
+        seen: Dict[str, Any] = {"seq": None, "ids": None}
+
+        def callback(snapshots, changes, read_time) -> None:
+            for snapshot in snapshots:
+                bucket = snapshot.to_dict() or {}
+                messages = bucket.get("messages", [])
+                if seen["ids"] is not None:
+                    known = seen["ids"] if bucket.get("seq") == seen["seq"] else set()
+                    for data in messages:
+                        if data.get("id") not in known:
+                            self.hub.publish(activity_id, Message.from_dict(data.get("id"), data).to_dict())
+                seen["seq"], seen["ids"] = bucket.get("seq"), {m.get("id") for m in messages}
+            if seen["ids"] is None:
+                seen["ids"] = set()
+        return callback
+
+
+async def chat_socket(websocket: WebSocket, connection: ChatConnection, hub: ChatHub,
+                      post: Callable[[str], Any]) -> None:
+    """
+    Serve an accepted, authorized socket until the client leaves.
+
+    Client frames are JSON {"content": "..."}; each is stored and published
+    with `post` (called in a worker thread), so the sender receives its own
+    message like everyone else. Server frames are JSON {"type", "data"} events.
+    The hub closes the socket when its user stops being a member; it is also
+    closed after CHAT_SOCKET_MAX_SECONDS so the client reconnects and its
+    membership is read again, in case a change was missed.
+    """
+    sent_ids: "OrderedDict[str, None]" = OrderedDict()
+    deadline = time.monotonic() + config.CHAT_SOCKET_MAX_SECONDS
+    receiver = asyncio.create_task(_receive(websocket, connection, post))
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                await websocket.close(code=1000, reason="Session expired, reconnect")
+                break
+            event = await connection.next(remaining)
+            if event is None:
+                continue
+            if event.kind == CLOSED:
+                if event.data:
+                    await websocket.close(code=event.data[0], reason=event.data[1])
+                break
+            if event.kind == MESSAGE:
+                if event.data["id"] in sent_ids:
+                    continue
+                sent_ids[event.data["id"]] = None
+                if len(sent_ids) > config.CHAT_SOCKET_QUEUE_SIZE:
+                    sent_ids.popitem(last=False)
+            await websocket.send_json({"type": event.kind, "data": event.data})
+    except (WebSocketDisconnect, RuntimeError):
+        # The client went away mid-send
+        pass
+    finally:
+        receiver.cancel()
+        hub.disconnect(connection)
+
+
+async def _receive(websocket: WebSocket, connection: ChatConnection, post: Callable[[str], Any]) -> None:
+    """
+    Post each message the client sends; rejections are queued back to it as
+    error events. A 403 or 404 (no longer a member, activity gone) also ends
+    the session, with close code 4403 or 4404.
+    """
+    end = (None, "")
+    try:
+        while True:
+            try:
+                frame = json.loads(await websocket.receive_text())
+            except ValueError:
+                frame = None
+            content = frame.get("content") if isinstance(frame, dict) else None
+            if not isinstance(content, str) or not content.strip():
+                connection.deliver(ChatEvent(ERROR, {"detail": "Message content is required"}))
+                continue
+            try:
+                await asyncio.to_thread(post, content)
+            except HTTPException as e:
+                connection.deliver(ChatEvent(ERROR, {"detail": e.detail}))
+                if e.status_code in (403, 404):
+                    end = (4000 + e.status_code, e.detail)
+                    return
+            except Exception:
+                logger.exception("Error posting message to %s", connection.activity_id)
+                connection.deliver(ChatEvent(ERROR, {"detail": "Failed to send message"}))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        connection.close(*end)
@@ -0,0 +1,122 @@
+"""
+Runtime configuration for the backend, read from environment variables (and .env).
+"""
+
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ================= Alert write coalescing =================
+# Firestore batched writes are capped at 500 operations
+ALERT_BATCH_MAX_WRITES = int(os.getenv("ALERT_BATCH_MAX_WRITES", "500"))
+# Seconds to wait for more alerts before committing a partial batch
+ALERT_BATCH_FLUSH_INTERVAL = float(os.getenv("ALERT_BATCH_FLUSH_INTERVAL", "0.05"))
+# Queued alert writes before callers block (backpressure)
+ALERT_BATCH_MAX_PENDING = int(os.getenv("ALERT_BATCH_MAX_PENDING", "5000"))
+
+# ================= Backends =================
+# "firestore" for the real database, "memory" for the in-process stand-in (offline tests/benchmarks)
+DATA_BACKEND = os.getenv("DATA_BACKEND", "firestore").lower()
+# "firebase" verifies ID tokens with Firebase Auth; "stub" accepts "<uid>" or "<uid>:<email>" as the token,
+# and is only allowed together with the memory data backend
+AUTH_BACKEND = os.getenv("AUTH_BACKEND", "firebase").lower()
+if AUTH_BACKEND == "stub" and DATA_BACKEND != "memory":
+    raise RuntimeError(f"AUTH_BACKEND=stub requires DATA_BACKEND=memory (got DATA_BACKEND={DATA_BACKEND})")
+FIREBASE_CREDENTIALS_PATH = os.getenv("FIREBASE_CREDENTIALS_PATH", "./firebase_credentials.json")
+# Comma-separated user IDs allowed on the operator endpoints under /utils (jobs, stats); users
+# with an "admin" custom claim on their Firebase token are allowed too
+ADMIN_UIDS = {uid.strip() for uid in os.getenv("ADMIN_UIDS", "").split(",") if uid.strip()}
+
+# ================= Start-up =================
+# Backoff between retries of a failed start-up warm-up task (seconds, doubled up to the max)
+STARTUP_RETRY_BASE_SECONDS = float(os.getenv("STARTUP_RETRY_BASE_SECONDS", "1"))
+STARTUP_RETRY_MAX_SECONDS = float(os.getenv("STARTUP_RETRY_MAX_SECONDS", "60"))
+
+# ================= Query telemetry =================
+# Queries slower than this are logged with their shape
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+
+# ================= Bulk writes =================
+# Writes per batch commit (Firestore caps batches at 500)
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "500"))
+# Batch commits allowed in flight at once
+BULK_PARALLELISM = int(os.getenv("BULK_PARALLELISM", "4"))
+
+# ================= Background scheduler =================
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "true").lower() == "true"
+# Random spread applied to each job interval, as a fraction of it
+SCHEDULER_JITTER = float(os.getenv("SCHEDULER_JITTER", "0.1"))
+# Run history kept in memory per job
+SCHEDULER_HISTORY_SIZE = int(os.getenv("SCHEDULER_HISTORY_SIZE", "50"))
+EXPIRE_JOB_INTERVAL_SECONDS = float(os.getenv("EXPIRE_JOB_INTERVAL_SECONDS", "300"))
+ALERT_COUNTER_RECONCILE_INTERVAL_SECONDS = float(os.getenv("ALERT_COUNTER_RECONCILE_INTERVAL_SECONDS", "3600"))
+
+# ================= Cascade deletion =================
+# Background threads running account/activity clean-up jobs
+CASCADE_WORKERS = int(os.getenv("CASCADE_WORKERS", "2"))
+# A running job with no progress for this long is assumed abandoned and resumed
+CASCADE_STALE_SECONDS = float(os.getenv("CASCADE_STALE_SECONDS", "300"))
+CASCADE_RESUME_INTERVAL_SECONDS = float(os.getenv("CASCADE_RESUME_INTERVAL_SECONDS", "120"))
+
+# ================= Profile cache =================
+# User profiles kept per worker (least recently used are evicted first)
+PROFILE_CACHE_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", "10000"))
+# Seconds a cached profile is served before it is re-read; bounds staleness across workers
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv("PROFILE_CACHE_TTL_SECONDS", "60"))
+
+# ================= Alert retention =================
+# Days an alert is kept after it is read, and while it stays unread, before
+# Firestore TTL deletes it (per-type overrides live in user.repositories.alert_repository)
+ALERT_RETENTION_READ_DAYS = int(os.getenv("ALERT_RETENTION_READ_DAYS", "30"))
+ALERT_RETENTION_UNREAD_DAYS = int(os.getenv("ALERT_RETENTION_UNREAD_DAYS", "180"))
+# Read alerts kept per user by compaction, newest first
+ALERT_MAX_READ_PER_USER = int(os.getenv("ALERT_MAX_READ_PER_USER", "100"))
+ALERT_COMPACTION_INTERVAL_SECONDS = float(os.getenv("ALERT_COMPACTION_INTERVAL_SECONDS", "86400"))
+
+# ================= Alert storage =================
+# Where alert documents live: "collection" (top-level alerts, filtered by user_id)
+# or "user_subcollections" (users/{uid}/alerts). Move existing alerts with
+# `python -m scripts.migrate_alert_layout` before switching.
+ALERT_STORAGE_LAYOUT = os.getenv("ALERT_STORAGE_LAYOUT", "collection")
+
+# ================= Alert stream =================
+# Seconds between keep-alive comments on an idle /user/alerts/stream connection
+ALERT_STREAM_HEARTBEAT_SECONDS = float(os.getenv("ALERT_STREAM_HEARTBEAT_SECONDS", "15"))
+# A stream is closed after this long so clients reconnect (and rebalance across replicas)
+ALERT_STREAM_MAX_SECONDS = float(os.getenv("ALERT_STREAM_MAX_SECONDS", "600"))
+# Reconnect delay suggested to clients
+ALERT_STREAM_RETRY_MS = int(os.getenv("ALERT_STREAM_RETRY_MS", "3000"))
+# Events buffered per connection; a client that falls further behind is told to resync
+ALERT_STREAM_QUEUE_SIZE = int(os.getenv("ALERT_STREAM_QUEUE_SIZE", "100"))
+# Forward changes made by other replicas with Firestore snapshot listeners (Firestore backend only)
+ALERT_STREAM_BRIDGE = os.getenv("ALERT_STREAM_BRIDGE", "true").lower() == "true"
+
+# ================= Alert outbox =================
+# Threads delivering outbox events right after the request that recorded them
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+# Seconds a worker holds an event; if it dies, the event is delivered again after this
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "60"))
+# Retry delay doubles from the base up to the max; the event is marked failed after the last attempt
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "5"))
+OUTBOX_RETRY_MAX_SECONDS = float(os.getenv("OUTBOX_RETRY_MAX_SECONDS", "600"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_DRAIN_INTERVAL_SECONDS = float(os.getenv("OUTBOX_DRAIN_INTERVAL_SECONDS", "30"))
+
+# ================= Activity chat =================
+# A chat socket is closed after this long so the client reconnects and its membership is re-checked
+CHAT_SOCKET_MAX_SECONDS = float(os.getenv("CHAT_SOCKET_MAX_SECONDS", "3600"))
+# Events buffered per socket; a client that falls further behind is told to resync
+CHAT_SOCKET_QUEUE_SIZE = int(os.getenv("CHAT_SOCKET_QUEUE_SIZE", "100"))
+# Forward messages posted through other replicas with Firestore snapshot listeners (Firestore backend only)
+CHAT_BRIDGE = os.getenv("CHAT_BRIDGE", "true").lower() == "true"
+
+# ================= Message storage =================
+# "documents" stores each message as its own document; "buckets" appends messages
+# to per-activity bucket documents so a chat screen loads in one or two reads.
+# Messages are not moved when this changes.
+MESSAGE_STORAGE = os.getenv("MESSAGE_STORAGE", "documents")
+# A new bucket is started once the newest one holds this many messages or bytes
+# (Firestore documents are capped at 1 MiB)
+MESSAGE_BUCKET_MAX_MESSAGES = int(os.getenv("MESSAGE_BUCKET_MAX_MESSAGES", "200"))
+MESSAGE_BUCKET_MAX_BYTES = int(os.getenv("MESSAGE_BUCKET_MAX_BYTES", "500000"))
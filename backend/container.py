@@ -0,0 +1,108 @@
+"""
+Application-wide dependency container.
+
+Built once in the app lifespan and stored on app.state, so every request
+shares one Firestore client and one instance of each repository, service
+and controller (and therefore their caches and coalescers). Routes receive
+them through the get_* providers below with FastAPI's Depends.
+"""
+
+from fastapi import Request
+
+import config
+from database.client import get_client
+from activity.controllers.activity_controller import ActivityController
+from activity.repositories.activity_repository import ActivityRepository
+from activity.repositories.message_repository import MessageRepository
+from activity.services.chat_hub import ChatHub, ThreadSnapshotBridge
+from user.controllers.user_controller import UserController
+from user.repositories.alert_repository import AlertRepository
+from user.repositories.user_repository import UserRepository
+from user.services.alert_service import AlertService
+from user.services.alert_events import AlertEventBus, AlertSnapshotBridge
+from user.services.image_service import ImageService, configure_cloudinary
+from jobs.cascade import CascadeDeleter
+from jobs.outbox import AlertOutbox
+
+
+class Container:
+    """Owns the shared client and the single instance of each service."""
+
+    def __init__(self, db=None):
+        self.db = db or get_client()
+        configure_cloudinary()
+
+        # Alert events for streaming clients; other replicas' changes arrive through Firestore listeners
+        self.alert_events = AlertEventBus()
+        if config.ALERT_STREAM_BRIDGE and config.DATA_BACKEND == "firestore":
+            self.alert_events.bridge = AlertSnapshotBridge(self.db, self.alert_events)
+        # New thread messages for chat sockets, bridged across replicas the same way
+        self.chat_hub = ChatHub()
+        if config.CHAT_BRIDGE and config.DATA_BACKEND == "firestore":
+            self.chat_hub.bridge = ThreadSnapshotBridge(self.db, self.chat_hub)
+
+        # Repositories
+        self.user_repository = UserRepository(self.db)
+        self.alert_repository = AlertRepository(self.db, events=self.alert_events)
+        self.activity_repository = ActivityRepository(self.db)
+        self.message_repository = MessageRepository(self.db)
+
+        # Services
+        self.image_service = ImageService()
+        self.cascade = CascadeDeleter(self.db)
+        self.alert_service = AlertService(self.alert_repository, self.user_repository)
+        self.outbox = AlertOutbox(self.db, self.alert_service)
+
+        # Controllers
+        self.user_controller = UserController(self.user_repository, self.image_service, self.cascade)
+        self.activity_controller = ActivityController(
+            self.activity_repository, self.image_service, self.alert_service, self.cascade, self.outbox,
+            self.chat_hub
+        )
+
+    def close(self) -> None:
+        """Release background resources owned by the container."""
+        self.cascade.shutdown()
+        self.outbox.shutdown()
+        self.alert_events.close()
+        self.chat_hub.close()
+
+
+def get_container(request: Request) -> Container:
+    return request.app.state.container
+
+
+def get_user_repository(request: Request) -> UserRepository:
+    return get_container(request).user_repository
+
+
+def get_alert_repository(request: Request) -> AlertRepository:
+    return get_container(request).alert_repository
+
+
+def get_activity_repository(request: Request) -> ActivityRepository:
+    return get_container(request).activity_repository
+
+
+def get_message_repository(request: Request) -> MessageRepository:
+    return get_container(request).message_repository
+
+
+def get_alert_events(request: Request) -> AlertEventBus:
+    return get_container(request).alert_events
+
+
+def get_chat_hub(request: Request) -> ChatHub:
+    return get_container(request).chat_hub
+
+
+def get_alert_service(request: Request) -> AlertService:
+    return get_container(request).alert_service
+
+
+def get_user_controller(request: Request) -> UserController:
+    return get_container(request).user_controller
+
+
+def get_activity_controller(request: Request) -> ActivityController:
+    return get_container(request).activity_controller
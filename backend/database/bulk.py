@@ -0,0 +1,161 @@
+"""
+Chunked, parallel batch commits for bulk jobs.
+"""
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, List, Optional
+
+import config
+from database.telemetry import run_query
+from utils.write_coalescer import MAX_BATCH_WRITES, PendingWrite
+
+
+@dataclass
+class BulkResult:
+    """Outcome of a bulk job."""
+    count: int
+    commits: int
+    duration: float
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "commits": self.commits, "duration_ms": round(self.duration * 1000, 1)}
+
+
+class BulkCommitter:
+    """
+    Buffers writes into batches of at most chunk_size and commits up to
+    `parallelism` batches concurrently.
+    
+    Writes are streamed in with add(); callers never hold more than
+    chunk_size * parallelism pending writes in memory. Use as a context manager,
+    or call close() to commit the remainder and collect the result.
+    """
+
+    def __init__(self, db, chunk_size: Optional[int] = None, parallelism: Optional[int] = None,
+                 on_commit: Optional[Callable[[List[PendingWrite]], None]] = None):
+        self.db = db
+        self.chunk_size = min(chunk_size or config.BULK_CHUNK_SIZE, MAX_BATCH_WRITES)
+        self.parallelism = max(1, parallelism or config.BULK_PARALLELISM)
+        self.on_commit = on_commit
+        self._executor = ThreadPoolExecutor(max_workers=self.parallelism, thread_name_prefix="bulk-commit")
+        self._buffer: List[PendingWrite] = []
+        self._in_flight: List[Future] = []
+        self._lock = threading.Lock()
+        self._count = 0
+        self._commits = 0
+        self._started = time.perf_counter()
+
+    def add(self, write: PendingWrite) -> None:
+        """Queue a write; commits a batch once chunk_size writes are buffered."""
+        self._buffer.append(write)
+        if len(self._buffer) >= self.chunk_size:
+            self._submit()
+
+    def set(self, reference, data: dict, merge: bool = False) -> None:
+        self.add(PendingWrite("set", reference, data, merge))
+
+    def update(self, reference, data: dict) -> None:
+        self.add(PendingWrite("update", reference, data))
+
+    def delete(self, reference) -> None:
+        self.add(PendingWrite("delete", reference))
+
+    def flush(self) -> None:
+        """Commit the partial batch and wait for every in-flight commit; raises the first error."""
+        if self._buffer:
+            self._submit()
+        done, _ = wait(self._in_flight)
+        self._in_flight = []
+        for future in done:
+            future.result()
+
+    def close(self) -> BulkResult:
+        """Flush and shut down the worker pool."""
+        try:
+            self.flush()
+        finally:
+            self._executor.shutdown(wait=True)
+        return self.result()
+
+    def result(self) -> BulkResult:
+        with self._lock:
+            return BulkResult(self._count, self._commits, time.perf_counter() - self._started)
+
+    def __enter__(self) -> "BulkCommitter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self._executor.shutdown(wait=True)
+
+    def _submit(self) -> None:
+        chunk, self._buffer = self._buffer, []
+        # Bound memory and concurrency: wait for a slot before submitting another batch
+        if len(self._in_flight) >= self.parallelism:
+            done, pending = wait(self._in_flight, return_when="FIRST_COMPLETED")
+            for future in done:
+                future.result()
+            self._in_flight = list(pending)
+        self._in_flight.append(self._executor.submit(self._commit, chunk))
+
+    def _commit(self, chunk: List[PendingWrite]) -> None:
+        batch = self.db.batch()
+        for write in chunk:
+            if write.op == "set":
+                batch.set(write.reference, write.data, merge=write.merge)
+            elif write.op == "update":
+                batch.update(write.reference, write.data)
+            elif write.op == "delete":
+                batch.delete(write.reference)
+            else:
+                raise ValueError(f"Unknown write operation: {write.op}")
+        batch.commit()
+        with self._lock:
+            self._count += len(chunk)
+            self._commits += 1
+        if self.on_commit:
+            self.on_commit(chunk)
+
+
+def drain_query(db, query, shape, write: Callable[[BulkCommitter, object], None],
+                chunk_size: Optional[int] = None, parallelism: Optional[int] = None,
+                on_page: Optional[Callable[[int], None]] = None, fields: Optional[List[str]] = None) -> BulkResult:
+    """
+    Apply `write` to every document matching `query` until none are left.
+    
+    Results are read a page at a time (document IDs only) and each page is
+    committed as parallel batches before the next is read. Each write must take
+    its document out of the query (delete it, or change the field it matched
+    on), so the query is re-read from the start after every page.
+    
+    Args:
+        query: Firestore query; select() and limit() are applied here.
+        shape: QueryShape the query is recorded under.
+        write: Called as write(committer, snapshot) for each matched document.
+        on_page: Called with the number of documents after each committed page.
+        fields: Fields `write` needs from each snapshot (default: IDs only).
+    
+    Returns:
+        BulkResult: documents processed, commits and duration.
+    """
+    processed = 0
+    committer = BulkCommitter(db, chunk_size=chunk_size, parallelism=parallelism)
+    page_size = committer.chunk_size * committer.parallelism
+    with committer:
+        while True:
+            docs = run_query(query.select(fields or []).limit(page_size), shape)
+            for doc in docs:
+                write(committer, doc)
+            committer.flush()
+            processed += len(docs)
+            if docs and on_page:
+                on_page(len(docs))
+            if len(docs) < page_size:
+                break
+    result = committer.result()
+    return BulkResult(processed, result.commits, result.duration)
@@ -0,0 +1,47 @@
+"""
+Selects the data backend every repository talks to.
+"""
+
+import threading
+from typing import Optional
+
+import firebase_admin
+from firebase_admin import credentials, firestore
+
+import config
+from database.memory import InMemoryClient
+
+_memory_client: Optional[InMemoryClient] = None
+_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Return the Firestore client for the configured DATA_BACKEND.
+    
+    With DATA_BACKEND=memory every caller shares one InMemoryClient, so the
+    whole API runs without network access or credentials.
+    """
+    global _memory_client
+    if config.DATA_BACKEND == "memory":
+        with _lock:
+            if _memory_client is None:
+                _memory_client = InMemoryClient()
+        return _memory_client
+    if config.DATA_BACKEND != "firestore":
+        raise ValueError(f"Unknown DATA_BACKEND: {config.DATA_BACKEND}")
+    return firestore.client()
+
+
+def uses_firebase() -> bool:
+    """Whether the Firebase Admin app must be initialized for the configured backends."""
+    return config.DATA_BACKEND == "firestore" or config.AUTH_BACKEND == "firebase"
+
+
+def init_firebase() -> None:
+    """Initialize the Firebase Admin app once, if the configured backends need it."""
+    if not uses_firebase():
+        return
+    with _lock:
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(credentials.Certificate(config.FIREBASE_CREDENTIALS_PATH))
@@ -0,0 +1,124 @@
+"""
+Generates firestore.indexes.json from the query shapes the repositories register.
+
+Usage (from the backend directory):
+    python -m database.indexes                 # writes firestore.indexes.json
+    python -m database.indexes --check         # exits non-zero if the file is stale
+    python -m database.indexes --output -      # prints to stdout
+
+Deploy the result with `firebase deploy --only firestore:indexes`, which also
+enables the TTL policies declared with register_ttl_field.
+"""
+
+import argparse
+import importlib
+import json
+import sys
+from typing import Dict, List, Tuple
+
+from database.query_shapes import ASCENDING, QUERY_SHAPES, TTL_FIELDS, QueryShape
+
+# Modules whose import registers query shapes
+REPOSITORY_MODULES = [
+    "activity.repositories.activity_repository",
+    "activity.repositories.message_repository",
+    "user.repositories.alert_repository",
+    "user.repositories.user_repository",
+    "jobs.cascade",
+    "jobs.outbox",
+    "user.services.alert_events",
+    "activity.services.chat_hub",
+]
+
+DEFAULT_OUTPUT = "firestore.indexes.json"
+
+
+def load_shapes() -> List[QueryShape]:
+    """Import every repository module and return the registered shapes."""
+    for module in REPOSITORY_MODULES:
+        importlib.import_module(module)
+    return list(QUERY_SHAPES.values())
+
+
+def build_manifest(shapes: List[QueryShape], ttl_fields: List[Tuple[str, str]] = ()) -> Dict:
+    """
+    Expand shapes into concrete variants and collect the composite indexes they need.
+    Field overrides cover what single-field indexes can't do by default: TTL fields
+    enable the policy, and fields of collection group queries get collection group
+    scope. Both keep the default single-field indexes.
+    """
+    indexes = {}
+    group_fields: Dict[Tuple[str, str], List[Dict[str, str]]] = {}
+    for declared in shapes:
+        for shape in declared.expand():
+            if not shape.requires_composite_index():
+                if shape.collection_group:
+                    for entry in single_field_indexes(shape):
+                        field_indexes = group_fields.setdefault((shape.collection, entry.pop("fieldPath")), [])
+                        if entry not in field_indexes:
+                            field_indexes.append(entry)
+                continue
+            index = {
+                "collectionGroup": shape.collection,
+                "queryScope": "COLLECTION_GROUP" if shape.collection_group else "COLLECTION",
+                "fields": shape.index_fields(),
+            }
+            indexes[json.dumps(index, sort_keys=True)] = index
+
+    ordered = sorted(indexes.values(), key=lambda i: (i["collectionGroup"], json.dumps(i["fields"])))
+    overrides = []
+    for collection, field_path in sorted(set(ttl_fields) | set(group_fields)):
+        override = {"collectionGroup": collection, "fieldPath": field_path}
+        if (collection, field_path) in ttl_fields:
+            override["ttl"] = True
+        override["indexes"] = [
+            {"order": "ASCENDING", "queryScope": "COLLECTION"},
+            {"order": "DESCENDING", "queryScope": "COLLECTION"},
+            {"arrayConfig": "CONTAINS", "queryScope": "COLLECTION"},
+        ] + sorted(group_fields.get((collection, field_path), []), key=lambda i: json.dumps(i, sort_keys=True))
+        overrides.append(override)
+    return {"indexes": ordered, "fieldOverrides": overrides}
+
+
+def single_field_indexes(shape: QueryShape) -> List[Dict[str, str]]:
+    """Collection group single-field indexes serving a shape that needs no composite index."""
+    entries = [{"fieldPath": f, "order": ASCENDING} for f in shape.equality]
+    if shape.array_contains:
+        entries.append({"fieldPath": shape.array_contains, "arrayConfig": "CONTAINS"})
+    directions = dict(shape.order_by)
+    if shape.range:
+        entries.append({"fieldPath": shape.range, "order": directions.get(shape.range, ASCENDING)})
+    entries += [{"fieldPath": f, "order": d} for f, d in shape.order_by if f != shape.range]
+    for entry in entries:
+        entry["queryScope"] = "COLLECTION_GROUP"
+    return entries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="File to write, or - for stdout")
+    parser.add_argument("--check", action="store_true", help="Fail if the output file is out of date")
+    args = parser.parse_args()
+
+    rendered = json.dumps(build_manifest(load_shapes(), TTL_FIELDS), indent=2) + "\n"
+
+    if args.check:
+        try:
+            with open(args.output, "r", encoding="utf-8") as f:
+                current = f.read()
+        except FileNotFoundError:
+            current = ""
+        if current != rendered:
+            sys.exit(f"{args.output} is out of date; run `python -m database.indexes`")
+        return
+
+    if args.output == "-":
+        sys.stdout.write(rendered)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(rendered)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
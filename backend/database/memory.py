@@ -0,0 +1,687 @@
+"""
+In-memory stand-in for the Firestore client, for offline tests and benchmarks.
+
+Implements the subset of the google-cloud-firestore API the repositories use:
+collections and subcollections, where/order_by/limit/start_after/select queries,
+count() aggregations, field transforms, batches, transactions (compatible with firestore.transactional),
+get_all and last-update-time preconditions. Data lives in a dict guarded by a
+single lock, so every write is atomic and transactions simply serialize.
+"""
+
+import copy
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1._helpers import LastUpdateOption
+
+ASCENDING = "ASCENDING"
+DESCENDING = "DESCENDING"
+
+_MISSING = object()
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _normalize(value: Any) -> Any:
+    """Store values the way Firestore returns them (timezone-aware UTC datetimes)."""
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def _type_rank(value: Any) -> int:
+    # Firestore's cross-type ordering: null < bool < number < timestamp < string < ... < array < map
+    if value is None:
+        return 0
+    if isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, datetime):
+        return 3
+    if isinstance(value, str):
+        return 4
+    if isinstance(value, bytes):
+        return 5
+    if isinstance(value, list):
+        return 8
+    if isinstance(value, dict):
+        return 9
+    return 7
+
+
+def _sort_key(value: Any) -> Tuple:
+    rank = _type_rank(value)
+    if rank == 8:
+        return (rank, tuple(_sort_key(v) for v in value))
+    if rank == 9:
+        return (rank, tuple(sorted((k, _sort_key(v)) for k, v in value.items())))
+    if rank == 7:
+        return (rank, repr(value))
+    return (rank, value)
+
+
+def _get_field(data: Dict, path: str) -> Any:
+    current: Any = data
+    for part in path.split("."):
+        if not isinstance(current, dict) or part not in current:
+            return _MISSING
+        current = current[part]
+    return current
+
+
+def _set_field(data: Dict, path: str, value: Any) -> None:
+    parts = path.split(".")
+    current = data
+    for part in parts[:-1]:
+        if not isinstance(current.get(part), dict):
+            current[part] = {}
+        current = current[part]
+    current[parts[-1]] = value
+
+
+def _delete_field(data: Dict, path: str) -> None:
+    parts = path.split(".")
+    current = data
+    for part in parts[:-1]:
+        current = current.get(part)
+        if not isinstance(current, dict):
+            return
+    current.pop(parts[-1], None)
+
+
+def _apply_value(data: Dict, path: str, value: Any, timestamp: datetime) -> None:
+    """Write one field, resolving sentinels and transforms against the current value."""
+    current = _get_field(data, path)
+    if value is transforms.DELETE_FIELD:
+        _delete_field(data, path)
+    elif value is transforms.SERVER_TIMESTAMP:
+        _set_field(data, path, timestamp)
+    elif isinstance(value, transforms.Increment):
+        base = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+        _set_field(data, path, base + value.value)
+    elif isinstance(value, transforms.Maximum):
+        base = current if isinstance(current, (int, float)) else value.value
+        _set_field(data, path, max(base, value.value))
+    elif isinstance(value, transforms.Minimum):
+        base = current if isinstance(current, (int, float)) else value.value
+        _set_field(data, path, min(base, value.value))
+    elif isinstance(value, transforms.ArrayUnion):
+        items = list(current) if isinstance(current, list) else []
+        for item in _normalize(list(value.values)):
+            if item not in items:
+                items.append(item)
+        _set_field(data, path, items)
+    elif isinstance(value, transforms.ArrayRemove):
+        removed = _normalize(list(value.values))
+        items = list(current) if isinstance(current, list) else []
+        _set_field(data, path, [item for item in items if item not in removed])
+    else:
+        _set_field(data, path, _normalize(copy.deepcopy(value)))
+
+
+def _merge(data: Dict, updates: Dict, timestamp: datetime, prefix: str = "") -> None:
+    """Deep-merge a set(..., merge=True) payload into a document."""
+    for key, value in updates.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict) and value:
+            if not isinstance(_get_field(data, path), dict):
+                _set_field(data, path, {})
+            _merge(data, value, timestamp, prefix=f"{path}.")
+        else:
+            _apply_value(data, path, value, timestamp)
+
+
+def _resolve_set(values: Dict, timestamp: datetime) -> Dict:
+    """Build a fresh document from a set() payload."""
+    data: Dict = {}
+    _merge(data, values, timestamp)
+    return data
+
+
+class _StoredDocument:
+    """Document contents plus Firestore's server-maintained metadata."""
+
+    __slots__ = ("data", "create_time", "update_time")
+
+    def __init__(self, data: Dict, create_time: datetime, update_time: datetime):
+        self.data = data
+        self.create_time = create_time
+        self.update_time = update_time
+
+
+class MemoryDocumentSnapshot:
+    """Immutable view of a document at read time."""
+
+    def __init__(self, reference: "MemoryDocumentReference", data: Optional[Dict],
+                 create_time: Optional[datetime] = None, update_time: Optional[datetime] = None,
+                 read_time: Optional[datetime] = None):
+        self.reference = reference
+        self._data = data
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = read_time or _now()
+
+    @property
+    def id(self) -> str:
+        return self.reference.id
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> Optional[Dict]:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path: str) -> Any:
+        if self._data is None:
+            return None
+        value = _get_field(self._data, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class MemoryDocumentReference:
+    """Reference to a single document path."""
+
+    def __init__(self, client: "InMemoryClient", path: Tuple[str, ...]):
+        self._client = client
+        self._path = path
+
+    @property
+    def id(self) -> str:
+        return self._path[-1]
+
+    @property
+    def path(self) -> str:
+        return "/".join(self._path)
+
+    @property
+    def parent(self) -> "MemoryCollectionReference":
+        return MemoryCollectionReference(self._client, self._path[:-1])
+
+    def collection(self, collection_id: str) -> "MemoryCollectionReference":
+        return MemoryCollectionReference(self._client, self._path + (collection_id,))
+
+    def get(self, field_paths: Optional[Iterable[str]] = None, transaction=None, **kwargs) -> MemoryDocumentSnapshot:
+        snapshot = self._client._snapshot(self)
+        if field_paths is not None and snapshot.exists:
+            snapshot = self._client._project(snapshot, list(field_paths))
+        return snapshot
+
+    def create(self, document_data: Dict, **kwargs) -> None:
+        self._client._commit([("create", self, document_data, None)])
+
+    def set(self, document_data: Dict, merge: bool = False, **kwargs) -> None:
+        self._client._commit([("set", self, document_data, merge)])
+
+    def update(self, field_updates: Dict, option=None, **kwargs) -> None:
+        self._client._commit([("update", self, field_updates, option)])
+
+    def delete(self, option=None, **kwargs) -> None:
+        self._client._commit([("delete", self, None, option)])
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, MemoryDocumentReference) and other._path == self._path
+
+    def __hash__(self) -> int:
+        return hash(self._path)
+
+    def __repr__(self) -> str:
+        return f"MemoryDocumentReference({self.path!r})"
+
+
+class MemoryQuery:
+    """Immutable query over one collection (or a collection group)."""
+
+    ASCENDING = ASCENDING
+    DESCENDING = DESCENDING
+
+    def __init__(self, client: "InMemoryClient", parent_path: Tuple[str, ...], all_descendants: bool = False,
+                 filters: Tuple = (), orders: Tuple = (), limit: Optional[int] = None,
+                 limit_to_last: bool = False, projection: Optional[List[str]] = None,
+                 start: Optional[Tuple[Any, bool]] = None, end: Optional[Tuple[Any, bool]] = None):
+        self._client = client
+        self._parent_path = parent_path
+        self._all_descendants = all_descendants
+        self._filters = filters
+        self._orders = orders
+        self._limit = limit
+        self._limit_to_last = limit_to_last
+        self._projection = projection
+        self._start = start
+        self._end = end
+
+    def _copy(self, **overrides) -> "MemoryQuery":
+        params = dict(
+            filters=self._filters, orders=self._orders, limit=self._limit,
+            limit_to_last=self._limit_to_last, projection=self._projection,
+            start=self._start, end=self._end,
+        )
+        params.update(overrides)
+        return MemoryQuery(self._client, self._parent_path, self._all_descendants, **params)
+
+    def where(self, field_path: Optional[str] = None, op_string: Optional[str] = None,
+              value: Any = None, *, filter=None) -> "MemoryQuery":
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, _normalize(value)),))
+
+    def order_by(self, field_path: str, direction: str = ASCENDING) -> "MemoryQuery":
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count: int) -> "MemoryQuery":
+        return self._copy(limit=count, limit_to_last=False)
+
+    def limit_to_last(self, count: int) -> "MemoryQuery":
+        return self._copy(limit=count, limit_to_last=True)
+
+    def select(self, field_paths: Iterable[str]) -> "MemoryQuery":
+        return self._copy(projection=list(field_paths))
+
+    def start_at(self, document_fields_or_snapshot) -> "MemoryQuery":
+        return self._copy(start=(document_fields_or_snapshot, True))
+
+    def start_after(self, document_fields_or_snapshot) -> "MemoryQuery":
+        return self._copy(start=(document_fields_or_snapshot, False))
+
+    def end_at(self, document_fields_or_snapshot) -> "MemoryQuery":
+        return self._copy(end=(document_fields_or_snapshot, True))
+
+    def end_before(self, document_fields_or_snapshot) -> "MemoryQuery":
+        return self._copy(end=(document_fields_or_snapshot, False))
+
+    def stream(self, transaction=None, **kwargs) -> Iterator[MemoryDocumentSnapshot]:
+        return iter(self._execute())
+
+    def get(self, transaction=None, **kwargs) -> List[MemoryDocumentSnapshot]:
+        return self._execute()
+
+    def count(self, alias: Optional[str] = None) -> "MemoryAggregationQuery":
+        return MemoryAggregationQuery(self, alias or "count")
+
+    # ---- evaluation ----
+
+    def _effective_orders(self) -> List[Tuple[str, str]]:
+        orders = list(self._orders)
+        if not orders:
+            # Firestore orders by the inequality field first when there is one
+            for field, op, _ in self._filters:
+                if op in ("<", "<=", ">", ">=", "!=", "not-in"):
+                    orders.append((field, ASCENDING))
+                    break
+        if not any(field == "__name__" for field, _ in orders):
+            last_direction = orders[-1][1] if orders else ASCENDING
+            orders.append(("__name__", last_direction))
+        return orders
+
+    @staticmethod
+    def _value(snapshot: MemoryDocumentSnapshot, field: str) -> Any:
+        if field == "__name__":
+            return snapshot.reference.path
+        return _get_field(snapshot._data, field)
+
+    def _matches(self, snapshot: MemoryDocumentSnapshot) -> bool:
+        for field, op, expected in self._filters:
+            actual = self._value(snapshot, field)
+            if actual is _MISSING:
+                return False
+            if op == "==":
+                if actual != expected:
+                    return False
+            elif op == "!=":
+                if actual == expected or actual is None:
+                    return False
+            elif op in ("<", "<=", ">", ">="):
+                if _type_rank(actual) != _type_rank(expected):
+                    return False
+                a, b = _sort_key(actual), _sort_key(expected)
+                if not {"<": a < b, "<=": a <= b, ">": a > b, ">=": a >= b}[op]:
+                    return False
+            elif op == "array_contains":
+                if not isinstance(actual, list) or expected not in actual:
+                    return False
+            elif op == "array_contains_any":
+                if not isinstance(actual, list) or not any(v in actual for v in expected):
+                    return False
+            elif op == "in":
+                if actual not in expected:
+                    return False
+            elif op == "not-in":
+                if actual in expected or actual is None:
+                    return False
+            else:
+                raise ValueError(f"Unsupported operator: {op}")
+        return True
+
+    def _cursor_values(self, cursor: Any, orders: List[Tuple[str, str]]) -> List[Any]:
+        if isinstance(cursor, MemoryDocumentSnapshot):
+            return [self._value(cursor, field) for field, _ in orders]
+        if isinstance(cursor, dict):
+            values = [cursor[field] for field, _ in orders if field in cursor]
+        else:
+            values = list(cursor)
+        return [self._cursor_value(field, value) for (field, _), value in zip(orders, values)]
+
+    def _cursor_value(self, field: str, value: Any) -> Any:
+        # Like Firestore, a document ID given for __name__ is taken as a document of the queried collection
+        if field == "__name__":
+            if isinstance(value, MemoryDocumentReference):
+                return value.path
+            if isinstance(value, str) and "/" not in value:
+                return "/".join(self._parent_path + (value,))
+        return _normalize(value)
+
+    def _compare_to_cursor(self, snapshot: MemoryDocumentSnapshot, values: List[Any],
+                           orders: List[Tuple[str, str]]) -> int:
+        for (field, direction), cursor_value in zip(orders, values):
+            a, b = _sort_key(self._value(snapshot, field)), _sort_key(cursor_value)
+            if a != b:
+                result = -1 if a < b else 1
+                return -result if direction == DESCENDING else result
+        return 0
+
+    def _execute(self) -> List[MemoryDocumentSnapshot]:
+        snapshots = [s for s in self._client._scan(self._parent_path, self._all_descendants) if self._matches(s)]
+        orders = self._effective_orders()
+        # Documents missing an order_by field are excluded, as in Firestore
+        snapshots = [s for s in snapshots if all(self._value(s, f) is not _MISSING for f, _ in orders)]
+        for field, direction in reversed(orders):
+            snapshots.sort(key=lambda s: _sort_key(self._value(s, field)), reverse=(direction == DESCENDING))
+
+        if self._start is not None:
+            cursor, inclusive = self._start
+            values = self._cursor_values(cursor, orders)
+            snapshots = [s for s in snapshots
+                         if (c := self._compare_to_cursor(s, values, orders)) > 0 or (inclusive and c == 0)]
+        if self._end is not None:
+            cursor, inclusive = self._end
+            values = self._cursor_values(cursor, orders)
+            snapshots = [s for s in snapshots
+                         if (c := self._compare_to_cursor(s, values, orders)) < 0 or (inclusive and c == 0)]
+
+        if self._limit is not None:
+            snapshots = snapshots[-self._limit:] if self._limit_to_last else snapshots[:self._limit]
+        if self._projection is not None:
+            snapshots = [self._client._project(s, self._projection) for s in snapshots]
+        return snapshots
+
+
+class MemoryAggregationResult:
+    """Mirrors google.cloud.firestore_v1.aggregation.AggregationResult."""
+
+    def __init__(self, alias: str, value: Any, read_time: datetime):
+        self.alias = alias
+        self.value = value
+        self.read_time = read_time
+
+
+class MemoryAggregationQuery:
+    """count() over a query; results are shaped like Firestore's: [[AggregationResult]]."""
+
+    def __init__(self, query: MemoryQuery, alias: str):
+        self._query = query
+        self._alias = alias
+
+    def get(self, transaction=None, **kwargs) -> List[List[MemoryAggregationResult]]:
+        count = len(self._query._execute())
+        return [[MemoryAggregationResult(self._alias, count, _now())]]
+
+    def stream(self, transaction=None, **kwargs) -> Iterator[List[MemoryAggregationResult]]:
+        return iter(self.get(transaction=transaction))
+
+
+class MemoryCollectionReference(MemoryQuery):
+    """Reference to a collection; also queryable."""
+
+    def __init__(self, client: "InMemoryClient", path: Tuple[str, ...]):
+        super().__init__(client, path)
+        self._path = path
+
+    @property
+    def id(self) -> str:
+        return self._path[-1]
+
+    def document(self, document_id: Optional[str] = None) -> MemoryDocumentReference:
+        return MemoryDocumentReference(self._client, self._path + (document_id or uuid.uuid4().hex[:20],))
+
+    def add(self, document_data: Dict, document_id: Optional[str] = None):
+        ref = self.document(document_id)
+        ref.create(document_data)
+        return ref.get().update_time, ref
+
+    def list_documents(self) -> List[MemoryDocumentReference]:
+        return [s.reference for s in self._client._scan(self._path, False)]
+
+
+class MemoryWriteBatch:
+    """Buffers writes and applies them atomically on commit."""
+
+    MAX_WRITES = 500
+
+    def __init__(self, client: "InMemoryClient"):
+        self._client = client
+        self._writes: List[Tuple] = []
+
+    def __len__(self) -> int:
+        return len(self._writes)
+
+    def create(self, reference, document_data: Dict) -> "MemoryWriteBatch":
+        self._writes.append(("create", reference, document_data, None))
+        return self
+
+    def set(self, reference, document_data: Dict, merge: bool = False) -> "MemoryWriteBatch":
+        self._writes.append(("set", reference, document_data, merge))
+        return self
+
+    def update(self, reference, field_updates: Dict, option=None) -> "MemoryWriteBatch":
+        self._writes.append(("update", reference, field_updates, option))
+        return self
+
+    def delete(self, reference, option=None) -> "MemoryWriteBatch":
+        self._writes.append(("delete", reference, None, option))
+        return self
+
+    def commit(self, **kwargs) -> List:
+        if len(self._writes) > self.MAX_WRITES:
+            raise ValueError(f"maximum {self.MAX_WRITES} writes allowed per request")
+        writes, self._writes = self._writes, []
+        return self._client._commit(writes)
+
+
+class MemoryTransaction(MemoryWriteBatch):
+    """
+    Transaction holding the client lock from begin to commit.
+
+    Exposes the private hooks google's firestore.transactional decorator drives
+    (_begin/_commit/_rollback/_clean_up), so repository code is unchanged.
+    """
+
+    def __init__(self, client: "InMemoryClient", max_attempts: int = 5, read_only: bool = False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+
+    @property
+    def in_progress(self) -> bool:
+        return self._id is not None
+
+    def _clean_up(self) -> None:
+        self._writes = []
+        self._id = None
+
+    def _begin(self, retry_id=None) -> None:
+        self._client._lock.acquire()
+        self._id = uuid.uuid4().bytes
+
+    def _commit(self) -> List:
+        try:
+            return self.commit()
+        finally:
+            self._release()
+
+    def _rollback(self) -> None:
+        self._writes = []
+        self._release()
+
+    def _release(self) -> None:
+        if self._id is not None:
+            self._id = None
+            self._client._lock.release()
+
+    def get(self, ref_or_query, **kwargs):
+        if isinstance(ref_or_query, MemoryDocumentReference):
+            return iter([ref_or_query.get()])
+        return ref_or_query.stream()
+
+    def get_all(self, references, **kwargs):
+        return self._client.get_all(references)
+
+
+class InMemoryClient:
+    """Drop-in replacement for firestore.Client backed by a process-local dict."""
+
+    def __init__(self, project: str = "sportsbuddies-memory"):
+        self.project = project
+        self._documents: Dict[Tuple[str, ...], _StoredDocument] = {}
+        self._lock = threading.RLock()
+        self._last_commit = datetime.min.replace(tzinfo=timezone.utc)
+
+    # ---- public API ----
+
+    def collection(self, *collection_path: str) -> MemoryCollectionReference:
+        path = tuple("/".join(collection_path).split("/"))
+        return MemoryCollectionReference(self, path)
+
+    def collection_group(self, collection_id: str) -> MemoryQuery:
+        return MemoryQuery(self, (collection_id,), all_descendants=True)
+
+    def document(self, *document_path: str) -> MemoryDocumentReference:
+        path = tuple("/".join(document_path).split("/"))
+        return MemoryDocumentReference(self, path)
+
+    def batch(self) -> MemoryWriteBatch:
+        return MemoryWriteBatch(self)
+
+    def transaction(self, max_attempts: int = 5, read_only: bool = False) -> MemoryTransaction:
+        return MemoryTransaction(self, max_attempts=max_attempts, read_only=read_only)
+
+    def get_all(self, references: Iterable[MemoryDocumentReference], field_paths=None,
+                transaction=None, **kwargs) -> Iterator[MemoryDocumentSnapshot]:
+        with self._lock:
+            snapshots = [ref.get(field_paths=field_paths) for ref in references]
+        return iter(snapshots)
+
+    def collections(self) -> List[MemoryCollectionReference]:
+        with self._lock:
+            names = sorted({path[0] for path in self._documents})
+        return [MemoryCollectionReference(self, (name,)) for name in names]
+
+    @staticmethod
+    def write_option(**kwargs) -> LastUpdateOption:
+        if set(kwargs) != {"last_update_time"}:
+            raise TypeError("Only last_update_time preconditions are supported")
+        return LastUpdateOption(kwargs["last_update_time"])
+
+    def reset(self) -> None:
+        """Drop all documents (test helper)."""
+        with self._lock:
+            self._documents.clear()
+
+    # ---- internals ----
+
+    def _tick(self) -> datetime:
+        # Wall-clock commit time, like SERVER_TIMESTAMP, kept strictly increasing so precondition checks behave
+        self._last_commit = max(_now(), self._last_commit + timedelta(microseconds=1))
+        return self._last_commit
+
+    def _snapshot(self, reference: MemoryDocumentReference) -> MemoryDocumentSnapshot:
+        with self._lock:
+            stored = self._documents.get(reference._path)
+            if stored is None:
+                return MemoryDocumentSnapshot(reference, None)
+            return MemoryDocumentSnapshot(reference, copy.deepcopy(stored.data),
+                                          stored.create_time, stored.update_time)
+
+    def _scan(self, parent_path: Tuple[str, ...], all_descendants: bool) -> List[MemoryDocumentSnapshot]:
+        with self._lock:
+            if all_descendants:
+                collection_id = parent_path[-1]
+                paths = [p for p in self._documents if len(p) >= 2 and p[-2] == collection_id]
+            else:
+                depth = len(parent_path) + 1
+                paths = [p for p in self._documents if len(p) == depth and p[:-1] == parent_path]
+            return [self._snapshot(MemoryDocumentReference(self, p)) for p in paths]
+
+    @staticmethod
+    def _project(snapshot: MemoryDocumentSnapshot, fields: List[str]) -> MemoryDocumentSnapshot:
+        projected: Dict = {}
+        for field in fields:
+            value = _get_field(snapshot._data, field)
+            if value is not _MISSING:
+                _set_field(projected, field, value)
+        return MemoryDocumentSnapshot(snapshot.reference, projected, snapshot.create_time,
+                                      snapshot.update_time, snapshot.read_time)
+
+    def _check_option(self, reference, stored: Optional[_StoredDocument], option) -> None:
+        if option is None:
+            return
+        expected = getattr(option, "_last_update_time", None)
+        if expected is not None and (stored is None or stored.update_time != expected):
+            raise FailedPrecondition(f"Document {reference.path} was modified since it was read")
+
+    def _commit(self, writes: List[Tuple]) -> List:
+        with self._lock:
+            timestamp = self._tick()
+            staged: Dict[Tuple[str, ...], Optional[_StoredDocument]] = {}
+
+            def current(path):
+                return staged[path] if path in staged else self._documents.get(path)
+
+            for op, reference, payload, extra in writes:
+                path = reference._path
+                stored = current(path)
+                if op == "create":
+                    if stored is not None:
+                        raise AlreadyExists(f"Document already exists: {reference.path}")
+                    staged[path] = _StoredDocument(_resolve_set(payload, timestamp), timestamp, timestamp)
+                elif op == "set":
+                    if extra and stored is not None:
+                        data = copy.deepcopy(stored.data)
+                        _merge(data, payload, timestamp)
+                        staged[path] = _StoredDocument(data, stored.create_time, timestamp)
+                    else:
+                        create_time = stored.create_time if stored is not None else timestamp
+                        staged[path] = _StoredDocument(_resolve_set(payload, timestamp), create_time, timestamp)
+                elif op == "update":
+                    self._check_option(reference, stored, extra)
+                    if stored is None:
+                        raise NotFound(f"No document to update: {reference.path}")
+                    data = copy.deepcopy(stored.data)
+                    for field_path, value in payload.items():
+                        _apply_value(data, field_path, value, timestamp)
+                    staged[path] = _StoredDocument(data, stored.create_time, timestamp)
+                elif op == "delete":
+                    self._check_option(reference, stored, extra)
+                    staged[path] = None
+                else:
+                    raise ValueError(f"Unknown write operation: {op}")
+
+            for path, stored in staged.items():
+                if stored is None:
+                    self._documents.pop(path, None)
+                else:
+                    self._documents[path] = stored
+            return [timestamp for _ in writes]
@@ -0,0 +1,132 @@
+"""
+Declarations of the query shapes the repositories emit.
+
+Each repository registers the shapes of the queries it can run. The index
+generator (database.indexes) turns them into firestore.indexes.json, and the
+query telemetry (database.telemetry) records latency and result counts per shape.
+"""
+
+from dataclasses import dataclass, field
+from itertools import combinations
+from typing import Dict, Iterator, List, Optional, Tuple
+
+ASCENDING = "ASCENDING"
+DESCENDING = "DESCENDING"
+
+
+@dataclass(frozen=True)
+class QueryShape:
+    """
+    The structure of a query, independent of its values.
+    
+    Attributes:
+        name: Stable identifier used in telemetry, e.g. "alerts.by_user".
+        collection: Collection (or collection group) ID the query runs on.
+        equality: Fields always filtered with ==.
+        optional_equality: Fields that may or may not be filtered with ==.
+        array_contains: Field filtered with array_contains, if any.
+        range: Field filtered with <, <=, >, >= or !=, if any.
+        optional_range: Whether the range filter is only sometimes applied.
+        order_by: (field, direction) pairs in query order.
+        collection_group: Whether the query runs across all subcollections with this ID.
+    """
+    name: str
+    collection: str
+    equality: Tuple[str, ...] = ()
+    optional_equality: Tuple[str, ...] = ()
+    array_contains: Optional[str] = None
+    range: Optional[str] = None
+    optional_range: bool = False
+    order_by: Tuple[Tuple[str, str], ...] = ()
+    collection_group: bool = False
+
+    def variant(self, equality: Tuple[str, ...] = (), range_field: Optional[str] = None) -> "QueryShape":
+        """The concrete shape of one execution, given the optional filters it used."""
+        return QueryShape(
+            name=self.name,
+            collection=self.collection,
+            equality=tuple(self.equality) + tuple(f for f in self.optional_equality if f in equality),
+            array_contains=self.array_contains,
+            range=range_field if range_field is not None else (None if self.optional_range else self.range),
+            order_by=self.order_by,
+            collection_group=self.collection_group,
+        )
+
+    def expand(self) -> Iterator["QueryShape"]:
+        """Yield every concrete shape this declaration can produce."""
+        ranges = [self.range, None] if self.optional_range else [self.range]
+        for size in range(len(self.optional_equality) + 1):
+            for extra in combinations(self.optional_equality, size):
+                for range_field in ranges:
+                    yield QueryShape(
+                        name=self.name,
+                        collection=self.collection,
+                        equality=tuple(self.equality) + extra,
+                        array_contains=self.array_contains,
+                        range=range_field,
+                        order_by=self.order_by,
+                        collection_group=self.collection_group,
+                    )
+
+    @property
+    def key(self) -> str:
+        """Readable signature of a concrete shape, used to group telemetry."""
+        parts = [f"{f}==" for f in self.equality]
+        if self.array_contains:
+            parts.append(f"{self.array_contains} array_contains")
+        if self.range:
+            parts.append(f"{self.range} range")
+        parts += [f"order {f} {d.lower()}" for f, d in self.order_by]
+        return f"{self.name}({', '.join(parts)})"
+
+    def requires_composite_index(self) -> bool:
+        """
+        Whether Firestore needs a composite index for this shape.
+        
+        Equality-only filters are served by merging single-field indexes; anything
+        combining equality or array_contains with a range, an order_by on another
+        field, or array_contains with other filters needs a composite index.
+        """
+        sort_fields = [f for f, _ in self.order_by]
+        if self.range and self.range not in sort_fields:
+            sort_fields.insert(0, self.range)
+        filter_count = len(self.equality) + (1 if self.array_contains else 0)
+        if len(sort_fields) > 1:
+            return True
+        if filter_count and sort_fields:
+            return True
+        return bool(self.array_contains) and filter_count > 1
+
+    def index_fields(self) -> List[Dict[str, str]]:
+        """Fields of the composite index serving this shape, in Firestore order."""
+        fields = [{"fieldPath": f, "order": ASCENDING} for f in sorted(set(self.equality))]
+        if self.array_contains:
+            fields.append({"fieldPath": self.array_contains, "arrayConfig": "CONTAINS"})
+        directions = dict(self.order_by)
+        # The range field must lead the sort order
+        if self.range:
+            fields.append({"fieldPath": self.range, "order": directions.get(self.range, ASCENDING)})
+        for f, direction in self.order_by:
+            if f != self.range:
+                fields.append({"fieldPath": f, "order": direction})
+        return fields
+
+
+# All shapes registered by repository modules, by name
+QUERY_SHAPES: Dict[str, QueryShape] = {}
+
+
+def register_shape(shape: QueryShape) -> QueryShape:
+    """Register a shape declared by a repository and return it."""
+    QUERY_SHAPES[shape.name] = shape
+    return shape
+
+
+# (collection, field) pairs holding a timestamp that a Firestore TTL policy deletes documents after
+TTL_FIELDS: List[Tuple[str, str]] = []
+
+
+def register_ttl_field(collection: str, field_path: str) -> None:
+    """Declare a TTL field; the index generator emits its TTL policy as a field override."""
+    if (collection, field_path) not in TTL_FIELDS:
+        TTL_FIELDS.append((collection, field_path))
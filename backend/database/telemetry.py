@@ -0,0 +1,98 @@
+"""
+Runtime telemetry for executed queries, grouped by query shape.
+"""
+
+import threading
+import time
+from typing import Any, Dict, List
+
+import config
+from database.query_shapes import QueryShape
+
+
+class QueryTelemetry:
+    """Thread-safe aggregate of latency and result counts per query shape."""
+
+    def __init__(self, slow_query_ms: float = 500.0):
+        self.slow_query_ms = slow_query_ms
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, shape: QueryShape, latency_ms: float, results: int, error: bool = False) -> None:
+        """Record one execution of a concrete query shape."""
+        with self._lock:
+            stats = self._stats.setdefault(shape.key, {
+                "shape": shape.key,
+                "collection": shape.collection,
+                "composite_index": shape.requires_composite_index(),
+                "count": 0,
+                "errors": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0,
+                "total_results": 0,
+                "max_results": 0,
+            })
+            stats["count"] += 1
+            stats["errors"] += 1 if error else 0
+            stats["total_ms"] += latency_ms
+            stats["max_ms"] = max(stats["max_ms"], latency_ms)
+            stats["total_results"] += results
+            stats["max_results"] = max(stats["max_results"], results)
+
+        if latency_ms >= self.slow_query_ms:
+            print(f"Slow query {shape.key}: {latency_ms:.1f} ms, {results} results")
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Per-shape stats, slowest total time first."""
+        with self._lock:
+            rows = [dict(s) for s in self._stats.values()]
+        for row in rows:
+            row["avg_ms"] = round(row["total_ms"] / row["count"], 2) if row["count"] else 0.0
+            row["avg_results"] = round(row["total_results"] / row["count"], 2) if row["count"] else 0.0
+            row["total_ms"] = round(row["total_ms"], 2)
+            row["max_ms"] = round(row["max_ms"], 2)
+        return sorted(rows, key=lambda r: r["total_ms"], reverse=True)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+query_telemetry = QueryTelemetry(slow_query_ms=config.SLOW_QUERY_MS)
+
+
+def run_query(query, shape: QueryShape) -> List:
+    """
+    Execute a query and record its shape, latency and result count.
+    
+    Args:
+        query: A Firestore (or in-memory) query.
+        shape: The concrete shape of this execution.
+    
+    Returns:
+        The list of document snapshots.
+    """
+    start = time.perf_counter()
+    try:
+        docs = list(query.stream())
+    except Exception:
+        query_telemetry.record(shape, (time.perf_counter() - start) * 1000, 0, error=True)
+        raise
+    query_telemetry.record(shape, (time.perf_counter() - start) * 1000, len(docs))
+    return docs
+
+
+def run_count(query, shape: QueryShape) -> int:
+    """
+    Execute a count() aggregation over a query and record it under the shape.
+    
+    Billed as one read per 1000 matching index entries, instead of one per document.
+    """
+    start = time.perf_counter()
+    try:
+        results = query.count(alias="count").get()
+    except Exception:
+        query_telemetry.record(shape, (time.perf_counter() - start) * 1000, 0, error=True)
+        raise
+    query_telemetry.record(shape, (time.perf_counter() - start) * 1000, 1)
+    return int(results[0][0].value)
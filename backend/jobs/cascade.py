@@ -0,0 +1,287 @@
+"""
+Background cascade deletion for user accounts and activities.
+
+The request path deletes the primary document and records a job document in
+cascade_jobs in the same batch, then returns. A worker thread removes what
+referenced it (messages, alerts, memberships) in parallel bulk commits,
+recording progress per step. Every step only touches documents that still
+reference the deleted entity, so a job interrupted at any point can simply be
+run again; the scheduler resumes jobs that stop making progress.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional
+
+from firebase_admin import firestore
+
+import config
+from activity.repositories.activity_repository import BY_CREATOR, BY_JOIN_REQUEST, BY_PARTICIPANT
+from activity.repositories.message_repository import BUCKETS_BY_SENDER, anonymize_bucket, message_buckets
+from database.bulk import BulkCommitter, drain_query
+from database.query_shapes import QueryShape, register_shape
+from database.telemetry import run_query
+from user.repositories.alert_repository import (
+    ALL_FOR_USER, adjust_unread_counts, alert_shape, all_alerts, layout_shape, release_unread, unread_counter_ref,
+    user_alerts_query
+)
+from user.services.auth_service import AuthService
+
+CASCADE_COLLECTION = "cascade_jobs"
+
+logger = logging.getLogger(__name__)
+
+# Shown in place of a deleted user's name on the messages they leave behind
+DELETED_USER_ID = "deleted-user"
+DELETED_USER_NAME = "Deleted user"
+
+MESSAGES_FOR_ACTIVITY = register_shape(QueryShape("messages.for_activity", "messages", equality=("activity_id",)))
+MESSAGES_BY_SENDER = register_shape(QueryShape("messages.by_sender", "messages", equality=("sender_id",)))
+THREAD_BUCKETS = register_shape(QueryShape("message_buckets.all", "message_buckets"))
+ALERTS_FOR_ACTIVITY = alert_shape(QueryShape("alerts.for_activity", "alerts", equality=("activity_id",)))
+ALERTS_BY_SENDER = alert_shape(QueryShape("alerts.by_sender", "alerts", equality=("sender_id",)))
+RUNNING_CASCADES = register_shape(QueryShape("cascade_jobs.running", CASCADE_COLLECTION, equality=("status",)))
+
+ACTIVITY_STEPS = ["messages", "alerts"]
+# Created activities go last: their clean-up jobs delete messages the "messages" step would otherwise update
+USER_STEPS = ["messages", "participations", "join_requests", "alerts", "sent_alerts", "created_activities"]
+
+
+class CascadeDeleter:
+    """Deletes users and activities and cleans up everything that references them."""
+
+    def __init__(self, db, workers: Optional[int] = None):
+        self.db = db
+        self.jobs = db.collection(CASCADE_COLLECTION)
+        self._executor = ThreadPoolExecutor(max_workers=workers or config.CASCADE_WORKERS,
+                                            thread_name_prefix="cascade")
+
+    # ---- Request path ----
+
+    def delete_activity(self, activity_id: str) -> str:
+        """
+        Delete an activity now and queue clean-up of its messages and alerts.
+        
+        Returns:
+            str: The clean-up job ID, for progress lookups.
+        """
+        job_id = f"activity:{activity_id}"
+        batch = self.db.batch()
+        batch.set(self.jobs.document(job_id), self._new_job("activity", activity_id))
+        batch.delete(self.db.collection("activities").document(activity_id))
+        batch.commit()
+        self.submit(job_id)
+        return job_id
+
+    def delete_user(self, user_id: str) -> str:
+        """
+        Delete a user's profile and auth account now and queue clean-up of
+        their activities, memberships, alerts and messages.
+        
+        Returns:
+            str: The clean-up job ID, for progress lookups.
+        """
+        job_id = f"user:{user_id}"
+        batch = self.db.batch()
+        batch.set(self.jobs.document(job_id), self._new_job("user", user_id))
+        batch.delete(self.db.collection("users").document(user_id))
+        batch.commit()
+        AuthService.delete_user(user_id)
+        self.submit(job_id)
+        return job_id
+
+    def submit(self, job_id: str) -> None:
+        """Run a job on the background pool."""
+        self._executor.submit(self._run_logged, job_id)
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job's progress document, or None."""
+        doc = self.jobs.document(job_id).get()
+        if not doc.exists:
+            return None
+        return {"id": doc.id, **doc.to_dict()}
+
+    def shutdown(self) -> None:
+        """Stop accepting jobs; unfinished ones are picked up by resume_stale() later."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # ---- Execution ----
+
+    def run(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Run the remaining steps of a job.
+        
+        Completed steps are skipped; an interrupted step is re-run from the
+        documents that still match it. Returns the final job document.
+        """
+        job_ref = self.jobs.document(job_id)
+        doc = job_ref.get()
+        if not doc.exists:
+            return None
+        job = doc.to_dict()
+        if job.get("status") == "done":
+            return {"id": job_id, **job}
+
+        steps = ACTIVITY_STEPS if job["kind"] == "activity" else USER_STEPS
+        target_id = job["target_id"]
+        try:
+            for step in steps:
+                if job.get("steps", {}).get(step, {}).get("done"):
+                    continue
+                getattr(self, f"_{job['kind']}_{step}")(job_ref, step, target_id)
+                job_ref.update({f"steps.{step}.done": True, "updated_at": _now()})
+            job_ref.update({"status": "done", "error": None, "finished_at": _now(), "updated_at": _now()})
+        except Exception as e:
+            job_ref.update({"error": str(e), "attempts": firestore.Increment(1), "updated_at": _now()})
+            raise
+        return self.get_job(job_id)
+
+    def resume_stale(self) -> Dict[str, Any]:
+        """Re-run jobs that are unfinished and have made no progress for CASCADE_STALE_SECONDS."""
+        cutoff = _now() - timedelta(seconds=config.CASCADE_STALE_SECONDS)
+        docs = run_query(self.jobs.where("status", "==", "running"), RUNNING_CASCADES)
+        stale = [doc.id for doc in docs if doc.to_dict().get("updated_at", cutoff) <= cutoff]
+        failed = 0
+        for job_id in stale:
+            try:
+                self.run(job_id)
+            except Exception:
+                failed += 1
+                logger.exception("Cascade job %s failed again", job_id)
+        return {"resumed": len(stale), "failed": failed}
+
+    def _run_logged(self, job_id: str) -> None:
+        try:
+            self.run(job_id)
+        except Exception:
+            logger.exception("Cascade job %s failed", job_id)
+
+    def _drain(self, job_ref, step: str, query, shape: QueryShape,
+               write: Callable[[BulkCommitter, Any], None]) -> int:
+        """Drain `query` with `write`, adding progress to the job document after each page."""
+        def on_page(count: int) -> None:
+            job_ref.update({f"steps.{step}.count": firestore.Increment(count), "updated_at": _now()})
+
+        return drain_query(self.db, query, shape, write, on_page=on_page).count
+
+    @staticmethod
+    def _delete(committer: BulkCommitter, doc) -> None:
+        committer.delete(doc.reference)
+
+    def _delete_alerts(self, job_ref, step: str, query, shape: QueryShape) -> int:
+        """Delete other users' alerts and take the unread ones off their counters."""
+        releases: Dict[str, Dict[str, Any]] = {}
+
+        def delete(committer: BulkCommitter, doc) -> None:
+            data = doc.to_dict()
+            if not data.get("read"):
+                release_unread(releases, data.get("user_id"), doc.id, data.get("type"))
+            committer.delete(doc.reference)
+
+        def on_page(count: int) -> None:
+            # Settle counters per page so a resumed job never decrements twice
+            adjust_unread_counts(self.db, releases)
+            releases.clear()
+            job_ref.update({f"steps.{step}.count": firestore.Increment(count), "updated_at": _now()})
+
+        return drain_query(self.db, query, shape, delete, on_page=on_page, fields=["user_id", "read", "type"]).count
+
+    # ---- Activity steps ----
+
+    def _activity_messages(self, job_ref, step: str, activity_id: str) -> int:
+        query = self.db.collection("messages").where("activity_id", "==", activity_id)
+        count = self._drain(job_ref, step, query, MESSAGES_FOR_ACTIVITY, self._delete)
+        # Messages stored in buckets (MESSAGE_STORAGE=buckets) live under the activity
+        return count + self._drain(job_ref, step, message_buckets(self.db, activity_id), THREAD_BUCKETS,
+                                   self._delete)
+
+    def _activity_alerts(self, job_ref, step: str, activity_id: str) -> int:
+        query = all_alerts(self.db).where("activity_id", "==", activity_id)
+        return self._delete_alerts(job_ref, step, query, layout_shape(ALERTS_FOR_ACTIVITY))
+
+    # ---- User steps ----
+
+    def _user_created_activities(self, job_ref, step: str, user_id: str) -> int:
+        # Each created activity is deleted together with its own clean-up job,
+        # so its messages and alerts are removed by that job
+        child_jobs = []
+
+        def delete_with_job(committer: BulkCommitter, doc) -> None:
+            child_id = f"activity:{doc.id}"
+            committer.set(self.jobs.document(child_id), self._new_job("activity", doc.id, parent=job_ref.id))
+            committer.delete(doc.reference)
+            child_jobs.append(child_id)
+
+        query = self.db.collection("activities").where("creator_id", "==", user_id)
+        count = self._drain(job_ref, step, query, BY_CREATOR, delete_with_job)
+        for child_id in child_jobs:
+            self.submit(child_id)
+        return count
+
+    def _user_participations(self, job_ref, step: str, user_id: str) -> int:
+        def leave(committer: BulkCommitter, doc) -> None:
+            committer.update(doc.reference, {
+                "participants": firestore.ArrayRemove([user_id]),
+                "participantCount": firestore.Increment(-1),
+            })
+
+        query = self.db.collection("activities").where("participants", "array_contains", user_id)
+        return self._drain(job_ref, step, query, BY_PARTICIPANT, leave)
+
+    def _user_join_requests(self, job_ref, step: str, user_id: str) -> int:
+        def withdraw(committer: BulkCommitter, doc) -> None:
+            committer.update(doc.reference, {"joinRequests": firestore.ArrayRemove([user_id])})
+
+        query = self.db.collection("activities").where("joinRequests", "array_contains", user_id)
+        return self._drain(job_ref, step, query, BY_JOIN_REQUEST, withdraw)
+
+    def _user_alerts(self, job_ref, step: str, user_id: str) -> int:
+        query = user_alerts_query(self.db, user_id)
+        count = self._drain(job_ref, step, query, layout_shape(ALL_FOR_USER), self._delete)
+        unread_counter_ref(self.db, user_id).delete()
+        return count
+
+    def _user_sent_alerts(self, job_ref, step: str, user_id: str) -> int:
+        # Join requests, messages and departures by this user are no longer actionable
+        query = all_alerts(self.db).where("sender_id", "==", user_id)
+        return self._delete_alerts(job_ref, step, query, layout_shape(ALERTS_BY_SENDER))
+
+    def _user_messages(self, job_ref, step: str, user_id: str) -> int:
+        # Keep the conversation readable for the other participants
+        def anonymize(committer: BulkCommitter, doc) -> None:
+            committer.update(doc.reference, {
+                "sender_id": DELETED_USER_ID,
+                "sender_name": DELETED_USER_NAME,
+                "sender_profile_pic": None,
+            })
+
+        def anonymize_in_bucket(committer: BulkCommitter, doc) -> None:
+            # Buckets take concurrent appends, so each is rewritten in its own transaction
+            anonymize_bucket(self.db, doc.reference, user_id, DELETED_USER_ID, DELETED_USER_NAME)
+
+        query = self.db.collection("messages").where("sender_id", "==", user_id)
+        count = self._drain(job_ref, step, query, MESSAGES_BY_SENDER, anonymize)
+        buckets = self.db.collection_group("message_buckets").where("sender_ids", "array_contains", user_id)
+        return count + self._drain(job_ref, step, buckets, BUCKETS_BY_SENDER, anonymize_in_bucket)
+
+    @staticmethod
+    def _new_job(kind: str, target_id: str, parent: Optional[str] = None) -> Dict[str, Any]:
+        now = _now()
+        job = {
+            "kind": kind,
+            "target_id": target_id,
+            "status": "running",
+            "steps": {},
+            "attempts": 0,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+        }
+        if parent:
+            job["parent"] = parent
+        return job
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
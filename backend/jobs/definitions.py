@@ -0,0 +1,39 @@
+"""
+Jobs run by the in-app scheduler.
+"""
+
+import config
+from jobs.scheduler import Job, Scheduler
+
+
+def build_scheduler(container) -> Scheduler:
+    """Create a scheduler with every periodic job registered, using the app's shared services."""
+    scheduler = Scheduler(container.db)
+    activity_repository = container.activity_repository
+
+    scheduler.register(Job(
+        name="expire_activities",
+        func=activity_repository.expire_activities,
+        interval=config.EXPIRE_JOB_INTERVAL_SECONDS,
+    ))
+    scheduler.register(Job(
+        name="reconcile_alert_counters",
+        func=container.alert_repository.reconcile_unread_counts,
+        interval=config.ALERT_COUNTER_RECONCILE_INTERVAL_SECONDS,
+    ))
+    scheduler.register(Job(
+        name="compact_alerts",
+        func=container.alert_repository.compact,
+        interval=config.ALERT_COMPACTION_INTERVAL_SECONDS,
+    ))
+    scheduler.register(Job(
+        name="drain_alert_outbox",
+        func=container.outbox.drain,
+        interval=config.OUTBOX_DRAIN_INTERVAL_SECONDS,
+    ))
+    scheduler.register(Job(
+        name="resume_cascades",
+        func=container.cascade.resume_stale,
+        interval=config.CASCADE_RESUME_INTERVAL_SECONDS,
+    ))
+    return scheduler
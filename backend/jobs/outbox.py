@@ -0,0 +1,225 @@
+"""
+Durable outbox for the alerts an activity change owes.
+
+The request path writes a small event document to alert_outbox in the same
+batch as the activity change, hands its ID to a worker thread and returns, so
+request latency no longer depends on alert writes or on how many users are
+notified. A worker claims the event with a short lease, expands it into
+alerts through AlertService and deletes it. Delivery is idempotent (alerts are
+tagged with the event ID and written once), so an event whose worker died is
+simply delivered again once its lease expires. Failures are retried with
+exponential backoff; after OUTBOX_MAX_ATTEMPTS an event is kept as "failed".
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Optional
+
+from firebase_admin import firestore
+
+import config
+from database.query_shapes import ASCENDING, QueryShape, register_shape
+from database.telemetry import run_count, run_query
+from user.services.alert_service import AlertService
+from user.models.alert import AlertType
+from utils.write_coalescer import PendingWrite
+
+OUTBOX_COLLECTION = "alert_outbox"
+
+logger = logging.getLogger(__name__)
+
+# Event kinds
+JOIN_REQUESTED = "join_requested"
+JOIN_REQUEST_CANCELLED = "join_request_cancelled"
+JOIN_RESPONDED = "join_responded"
+PARTICIPANT_REMOVED = "participant_removed"
+PARTICIPANT_LEFT = "participant_left"
+ACTIVITY_UPDATED = "activity_updated"
+ACTIVITY_CANCELLED = "activity_cancelled"
+
+DUE_EVENTS = register_shape(QueryShape(
+    "alert_outbox.due", OUTBOX_COLLECTION,
+    equality=("status",), range="next_attempt_at",
+    order_by=(("next_attempt_at", ASCENDING),)
+))
+EVENTS_BY_STATUS = register_shape(QueryShape("alert_outbox.by_status", OUTBOX_COLLECTION, equality=("status",)))
+
+
+class AlertOutbox:
+    """Records alert events with activity changes and delivers them in the background."""
+
+    def __init__(self, db, alert_service: AlertService, workers: Optional[int] = None):
+        self.db = db
+        self.alert_service = alert_service
+        self.events = db.collection(OUTBOX_COLLECTION)
+        self._executor = ThreadPoolExecutor(max_workers=workers or config.OUTBOX_WORKERS,
+                                            thread_name_prefix="outbox")
+
+    # ---- Request path ----
+
+    def event(self, kind: str, **payload: Any) -> PendingWrite:
+        """Build an event write, to be committed with the change that caused it."""
+        now = _now()
+        return PendingWrite("set", self.events.document(), {
+            "kind": kind,
+            "payload": payload,
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "created_at": now,
+        })
+
+    def dispatch(self, writes: Iterable[PendingWrite]) -> None:
+        """Deliver committed events on the worker pool now instead of waiting for the next drain."""
+        for write in writes:
+            self._executor.submit(self._process_logged, write.reference.id)
+
+    def shutdown(self) -> None:
+        """Stop delivering; pending events are picked up by drain() on the next start."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    # ---- Delivery ----
+
+    def process(self, event_id: str) -> Optional[str]:
+        """
+        Deliver one event if it is due and not leased by another worker.
+
+        Returns:
+            "delivered", "retry", "failed", or None if the event was not claimed.
+        """
+        event_ref = self.events.document(event_id)
+        event = self._claim(event_ref)
+        if event is None:
+            return None
+        try:
+            getattr(self, f"_handle_{event['kind']}")(event_id, **event["payload"])
+        except Exception as e:
+            attempts = event.get("attempts", 0) + 1
+            # ValueError means the event can never be delivered (e.g. its sender was deleted)
+            if isinstance(e, ValueError) or attempts >= config.OUTBOX_MAX_ATTEMPTS:
+                event_ref.update({"status": "failed", "attempts": attempts, "error": str(e), "failed_at": _now()})
+                return "failed"
+            delay = min(config.OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1), config.OUTBOX_RETRY_MAX_SECONDS)
+            event_ref.update({"attempts": attempts, "error": str(e),
+                              "next_attempt_at": _now() + timedelta(seconds=delay)})
+            return "retry"
+        event_ref.delete()
+        return "delivered"
+
+    def drain(self, page_size: int = 100) -> Dict[str, Any]:
+        """
+        Deliver every due event: ones whose immediate dispatch was lost (worker
+        restart), retries whose backoff has passed, and leases that expired.
+
+        Processing takes an event out of the due query (it is deleted, leased or
+        rescheduled), so the query is re-read from the start until a page
+        brings nothing new.
+        """
+        results: Dict[str, int] = {"delivered": 0, "retry": 0, "failed": 0, "skipped": 0, "errors": 0}
+        seen = set()
+        while True:
+            query = self.events.where("status", "==", "pending")\
+                               .where("next_attempt_at", "<=", _now())\
+                               .order_by("next_attempt_at")\
+                               .select([])\
+                               .limit(page_size)
+            event_ids = [doc.id for doc in run_query(query, DUE_EVENTS) if doc.id not in seen]
+            if not event_ids:
+                break
+            seen.update(event_ids)
+            for outcome in self._executor.map(self._process_logged, event_ids):
+                results[outcome or "skipped"] += 1
+        return results
+
+    def stats(self) -> Dict[str, int]:
+        """Count events waiting for delivery and events that gave up."""
+        return {
+            status: run_count(self.events.where("status", "==", status), EVENTS_BY_STATUS)
+            for status in ("pending", "failed")
+        }
+
+    def _claim(self, event_ref) -> Optional[Dict[str, Any]]:
+        """Take a lease on a due event so no other worker delivers it concurrently."""
+        @firestore.transactional
+        def claim_in_transaction(transaction):
+            doc = event_ref.get(transaction=transaction)
+            if not doc.exists:
+                return None
+            event = doc.to_dict()
+            now = _now()
+            if event.get("status") != "pending" or event.get("next_attempt_at", now) > now:
+                return None
+            transaction.update(event_ref, {
+                "next_attempt_at": now + timedelta(seconds=config.OUTBOX_LEASE_SECONDS)
+            })
+            return event
+
+        return claim_in_transaction(self.db.transaction())
+
+    def _process_logged(self, event_id: str) -> Optional[str]:
+        try:
+            return self.process(event_id)
+        except Exception:
+            # Left pending; the next drain retries it
+            logger.exception("Outbox event %s could not be processed", event_id)
+            return "errors"
+
+    # ---- Handlers (must be idempotent) ----
+
+    def _handle_join_requested(self, event_id: str, activity_id: str, activity_name: str,
+                               creator_id: str, requester_id: str) -> None:
+        # Cancelled before delivery: don't resurrect an alert the cancellation already removed. The check
+        # and the write share a transaction, so a cancel can't commit (and be delivered) in between.
+        self.alert_service.create_join_request_alert(creator_id, requester_id, activity_id, activity_name,
+                                                     event_id=event_id,
+                                                     only_if=self._request_pending(activity_id, requester_id))
+
+    def _handle_join_request_cancelled(self, event_id: str, activity_id: str,
+                                       creator_id: str, requester_id: str) -> None:
+        # Requested again before delivery: the alert now belongs to the new request
+        pending = self._request_pending(activity_id, requester_id)
+        self.alert_service.delete_join_request_alert(creator_id, requester_id, activity_id,
+                                                     only_if=lambda transaction: not pending(transaction))
+
+    def _request_pending(self, activity_id: str, requester_id: str):
+        """Check, inside an alert transaction, whether the requester's join request is still pending."""
+        activity_ref = self.db.collection("activities").document(activity_id)
+
+        def pending(transaction) -> bool:
+            activity = activity_ref.get(field_paths=["joinRequests"], transaction=transaction)
+            return activity.exists and requester_id in (activity.to_dict().get("joinRequests") or [])
+
+        return pending
+
+    def _handle_join_responded(self, event_id: str, activity_id: str, activity_name: str,
+                               creator_id: str, requester_id: str, approved: bool) -> None:
+        self.alert_service.repository.respond_to_join_request(
+            creator_id, requester_id, activity_id, "accepted" if approved else "rejected"
+        )
+        self.alert_service.create_request_response_alert(requester_id, creator_id, activity_id, activity_name,
+                                                         approved, event_id=event_id)
+
+    def _handle_participant_removed(self, event_id: str, activity_id: str, activity_name: str,
+                                    creator_id: str, participant_id: str) -> None:
+        self.alert_service.create_user_removed_alert(participant_id, creator_id, activity_id, activity_name,
+                                                     event_id=event_id)
+
+    def _handle_participant_left(self, event_id: str, activity_id: str, activity_name: str,
+                                 creator_id: str, participant_id: str) -> None:
+        self.alert_service.create_user_left_alert(creator_id, participant_id, activity_id, activity_name,
+                                                  event_id=event_id)
+
+    def _handle_activity_updated(self, event_id: str, activity_id: str, activity_name: str,
+                                 creator_id: str, participants: list) -> None:
+        self.alert_service.fan_out(AlertType.ACTIVITY_UPDATED, participants, creator_id, activity_id,
+                                   activity_name, event_id=event_id)
+
+    def _handle_activity_cancelled(self, event_id: str, activity_id: str, activity_name: str,
+                                   creator_id: str, participants: list) -> None:
+        self.alert_service.fan_out(AlertType.ACTIVITY_CANCELLED, participants, creator_id, activity_id,
+                                   activity_name, event_id=event_id)
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
@@ -0,0 +1,245 @@
+"""
+In-app periodic job scheduler with Firestore lease-based leader election.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from firebase_admin import firestore
+
+import config
+
+LEASE_COLLECTION = "scheduler_leases"
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Job:
+    """
+    A periodic job.
+    
+    Attributes:
+        name: Unique job name; also the lease document ID.
+        func: Synchronous callable run in a worker thread; its return value is recorded.
+        interval: Seconds between runs.
+        jitter: Random spread applied to the interval, as a fraction of it.
+        lease_seconds: How long a replica owns the job after starting it (defaults to interval);
+            renewed while the job runs, so it need not exceed the job's runtime.
+    """
+    name: str
+    func: Callable[[], Any]
+    interval: float
+    jitter: float = config.SCHEDULER_JITTER
+    lease_seconds: Optional[float] = None
+
+
+@dataclass
+class JobRun:
+    """Record of one scheduled attempt."""
+    job: str
+    started_at: datetime
+    status: str
+    duration_ms: float = 0.0
+    result: Any = None
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job": self.job,
+            "started_at": self.started_at.isoformat(),
+            "status": self.status,
+            "duration_ms": round(self.duration_ms, 1),
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class LeaseManager:
+    """
+    Grants a replica exclusive ownership of a job for a period, using one
+    Firestore document per job in the scheduler_leases collection.
+    """
+
+    def __init__(self, db, owner_id: str):
+        self.db = db
+        self.owner_id = owner_id
+        self.collection = db.collection(LEASE_COLLECTION)
+
+    def acquire(self, job_name: str, ttl_seconds: float) -> bool:
+        """Take the lease if it is free, expired or already ours; returns whether we hold it."""
+        doc_ref = self.collection.document(job_name)
+        owner_id = self.owner_id
+
+        @firestore.transactional
+        def acquire_in_transaction(transaction):
+            now = datetime.now(timezone.utc)
+            doc = doc_ref.get(transaction=transaction)
+            lease = doc.to_dict() if doc.exists else None
+            if lease and lease.get("holder") != owner_id and lease.get("expires_at") and lease["expires_at"] > now:
+                return False
+            transaction.set(doc_ref, {
+                "holder": owner_id,
+                "acquired_at": now,
+                "expires_at": now + timedelta(seconds=ttl_seconds),
+            })
+            return True
+
+        return acquire_in_transaction(self.db.transaction())
+
+    def renew(self, job_name: str, ttl_seconds: float) -> bool:
+        """Extend a lease we hold; returns False if it has been taken over or is gone."""
+        doc_ref = self.collection.document(job_name)
+        owner_id = self.owner_id
+
+        @firestore.transactional
+        def renew_in_transaction(transaction):
+            doc = doc_ref.get(transaction=transaction)
+            if not doc.exists or doc.to_dict().get("holder") != owner_id:
+                return False
+            transaction.update(doc_ref, {"expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds)})
+            return True
+
+        return renew_in_transaction(self.db.transaction())
+
+    def release(self, job_name: str) -> None:
+        """Give the lease up early if we still hold it."""
+        doc_ref = self.collection.document(job_name)
+        owner_id = self.owner_id
+
+        @firestore.transactional
+        def release_in_transaction(transaction):
+            doc = doc_ref.get(transaction=transaction)
+            if doc.exists and doc.to_dict().get("holder") == owner_id:
+                transaction.delete(doc_ref)
+
+        release_in_transaction(self.db.transaction())
+
+
+class Scheduler:
+    """
+    Runs registered jobs on asyncio timers with jitter.
+    
+    Before each run the replica must win the job's lease, so when several
+    replicas run the app only one of them executes a job per interval.
+    The last runs of each job are kept in memory for monitoring.
+    """
+
+    def __init__(self, db, owner_id: Optional[str] = None, history_size: int = config.SCHEDULER_HISTORY_SIZE):
+        self.owner_id = owner_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.leases = LeaseManager(db, self.owner_id)
+        self.history_size = history_size
+        self._jobs: Dict[str, Job] = {}
+        self._runs: Dict[str, Deque[JobRun]] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def register(self, job: Job) -> Job:
+        """Add a job; must be called before start()."""
+        self._jobs[job.name] = job
+        self._runs[job.name] = deque(maxlen=self.history_size)
+        return job
+
+    def start(self) -> None:
+        """Start one timer task per job on the running event loop."""
+        for job in self._jobs.values():
+            self._tasks.append(asyncio.create_task(self._loop(job), name=f"job:{job.name}"))
+
+    async def stop(self) -> None:
+        """Cancel the timers; a job already running in its thread finishes on its own."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def run_now(self, name: str) -> JobRun:
+        """Run a job immediately (still subject to its lease)."""
+        return await self._run(self._jobs[name])
+
+    def history(self) -> List[Dict[str, Any]]:
+        """Per-job summary and recent runs, newest first."""
+        summaries = []
+        for name, job in self._jobs.items():
+            runs = list(self._runs[name])
+            executed = [r for r in runs if r.status in ("ok", "error")]
+            durations = [r.duration_ms for r in executed]
+            summaries.append({
+                "job": name,
+                "interval_seconds": job.interval,
+                "runs": len(executed),
+                "errors": sum(1 for r in executed if r.status == "error"),
+                "skipped": sum(1 for r in runs if r.status == "skipped"),
+                "avg_duration_ms": round(sum(durations) / len(durations), 1) if durations else None,
+                "max_duration_ms": round(max(durations), 1) if durations else None,
+                "last_run": executed[-1].to_dict() if executed else None,
+                "recent": [r.to_dict() for r in reversed(runs)],
+            })
+        return summaries
+
+    def _delay(self, job: Job) -> float:
+        spread = job.interval * job.jitter
+        return max(0.0, job.interval + random.uniform(-spread, spread))
+
+    async def _loop(self, job: Job) -> None:
+        # Stagger the first run so replicas started together don't race for every lease at once
+        await asyncio.sleep(random.uniform(0, job.interval * job.jitter))
+        while True:
+            await self._run(job)
+            await asyncio.sleep(self._delay(job))
+
+    async def _heartbeat(self, job_name: str, ttl: float) -> None:
+        """Renew a running job's lease every third of its TTL; returns once the lease is lost."""
+        while True:
+            await asyncio.sleep(ttl / 3)
+            try:
+                if not await asyncio.to_thread(self.leases.renew, job_name, ttl):
+                    return
+            except Exception as e:
+                # Retried on the next beat; the lease only lapses after two more failures
+                logger.warning("Could not renew the lease of job %s: %s", job_name, e)
+
+    async def _run(self, job: Job) -> JobRun:
+        started_at = datetime.now(timezone.utc)
+        ttl = job.lease_seconds or job.interval
+        try:
+            acquired = await asyncio.to_thread(self.leases.acquire, job.name, ttl)
+        except Exception as e:
+            run = JobRun(job.name, started_at, "error", error=f"Lease error: {str(e)}")
+            self._runs[job.name].append(run)
+            return run
+
+        if not acquired:
+            run = JobRun(job.name, started_at, "skipped")
+            self._runs[job.name].append(run)
+            return run
+
+        start = time.perf_counter()
+        heartbeat = asyncio.create_task(self._heartbeat(job.name, ttl))
+        try:
+            result = await asyncio.to_thread(job.func)
+            run = JobRun(job.name, started_at, "ok", (time.perf_counter() - start) * 1000, result=result)
+        except Exception as e:
+            logger.exception("Scheduled job %s failed", job.name)
+            run = JobRun(job.name, started_at, "error", (time.perf_counter() - start) * 1000, error=str(e))
+            # Let another replica retry without waiting out the lease
+            try:
+                await asyncio.to_thread(self.leases.release, job.name)
+            except Exception:
+                pass
+        finally:
+            lease_lost = heartbeat.done() and not heartbeat.cancelled() and heartbeat.exception() is None
+            heartbeat.cancel()
+        if lease_lost:
+            # The job can't be interrupted mid-run, so another replica may have run it as well
+            logger.warning("Job %s lost its lease while running", job.name)
+            run.error = run.error or "Lease lost while running"
+        self._runs[job.name].append(run)
+        return run
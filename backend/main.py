@@ -1,23 +1,53 @@
 ### MAIN ENTRY POINT FOR THE FASTAPI APP ###
+from startup import startup_profiler
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-import firebase_admin
-from firebase_admin import credentials
+import config
 
 security = HTTPBearer()
 
-# Initialize Firebase if not already done elsewhere
-cred = credentials.Certificate("./firebase_credentials.json")
-firebase_admin.initialize_app(cred)
-
 # Import routers from other files
-from user.routes import router as user_router
-from activity.routes import router as activity_router
-from utils.routes import router as utils_router
-##from events.routes import router as events_router
+with startup_profiler.phase("imports"):
+    from user.routes import router as user_router
+    from activity.routes import router as activity_router
+    from utils.routes import router as utils_router, load_facilities_geojson
+    ##from events.routes import router as events_router
+    from utils.write_coalescer import shutdown_coalescers
+    from database.client import init_firebase
+    from container import Container
+    from jobs.definitions import build_scheduler
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start-up and shutdown hooks for the app."""
+    # Initialize Firebase unless both data and auth run on the offline backends
+    with startup_profiler.phase("firebase_init"):
+        init_firebase()
+    with startup_profiler.phase("container"):
+        app.state.container = Container()
+        app.state.scheduler = build_scheduler(app.state.container)
+
+    # Heavy loads run in parallel after the server starts accepting connections; /ready gates traffic until
+    # the Firestore warm-up succeeds (the GeoJSON is retried in the background without holding it up)
+    db = app.state.container.db
+    warm_up = asyncio.create_task(startup_profiler.warm_up({
+        "firestore_warm_up": lambda: db.collection("sports").document("types").get(),
+        "geojson_load": load_facilities_geojson,
+    }, best_effort=["geojson_load"]))
+    if config.SCHEDULER_ENABLED:
+        app.state.scheduler.start()
+    yield
+    warm_up.cancel()
+    await app.state.scheduler.stop()
+    app.state.container.close()
+    # Commit writes still waiting in the coalescers (alerts, status write-backs) before the worker exits
+    shutdown_coalescers()
 
-app = FastAPI(title="SportsBuddies API")
+app = FastAPI(title="SportsBuddies API", lifespan=lifespan)
 
 # Add OpenAPI security definition
 app.swagger_ui_init_oauth = {
@@ -32,6 +62,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Message pagination cursors (see GET /activity/{id}/messages)
+    expose_headers=["X-Before-Cursor", "X-After-Cursor"],
 )
 
 # Include routers from different modules
@@ -49,6 +81,16 @@ async def root():
         "version": "1.0.0",
         "docs": "/docs"
     }
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness probe: 503 until start-up warm-ups have finished, then 200.
+    The body carries the start-up phase timings either way.
+    """
+    report = startup_profiler.report()
+    return JSONResponse(status_code=200 if report["ready"] else 503, content=report)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,17 @@
+"""
+One-off backfill of the participantCount field on existing activities.
+
+Usage (from the backend directory):
+    python -m scripts.backfill_participant_counts
+"""
+
+import firebase_admin
+from firebase_admin import credentials
+
+from activity.repositories.activity_repository import ActivityRepository
+
+
+if __name__ == "__main__":
+    firebase_admin.initialize_app(credentials.Certificate("./firebase_credentials.json"))
+    updated = ActivityRepository().backfill_participant_counts()
+    print(f"Backfilled participantCount on {updated} activities")
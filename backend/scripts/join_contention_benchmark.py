@@ -0,0 +1,96 @@
+"""
+Contention benchmark for join requests on a single hot activity.
+
+Fires concurrent join requests at one activity against the Firestore emulator,
+once through the read-modify-write transaction and once through the ArrayUnion
+transform, and reports throughput and failures for each.
+
+Usage (from the backend directory, with the emulator running):
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python -m scripts.join_contention_benchmark --joins 300
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from google.cloud import firestore
+
+from activity.models.activity import ActivityStatus
+from activity.repositories.activity_repository import ActivityRepository
+
+
+def seed_activity(repo: ActivityRepository, activity_id: str, max_participants: int) -> None:
+    """Create a fresh activity with no participants or join requests."""
+    repo.create(activity_id, {
+        "activityName": "Contention benchmark",
+        "sport": "Basketball",
+        "creator_id": "bench_creator",
+        "location": firestore.GeoPoint(1.3521, 103.8198),
+        "placeName": "Benchmark Court",
+        "dateTime": datetime.now(timezone.utc) + timedelta(days=1),
+        "maxParticipants": max_participants,
+        "status": ActivityStatus.AVAILABLE.value,
+        "participants": [],
+        "participantCount": 0,
+        "joinRequests": [],
+    })
+
+
+def join_with_transaction(repo: ActivityRepository, activity_id: str, user_id: str) -> None:
+    """The previous approach: read the whole document and rewrite the array."""
+    def update_func(activity):
+        if activity.add_join_request(user_id):
+            return {"joinRequests": activity.joinRequests}
+        return None
+
+    repo.update_activity_with_transaction(activity_id, update_func)
+
+
+def join_with_transform(repo: ActivityRepository, activity_id: str, user_id: str) -> None:
+    """The current approach: a blind ArrayUnion applied server-side."""
+    repo.add_join_request(activity_id, user_id)
+
+
+def run(repo: ActivityRepository, name: str, join_func, joins: int, workers: int) -> None:
+    activity_id = f"bench_{name}_{int(time.time())}"
+    seed_activity(repo, activity_id, max_participants=joins)
+
+    def attempt(i: int) -> bool:
+        try:
+            join_func(repo, activity_id, f"bench_user_{i}")
+            return True
+        except Exception:
+            return False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(attempt, range(joins)))
+    elapsed = time.perf_counter() - start
+
+    failures = results.count(False)
+    recorded = len(repo.get_by_id(activity_id).joinRequests)
+    print(f"{name:<12} joins={joins} workers={workers} elapsed={elapsed:.2f}s "
+          f"throughput={joins / elapsed:.1f}/s failed={failures} recorded={recorded}")
+
+    repo.delete(activity_id)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--joins", type=int, default=300, help="Number of concurrent join requests")
+    parser.add_argument("--workers", type=int, default=64, help="Number of client threads")
+    parser.add_argument("--project", default="sportsbuddies-bench", help="Emulator project ID")
+    args = parser.parse_args()
+
+    if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        raise SystemExit("FIRESTORE_EMULATOR_HOST is not set; refusing to run against a live project")
+
+    repo = ActivityRepository(db=firestore.Client(project=args.project))
+    run(repo, "transaction", join_with_transaction, args.joins, args.workers)
+    run(repo, "transform", join_with_transform, args.joins, args.workers)
+
+
+if __name__ == "__main__":
+    main()
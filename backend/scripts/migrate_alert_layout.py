@@ -0,0 +1,38 @@
+"""
+Moves existing alerts between the top-level alerts collection and per-user
+users/{uid}/alerts subcollections (see config.ALERT_STORAGE_LAYOUT).
+
+Run it once before switching ALERT_STORAGE_LAYOUT, then again after the switch
+to copy alerts written in between. Copies keep their IDs and alerts already in
+the target are skipped, so re-running is safe; pass --delete-source on the last
+run to remove the originals.
+
+Usage (from the backend directory):
+    python -m scripts.migrate_alert_layout --to user_subcollections --dry-run
+    python -m scripts.migrate_alert_layout --to user_subcollections
+    python -m scripts.migrate_alert_layout --to user_subcollections --delete-source
+"""
+
+import argparse
+
+import firebase_admin
+from firebase_admin import credentials
+
+from user.repositories.alert_repository import PER_USER, TOP_LEVEL, AlertRepository
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--to", dest="target", choices=[PER_USER, TOP_LEVEL], default=PER_USER,
+                        help="Layout to copy alerts into")
+    parser.add_argument("--delete-source", action="store_true", help="Delete each alert once it is copied")
+    parser.add_argument("--page-size", type=int, default=500, help="Alerts read per page")
+    parser.add_argument("--dry-run", action="store_true", help="Count alerts to copy without writing")
+    args = parser.parse_args()
+
+    firebase_admin.initialize_app(credentials.Certificate("./firebase_credentials.json"))
+    result = AlertRepository().migrate_layout(args.target, delete_source=args.delete_source,
+                                              page_size=args.page_size, dry_run=args.dry_run)
+    action = "Would copy" if args.dry_run else "Copied"
+    print(f"{action} {result['copied']} alerts to the {args.target} layout "
+          f"({result['skipped']} skipped, {result['commits']} commits, {result['duration_ms']} ms)")
@@ -0,0 +1,121 @@
+"""
+Start-up profiling and readiness tracking.
+
+Start-up is split into named phases (imports, client init, data loads,
+warm-ups) whose durations are recorded here. The app reports ready once
+the required warm-ups have succeeded, which is what /ready exposes to load
+balancers; failed warm-ups are retried with backoff until they do.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Phase:
+    name: str
+    duration_ms: float
+    status: str = "ok"
+    error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "duration_ms": round(self.duration_ms, 1),
+            "status": self.status,
+            "error": self.error,
+        }
+
+
+class StartupProfiler:
+    """Records start-up phase timings and whether the app is ready to serve."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: List[Phase] = []
+        self.ready = False
+        self.ready_after_ms: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time a block as a start-up phase; errors are recorded and re-raised."""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self._record(Phase(name, (time.perf_counter() - start) * 1000, "error", str(e)))
+            raise
+        self._record(Phase(name, (time.perf_counter() - start) * 1000))
+
+    async def warm_up(self, tasks: Dict[str, Callable[[], Any]], best_effort: Iterable[str] = ()) -> bool:
+        """
+        Run blocking warm-up tasks in parallel worker threads, each as its own phase.
+        
+        A failed task is retried with exponential backoff (STARTUP_RETRY_*)
+        until it succeeds; its latest failure stays in the report so /ready
+        explains why the worker is not serving. The app is marked ready once
+        every task not named in `best_effort` has succeeded.
+        """
+        best_effort = set(best_effort)
+        required = [name for name in tasks if name not in best_effort]
+
+        async def run(name, func):
+            delay = config.STARTUP_RETRY_BASE_SECONDS
+            while True:
+                try:
+                    with self.phase(name):
+                        await asyncio.to_thread(func)
+                    return
+                except Exception as e:
+                    logger.warning("Start-up warm-up %s failed, retrying in %.0fs: %s", name, delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, config.STARTUP_RETRY_MAX_SECONDS)
+
+        runs = {name: asyncio.create_task(run(name, func)) for name, func in tasks.items()}
+        try:
+            await asyncio.gather(*(runs[name] for name in required))
+            self.ready = True
+            self.ready_after_ms = (time.perf_counter() - self.started) * 1000
+            print(self.summary())
+            await asyncio.gather(*runs.values())
+        finally:
+            for task in runs.values():
+                task.cancel()
+        return self.ready
+
+    def summary(self) -> str:
+        """One-line timing report for the logs."""
+        parts = ", ".join(
+            f"{p.name} {p.duration_ms:.0f}ms" + ("" if p.status == "ok" else " (failed)")
+            for p in self.phases
+        )
+        state = f"ready after {self.ready_after_ms:.0f}ms" if self.ready else "not ready"
+        return f"Start-up: {parts}; {state}"
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            phases = [p.to_dict() for p in self.phases]
+        return {
+            "ready": self.ready,
+            "ready_after_ms": round(self.ready_after_ms, 1) if self.ready_after_ms is not None else None,
+            "phases": phases,
+        }
+
+    def _record(self, phase: Phase) -> None:
+        with self._lock:
+            # A retried phase replaces its earlier failure
+            self.phases = [p for p in self.phases if not (p.name == phase.name and p.status == "error")]
+            self.phases.append(phase)
+
+
+startup_profiler = StartupProfiler()
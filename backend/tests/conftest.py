@@ -0,0 +1,63 @@
+"""
+Shared fixtures for the offline test suite.
+
+The app runs against the in-memory data backend with stub tokens, so no
+Firebase project or network is needed. Every test creates its own users and
+activities under fresh IDs, since the in-memory client lives for the whole session.
+"""
+
+import os
+
+os.environ["DATA_BACKEND"] = "memory"
+os.environ["AUTH_BACKEND"] = "stub"
+
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+def auth(user_id: str) -> dict:
+    """Headers for a request made as `user_id` (stub tokens are "<uid>:<email>")."""
+    return {"Authorization": f"Bearer {user_id}:{user_id}@example.com"}
+
+
+@pytest.fixture(scope="session")
+def client():
+    from main import app
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def container(client):
+    return client.app.state.container
+
+
+@pytest.fixture
+def make_user(client):
+    """Create a user profile and return its ID."""
+    def make(name: str = "user") -> str:
+        user_id = f"{name}-{uuid.uuid4().hex[:8]}"
+        response = client.post("/user/create_user", headers=auth(user_id), json={
+            "firstName": name.title(), "lastName": "Test", "username": user_id, "phone": user_id,
+        })
+        assert response.status_code == 200, response.text
+        return user_id
+    return make
+
+
+@pytest.fixture
+def make_activity(client):
+    """Create an activity as `creator_id` and return its ID."""
+    def make(creator_id: str, max_participants: int = 4) -> str:
+        response = client.post("/activity/", headers=auth(creator_id), json={
+            "activityName": "Pick-up game", "type": "event", "price": 0, "sport": "Basketball",
+            "skillLevel": "beginner", "description": "Friendly game", "maxParticipants": max_participants,
+            "dateTime": (datetime.now(timezone.utc) + timedelta(days=7)).isoformat(),
+            "location": {"latitude": 1.3, "longitude": 103.8}, "placeName": "Court 1",
+        })
+        assert response.status_code == 200, response.text
+        return response.json()["activityId"]
+    return make
@@ -0,0 +1,114 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from conftest import auth
+from user.models.alert import Alert, AlertType
+from user.repositories.alert_repository import decode_alert_cursor, encode_alert_cursor
+
+
+def unread_count(client, user_id):
+    response = client.get("/user/alerts/count", headers=auth(user_id))
+    assert response.status_code == 200
+    return response.json()["unread_count"]
+
+
+def make_alerts(container, user_id, count, created_at=None, alert_type=AlertType.USER_LEFT):
+    start = created_at or datetime.now(timezone.utc)
+    alerts = [Alert(user_id=user_id, type=alert_type, message=f"alert {i}", activity_id="activity",
+                    activity_name="Game", sender_id="sender", created_at=start + timedelta(seconds=i))
+              for i in range(count)]
+    return container.alert_repository.create_many(alerts, wait=True)
+
+
+def test_unread_counter_follows_create_read_and_read_all(client, container, make_user):
+    user_id = make_user("reader")
+    alerts = make_alerts(container, user_id, 3)
+    assert unread_count(client, user_id) == 3
+
+    assert client.post(f"/user/alerts/{alerts[0].id}/read", headers=auth(user_id)).status_code == 200
+    assert unread_count(client, user_id) == 2
+    # Reading an alert again doesn't take it off the counter twice
+    client.post(f"/user/alerts/{alerts[0].id}/read", headers=auth(user_id))
+    assert unread_count(client, user_id) == 2
+
+    assert client.post("/user/alerts/read-all", headers=auth(user_id)).status_code == 200
+    assert unread_count(client, user_id) == 0
+    assert container.alert_repository.count_unread(user_id) == 0
+
+
+def test_thread_alert_counts_once_until_read(client, container, make_user):
+    user_id = make_user("member")
+    repository = container.alert_repository
+    for _ in range(3):
+        repository.bump_thread_alerts([Alert(user_id=user_id, type=AlertType.NEW_MESSAGE, message="hi",
+                                             activity_id="thread", activity_name="Game", sender_id="sender",
+                                             data={"message_preview": "hi"})], wait=True)
+    assert unread_count(client, user_id) == 1
+    thread = repository.get_by_user(user_id).alerts[0]
+    assert thread.data["message_count"] == 3
+
+    client.post(f"/user/alerts/{thread.id}/read", headers=auth(user_id))
+    assert unread_count(client, user_id) == 0
+    assert repository.get_by_id(thread.id, user_id).data["message_count"] == 0
+
+
+def test_unread_counter_matches_count_after_reconcile(client, container, make_user):
+    user_id = make_user("drifted")
+    make_alerts(container, user_id, 2)
+    container.db.collection("alert_counters").document(user_id).update({"unread": 7})
+
+    container.alert_repository.reconcile_unread_counts()
+
+    assert unread_count(client, user_id) == 2
+
+
+def test_alert_cursor_round_trip():
+    alert = Alert(id="a1", user_id="u", type=AlertType.USER_LEFT, message="m",
+                  created_at=datetime(2025, 5, 1, 12, 30, tzinfo=timezone.utc))
+
+    assert decode_alert_cursor(encode_alert_cursor(alert)) == {"created_at": alert.created_at, "__name__": "a1"}
+    with pytest.raises(ValueError):
+        decode_alert_cursor("not-a-cursor")
+
+
+def test_alert_pages_cover_every_alert_once(client, container, make_user):
+    user_id = make_user("pager")
+    created = make_alerts(container, user_id, 7)
+    # Alerts sharing a timestamp are ordered by ID instead of skipped or repeated
+    created += make_alerts(container, user_id, 1, created_at=created[2].created_at)
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"before": cursor} if cursor else {})}
+        response = client.get("/user/alerts", params=params, headers=auth(user_id))
+        assert response.status_code == 200
+        seen += [alert["id"] for alert in response.json()]
+        cursor = response.headers.get("X-Before-Cursor")
+        if not cursor:
+            break
+
+    assert sorted(seen) == sorted(alert.id for alert in created)
+    assert len(seen) == len(set(seen))
+
+
+def test_after_cursor_returns_only_newer_alerts(client, container, make_user):
+    user_id = make_user("catcher")
+    start = datetime.now(timezone.utc)
+    make_alerts(container, user_id, 2, created_at=start)
+    newest = client.get("/user/alerts", headers=auth(user_id)).headers["X-After-Cursor"]
+
+    newer = make_alerts(container, user_id, 3, created_at=start + timedelta(minutes=1))
+    response = client.get("/user/alerts", params={"after": newest, "limit": 2}, headers=auth(user_id))
+    # The oldest of the newer alerts come first, so a client catching up never skips any
+    assert [alert["id"] for alert in response.json()] == [newer[1].id, newer[0].id]
+
+    response = client.get("/user/alerts", params={"after": response.headers["X-After-Cursor"]},
+                          headers=auth(user_id))
+    assert [alert["id"] for alert in response.json()] == [newer[2].id]
+
+
+def test_malformed_alert_cursor_is_rejected(client, make_user):
+    user_id = make_user("client")
+
+    assert client.get("/user/alerts", params={"before": "garbage"}, headers=auth(user_id)).status_code == 400
@@ -0,0 +1,87 @@
+import time
+
+from conftest import auth
+from jobs.cascade import ACTIVITY_STEPS, DELETED_USER_ID, USER_STEPS
+from user.models.alert import Alert, AlertType
+
+
+def wait_for_job(container, job_id, timeout=5.0):
+    """Poll a clean-up job until it finishes; the jobs run on a background pool."""
+    deadline = time.monotonic() + timeout
+    while True:
+        job = container.cascade.get_job(job_id)
+        if (job and job["status"] != "running") or time.monotonic() > deadline:
+            return job
+        time.sleep(0.02)
+
+
+def send_message(client, activity_id, user_id, content):
+    response = client.post(f"/activity/{activity_id}/messages", json={"content": content}, headers=auth(user_id))
+    assert response.status_code == 200, response.text
+
+
+def test_activity_delete_job_cleans_up_messages_and_alerts(client, container, make_user, make_activity):
+    creator, watcher = make_user("creator"), make_user("watcher")
+    activity_id = make_activity(creator)
+    for i in range(3):
+        send_message(client, activity_id, creator, f"m{i}")
+    container.alert_repository.create_many([
+        Alert(user_id=watcher, type=AlertType.ACTIVITY_UPDATED, message="updated", activity_id=activity_id,
+              activity_name="Game", sender_id=creator)
+        for _ in range(2)
+    ], wait=True)
+    assert container.alert_repository.get_unread_count(watcher) == 2
+
+    response = client.delete(f"/activity/{activity_id}", headers=auth(creator))
+    assert response.status_code == 200
+    job_id = response.json()["cleanupJobId"]
+    job = wait_for_job(container, job_id)
+
+    assert job_id == f"activity:{activity_id}"
+    assert job["kind"] == "activity" and job["target_id"] == activity_id
+    assert job["status"] == "done" and job["error"] is None
+    assert all(job["steps"][step]["done"] for step in ACTIVITY_STEPS)
+    assert job["steps"]["messages"]["count"] == 3
+    assert job["steps"]["alerts"]["count"] == 2
+    assert container.activity_repository.get_by_id(activity_id) is None
+    assert container.message_repository.get_by_activity(activity_id).messages == []
+    assert container.alert_repository.get_unread_count(watcher) == 0
+    # A finished job is not run again
+    assert container.cascade.run(job_id)["finished_at"] == job["finished_at"]
+
+
+def test_user_delete_job_cleans_up_everything_they_touched(client, container, make_user, make_activity):
+    leaving, organiser = make_user("leaving"), make_user("organiser")
+    own_activity = make_activity(leaving)
+    joined_activity = make_activity(organiser)
+    requested_activity = make_activity(organiser)
+    activities = container.activity_repository
+    activities.add_join_request(joined_activity, leaving)
+    activities.approve_join_request(joined_activity, leaving)
+    activities.add_join_request(requested_activity, leaving)
+    send_message(client, joined_activity, leaving, "see you there")
+    container.alert_repository.writer.flush()
+    participants_before = container.db.collection("activities").document(joined_activity).get().get("participantCount")
+
+    response = client.delete("/user/delete_account", headers=auth(leaving))
+    assert response.status_code == 200
+    job_id = response.json()["cleanupJobId"]
+    job = wait_for_job(container, job_id)
+
+    assert job_id == f"user:{leaving}"
+    assert job["kind"] == "user" and job["status"] == "done"
+    assert all(job["steps"][step]["done"] for step in USER_STEPS)
+    # Their own activities are deleted by child jobs
+    child = wait_for_job(container, f"activity:{own_activity}")
+    assert child["parent"] == job_id and child["status"] == "done"
+    assert activities.get_by_id(own_activity) is None
+
+    joined = container.db.collection("activities").document(joined_activity).get()
+    assert leaving not in joined.get("participants")
+    assert joined.get("participantCount") == participants_before - 1
+    assert leaving not in activities.get_by_id(requested_activity).joinRequests
+    messages = container.message_repository.get_by_activity(joined_activity).messages
+    assert [message.sender_id for message in messages] == [DELETED_USER_ID]
+    # The thread alert they caused for the organiser is gone, and so is their own counter
+    assert container.alert_repository.get_unread_count(organiser) == 0
+    assert not container.db.collection("alert_counters").document(leaving).get().exists
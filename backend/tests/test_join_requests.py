@@ -0,0 +1,58 @@
+from conftest import auth
+
+
+def join(client, activity_id, user_id):
+    return client.post(f"/activity/{activity_id}/join", headers=auth(user_id))
+
+
+def approve(client, activity_id, creator_id, user_id):
+    return client.post(f"/activity/{activity_id}/approve/{user_id}", headers=auth(creator_id))
+
+
+def test_approve_moves_request_to_participants(client, container, make_user, make_activity):
+    creator, requester = make_user("creator"), make_user("requester")
+    activity_id = make_activity(creator)
+    assert join(client, activity_id, requester).status_code == 200
+
+    assert approve(client, activity_id, creator, requester).status_code == 200
+
+    activity = container.activity_repository.get_by_id(activity_id)
+    assert requester in activity.participants
+    assert requester not in activity.joinRequests
+    stored = container.db.collection("activities").document(activity_id).get()
+    assert stored.get("participantCount") == len(activity.participants)
+
+
+def test_approve_stops_at_capacity(client, container, make_user, make_activity):
+    creator = make_user("creator")
+    activity_id = make_activity(creator, max_participants=2)
+    room = 2 - len(container.activity_repository.get_by_id(activity_id).participants)
+    requesters = [make_user("requester") for _ in range(room + 1)]
+    for requester in requesters:
+        assert join(client, activity_id, requester).status_code == 200
+
+    for requester in requesters[:room]:
+        assert approve(client, activity_id, creator, requester).status_code == 200
+    response = approve(client, activity_id, creator, requesters[-1])
+
+    assert response.status_code == 400
+    assert "full" in response.json()["detail"]
+    activity = container.activity_repository.get_by_id(activity_id)
+    assert len(activity.participants) == 2
+    assert requesters[-1] in activity.joinRequests
+
+
+def test_approve_without_request_is_rejected(client, container, make_user, make_activity):
+    creator, stranger = make_user("creator"), make_user("stranger")
+    activity_id = make_activity(creator)
+
+    assert approve(client, activity_id, creator, stranger).status_code == 400
+    assert stranger not in container.activity_repository.get_by_id(activity_id).participants
+
+
+def test_only_creator_can_approve(client, make_user, make_activity):
+    creator, requester, other = make_user("creator"), make_user("requester"), make_user("other")
+    activity_id = make_activity(creator)
+    join(client, activity_id, requester)
+
+    assert approve(client, activity_id, other, requester).status_code == 403
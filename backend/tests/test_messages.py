@@ -0,0 +1,62 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import config
+from activity.models.message import Message
+from activity.repositories.message_repository import MessageRepository
+
+
+@pytest.fixture(params=["documents", "buckets"])
+def thread(request, container, monkeypatch):
+    """A repository in each storage mode and a thread of 11 messages, oldest first."""
+    # Small buckets, so paging crosses bucket boundaries
+    monkeypatch.setattr(config, "MESSAGE_BUCKET_MAX_MESSAGES", 4)
+    repository = MessageRepository(container.db, storage=request.param)
+    activity_id = f"thread-{uuid.uuid4().hex[:8]}"
+    start = datetime.now(timezone.utc)
+    messages = [repository.create(Message(activity_id=activity_id, sender_id="sender", sender_name="Sender",
+                                          content=f"m{i}", created_at=start + timedelta(seconds=i)))
+                for i in range(11)]
+    return repository, activity_id, messages
+
+
+def contents(page):
+    return [message.content for message in page.messages]
+
+
+def test_before_cursor_pages_back_through_every_message(thread):
+    repository, activity_id, messages = thread
+
+    page = repository.get_by_activity(activity_id, limit=3)
+    seen = contents(page)
+    while page.before:
+        page = repository.get_by_activity(activity_id, limit=3, before=page.before)
+        seen = contents(page) + seen
+
+    assert seen == [message.content for message in messages]
+
+
+def test_after_cursor_returns_new_messages_in_order(thread):
+    repository, activity_id, messages = thread
+    newest = repository.get_by_activity(activity_id, limit=5).after
+    assert repository.get_by_activity(activity_id, after=newest).messages == []
+
+    start = messages[-1].created_at
+    for i in range(3):
+        repository.create(Message(activity_id=activity_id, sender_id="sender", sender_name="Sender",
+                                  content=f"n{i}", created_at=start + timedelta(minutes=1, seconds=i)))
+    page = repository.get_by_activity(activity_id, limit=2, after=newest)
+    assert contents(page) == ["n0", "n1"]
+    assert contents(repository.get_by_activity(activity_id, limit=2, after=page.after)) == ["n2"]
+
+
+def test_invalid_message_cursors_are_rejected(thread):
+    repository, activity_id, _ = thread
+    page = repository.get_by_activity(activity_id, limit=3)
+
+    with pytest.raises(ValueError):
+        repository.get_by_activity(activity_id, before=page.before, after=page.after)
+    with pytest.raises(ValueError):
+        repository.get_by_activity(activity_id, before="0:unknown-message")
@@ -2,23 +2,29 @@ from typing import Dict, List, Optional
 from fastapi import HTTPException, UploadFile
 from user.repositories.user_repository import UserRepository
 from user.services.image_service import ImageService
+from jobs.cascade import CascadeDeleter
 from user.models.user import User
 from user.schemas import UserPreferences, UpdateProfileRequest
 from firebase_admin import firestore
+from database.client import get_client
+from database.telemetry import run_query
+from user.repositories.user_repository import BY_USERNAME
 from fastapi import  HTTPException
 
 class UserController:
     """Controller for user-related operations"""
     
-    def __init__(self):
-        self.repository = UserRepository()
-        self.image_service = ImageService()
-        self.db = firestore.client()
+    def __init__(self, repository: Optional[UserRepository] = None, image_service: Optional[ImageService] = None,
+                 cascade: Optional[CascadeDeleter] = None):
+        self.repository = repository or UserRepository()
+        self.image_service = image_service or ImageService()
+        self.db = self.repository.db
+        self.cascade = cascade or CascadeDeleter(self.db)
         self.users_collection = self.db.collection("users")
 
     async def get_by_username(self, username: str):
-      query = self.users_collection.where("username", "==", username).limit(1).stream()
-      docs = list(query)  # Works fine, no need for async
+      query = self.users_collection.where("username", "==", username).limit(1)
+      docs = run_query(query, BY_USERNAME)
       if not docs:
           return None
       doc = docs[0]
@@ -95,13 +101,14 @@ class UserController:
         return {"message": "Profile updated successfully"}
     
     def delete_account(self, user_id: str) -> Dict:
-        """Delete user account"""
+        """Delete user account; their activities, memberships, alerts and messages are cleaned up in the background"""
         # First check if user exists
         self.get_user(user_id)
         
         # Delete user
-        self.repository.delete(user_id)
-        return {"message": "Account deleted successfully"}
+        job_id = self.cascade.delete_user(user_id)
+        self.repository.invalidate(user_id)
+        return {"message": "Account deleted successfully", "cleanupJobId": job_id}
     
     def check_username_availability(self, username: str) -> Dict:
         """Check if username is available"""
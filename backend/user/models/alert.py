@@ -12,6 +12,9 @@ class AlertType(str, Enum):
     NEW_MESSAGE = "new_message"
     USER_REMOVED = "user_removed"
 
+# Shown instead of the stored message once a thread alert covers several unread messages
+THREAD_SUMMARY_MESSAGE = "{message_count} new messages in {activity_name}. Latest from {sender_name}: \"{message_preview}\""
+
 class Alert:
     """Model for user notifications/alerts."""
     
@@ -30,6 +33,8 @@ class Alert:
         read: bool = False,
         data: Dict[str, Any] = None,
         response_status: Optional[str] = None,
+        expire_at: Optional[datetime] = None,
+        updated_at: Optional[datetime] = None,
     ):
         self.id = id
         self.user_id = user_id  # ID of user receiving the alert
@@ -44,15 +49,24 @@ class Alert:
         self.read = read
         self.data = data or {}  # Additional data specific to alert type
         self.response_status = response_status
+        self.expire_at = expire_at  # Deleted by the Firestore TTL policy after this time
+        self.updated_at = updated_at  # Commit time of the last write, set by the server
     
     @classmethod
     def from_dict(cls, id: str, data: Dict) -> 'Alert':
         """Create Alert object from Firestore document."""
+        message = data.get('message', '')
+        extra = data.get('data') or {}
+        if data.get('type') == AlertType.NEW_MESSAGE and (extra.get('message_count') or 0) > 1:
+            message = THREAD_SUMMARY_MESSAGE.format(
+                message_count=extra['message_count'], activity_name=data.get('activity_name'),
+                sender_name=data.get('sender_name'), message_preview=extra.get('message_preview', '')
+            )
         return cls(
             id=id,
             user_id=data.get('user_id', ''),
             type=data.get('type', AlertType.JOIN_REQUEST),
-            message=data.get('message', ''),
+            message=message,
             activity_id=data.get('activity_id'),
             activity_name=data.get('activity_name'),
             sender_id=data.get('sender_id'),
@@ -61,7 +75,9 @@ class Alert:
             created_at=data.get('created_at'),
             read=data.get('read', False),
             data=data.get('data', {}),
-            response_status=data.get('response_status')
+            response_status=data.get('response_status'),
+            expire_at=data.get('expireAt'),
+            updated_at=data.get('updated_at')
         )
     
     def to_dict(self) -> Dict:
@@ -79,5 +95,7 @@ class Alert:
             'created_at': self.created_at,
             'read': self.read,
             'data': self.data,
-            'response_status': self.response_status
+            'response_status': self.response_status,
+            'expireAt': self.expire_at,
+            'updated_at': self.updated_at
         }
\ No newline at end of file
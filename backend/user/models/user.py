@@ -22,7 +22,7 @@ class User:
     @classmethod
     def from_dict(cls, uid: str, data: dict):
         """Create a User object from a Firestore document"""
-        return cls(
+        user = cls(
             uid=uid,
             email=data.get("email", ""),
             first_name=data.get("firstName", ""),
@@ -33,6 +33,8 @@ class User:
             preferences_set=data.get("preferences_set", False),
             created_at=data.get("createdAt")
         )
+        user.preferences = data.get("preferences", {})
+        return user
     
     def to_dict(self):
         """Convert User object to dictionary for Firestore"""
@@ -1,107 +1,887 @@
-from typing import List, Dict, Optional
+import base64
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition
 from user.models.alert import Alert, AlertType
-from datetime import datetime
+from utils.write_coalescer import PendingWrite, WriteCoalescer, get_coalescer
+from database.client import get_client
+from database.query_shapes import QueryShape, register_shape, register_ttl_field, ASCENDING, DESCENDING
+from database.telemetry import run_count, run_query
+from database.bulk import BulkCommitter, BulkResult, drain_query
+from datetime import datetime, timedelta, timezone
+import config
+
+# Per-user unread alert counters: alert_counters/{user_id} = {"unread": int, "seeded": bool,
+# "unread_threads": {alert_id: True}}. Thread alerts (NEW_MESSAGE) are rewritten on every
+# message without being read first, so they are flagged by ID instead of counted.
+COUNTER_COLLECTION = "alert_counters"
+
+# Alert storage layouts, chosen with config.ALERT_STORAGE_LAYOUT
+TOP_LEVEL = "collection"          # alerts/{alert_id}, filtered by user_id
+PER_USER = "user_subcollections"  # users/{user_id}/alerts/{alert_id}
+
+# Per-user layout form of each alerts shape, by the top-level shape's name
+_PER_USER_SHAPES: Dict[str, QueryShape] = {}
+
+def alert_shape(shape: QueryShape) -> QueryShape:
+    """
+    Register a query shape on the top-level alerts collection together with its
+    per-user layout form: queries on one user's alerts drop the user_id filter,
+    and queries across users become collection group queries.
+    """
+    register_shape(shape)
+    name = shape.name.replace("alerts.", "user_alerts.", 1)
+    if "user_id" in shape.equality:
+        nested = replace(shape, name=name, equality=tuple(f for f in shape.equality if f != "user_id"))
+    else:
+        nested = replace(shape, name=name, collection_group=True)
+    _PER_USER_SHAPES[shape.name] = register_shape(nested)
+    return shape
+
+def layout_shape(shape: QueryShape, layout: Optional[str] = None) -> QueryShape:
+    """The form of an alerts shape that queries in `layout` (default: configured) actually run."""
+    if (layout or config.ALERT_STORAGE_LAYOUT) == PER_USER:
+        return _PER_USER_SHAPES[shape.name]
+    return shape
+
+def user_alerts(db, user_id: str, layout: Optional[str] = None):
+    """Collection that holds a user's alert documents."""
+    if (layout or config.ALERT_STORAGE_LAYOUT) == PER_USER:
+        return db.collection("users").document(user_id).collection("alerts")
+    return db.collection("alerts")
+
+def user_alerts_query(db, user_id: str, layout: Optional[str] = None):
+    """Query over one user's alerts."""
+    if (layout or config.ALERT_STORAGE_LAYOUT) == PER_USER:
+        return user_alerts(db, user_id, PER_USER)
+    return db.collection("alerts").where("user_id", "==", user_id)
+
+def all_alerts(db, layout: Optional[str] = None):
+    """Query over every user's alerts."""
+    if (layout or config.ALERT_STORAGE_LAYOUT) == PER_USER:
+        return db.collection_group("alerts")
+    return db.collection("alerts")
+
+# Query shapes emitted by this repository (see database.indexes)
+BY_USER = alert_shape(QueryShape(
+    "alerts.by_user", "alerts",
+    equality=("user_id",), optional_equality=("read",),
+    order_by=(("created_at", DESCENDING),)
+))
+NEWER_FOR_USER = alert_shape(QueryShape(
+    "alerts.newer_for_user", "alerts",
+    equality=("user_id",), optional_equality=("read",),
+    order_by=(("created_at", ASCENDING),)
+))
+UPDATED_SINCE = alert_shape(QueryShape(
+    "alerts.updated_since", "alerts",
+    equality=("user_id",), range="updated_at",
+    order_by=(("updated_at", ASCENDING),)
+))
+UNREAD = alert_shape(QueryShape("alerts.unread", "alerts", equality=("user_id", "read")))
+UNREAD_THREADS = alert_shape(QueryShape("alerts.unread_threads", "alerts", equality=("user_id", "read", "type")))
+ALL_FOR_USER = alert_shape(QueryShape("alerts.all_for_user", "alerts", equality=("user_id",)))
+JOIN_REQUEST = alert_shape(QueryShape(
+    "alerts.join_request", "alerts", equality=("user_id", "sender_id", "activity_id", "type")
+))
+ALL_COUNTERS = register_shape(QueryShape("alert_counters.all", COUNTER_COLLECTION))
+EXPIRED = alert_shape(QueryShape("alerts.expired", "alerts", range="expireAt"))
+ALL_ALERTS = alert_shape(QueryShape("alerts.all", "alerts", optional_equality=("read",)))
+register_ttl_field("alerts", "expireAt")
+
+# Days an alert is kept (while unread, after being read) where the defaults don't fit.
+# None keeps it until it is read: a pending join request must not vanish before the creator answers.
+RETENTION_DAYS = {
+    AlertType.JOIN_REQUEST: (None, config.ALERT_RETENTION_READ_DAYS),
+    AlertType.NEW_MESSAGE: (60, 7),
+    AlertType.ACTIVITY_UPDATED: (60, 14),
+}
+
+def get_alert_writer(db) -> WriteCoalescer:
+    """Return the process-wide alert write coalescer, shared by every AlertRepository."""
+    return get_coalescer(
+        "alerts", db,
+        max_batch_writes=config.ALERT_BATCH_MAX_WRITES,
+        flush_interval=config.ALERT_BATCH_FLUSH_INTERVAL,
+        max_pending=config.ALERT_BATCH_MAX_PENDING
+    )
+
+def unread_counter_ref(db, user_id: str):
+    """Reference to a user's unread alert counter document."""
+    return db.collection(COUNTER_COLLECTION).document(user_id)
+
+def unread_total(counter: Dict[str, Any]) -> int:
+    """Unread alerts recorded on a counter document."""
+    return max(0, counter.get("unread") or 0) + len(counter.get("unread_threads") or {})
+
+def counter_claim(alert: Alert) -> Dict[str, Any]:
+    """Counter update for a new unread alert; setting a thread's flag again is a no-op."""
+    if alert.type == AlertType.NEW_MESSAGE:
+        return {"unread_threads": {alert.id: True}}
+    return {"unread": firestore.Increment(1)}
+
+def counter_release(alert_id: str, alert_type: str) -> Dict[str, Any]:
+    """Counter update for an unread alert being read or deleted."""
+    if alert_type == AlertType.NEW_MESSAGE:
+        return {"unread_threads": {alert_id: firestore.DELETE_FIELD}}
+    return {"unread": firestore.Increment(-1)}
+
+def release_unread(releases: Dict[str, Dict[str, Any]], user_id: str, alert_id: str, alert_type: str) -> None:
+    """Record in `releases` that an unread alert is being read or deleted (see adjust_unread_counts)."""
+    release = releases.setdefault(user_id, {})
+    if alert_type == AlertType.NEW_MESSAGE:
+        release.setdefault("unread_threads", {})[alert_id] = firestore.DELETE_FIELD
+    else:
+        release["unread"] = release.get("unread", 0) - 1
+
+def adjust_unread_counts(db, releases: Dict[str, Dict[str, Any]]) -> None:
+    """
+    Apply per-user counter releases collected with release_unread, in batches.
+    Used by bulk paths that change other users' alerts (e.g. cascade deletes).
+    """
+    with BulkCommitter(db) as committer:
+        for user_id, release in releases.items():
+            update = dict(release)
+            if update.get("unread"):
+                update["unread"] = firestore.Increment(update["unread"])
+            else:
+                update.pop("unread", None)
+            if update:
+                committer.set(unread_counter_ref(db, user_id), update, merge=True)
+
+def alert_expire_at(alert_type: str, read: bool, since: Optional[datetime] = None) -> Optional[datetime]:
+    """
+    When an alert of this type and read state should be deleted by the
+    Firestore TTL policy on expireAt, counting from `since` (default now).
+    """
+    try:
+        unread_days, read_days = RETENTION_DAYS.get(
+            AlertType(alert_type), (config.ALERT_RETENTION_UNREAD_DAYS, config.ALERT_RETENTION_READ_DAYS)
+        )
+    except ValueError:
+        unread_days, read_days = config.ALERT_RETENTION_UNREAD_DAYS, config.ALERT_RETENTION_READ_DAYS
+    days = read_days if read else unread_days
+    if days is None:
+        return None
+    since = since or datetime.now(timezone.utc)
+    if since.tzinfo is None:
+        # Firestore stores naive datetimes as UTC
+        since = since.replace(tzinfo=timezone.utc)
+    return since + timedelta(days=days)
+
+def read_updates(alert_type: str, now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Fields changed when an alert is read; a thread alert's message count starts over."""
+    updates = {"read": True, "expireAt": alert_expire_at(alert_type, True, now),
+               "updated_at": firestore.SERVER_TIMESTAMP}
+    if alert_type == AlertType.NEW_MESSAGE:
+        updates["data.message_count"] = 0
+    return updates
+
+def encode_alert_cursor(alert: Alert) -> str:
+    """Opaque, URL-safe cursor for an alert's place in its owner's list: its (created_at, ID)."""
+    created_at = alert.created_at if alert.created_at.tzinfo else alert.created_at.replace(tzinfo=timezone.utc)
+    raw = f"{created_at.astimezone(timezone.utc).isoformat()}|{alert.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_alert_cursor(cursor: str) -> Dict[str, Any]:
+    """Cursor fields for start_after() on a query ordered by created_at, then document ID."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, _, alert_id = raw.partition("|")
+        if not alert_id:
+            raise ValueError(cursor)
+        return {"created_at": datetime.fromisoformat(created_at), "__name__": alert_id}
+    except ValueError:
+        raise ValueError(f"Unknown alert cursor: {cursor}")
+
+def alert_key(alert_type: str, activity_id: Optional[str], sender_id: Optional[str], user_id: str) -> Optional[str]:
+    """
+    Natural document ID for alert types that happen at most once per key,
+    so they can be read, updated and deleted directly instead of queried.
+    Returns None for types that repeat (updates, responses, departures), which get random IDs.
+    
+    - join_request:{activity}:{requester}: a user's pending request to join
+    - new_message:{activity}:{recipient}: a recipient's thread alert
+    - activity_cancelled:{activity}:{participant}
+    """
+    if not activity_id:
+        return None
+    alert_type = AlertType(alert_type)
+    if alert_type == AlertType.JOIN_REQUEST:
+        return f"join_request:{activity_id}:{sender_id}"
+    if alert_type == AlertType.NEW_MESSAGE:
+        return f"new_message:{activity_id}:{user_id}"
+    if alert_type == AlertType.ACTIVITY_CANCELLED:
+        return f"activity_cancelled:{activity_id}:{user_id}"
+    return None
+
+@dataclass
+class AlertPage:
+    """
+    One page of a user's alerts, newest first.
+    
+    Attributes:
+        alerts: The page's alerts, newest first.
+        before: Cursor for the page of older alerts, or None if there are none.
+        after: Cursor for fetching alerts newer than this page (the newest alert seen).
+    """
+    alerts: List[Alert]
+    before: Optional[str]
+    after: Optional[str]
+
 
 class AlertRepository:
-    """Repository for alert operations."""
+    """
+    Repository for alert operations.
     
-    def __init__(self):
-        self.db = firestore.client()
-        self.collection = self.db.collection("alerts")
+    Alerts are stored either in the top-level alerts collection or under
+    users/{uid}/alerts (see TOP_LEVEL and PER_USER). In the per-user layout
+    an alert can only be addressed together with its owner, so methods taking
+    an alert ID also take the owner's user_id.
+    """
     
-    def create(self, alert: Alert) -> Alert:
-        """Create a new alert."""
-        if not alert.created_at:
-            alert.created_at = datetime.now()
-            
-        doc_ref = self.collection.document()
-        alert.id = doc_ref.id
-        doc_ref.set(alert.to_dict())
+    # Attempts at recounting a counter that keeps changing while it is counted
+    MAX_RECOUNT_ATTEMPTS = 5
+    
+    def __init__(self, db=None, events=None, layout: Optional[str] = None):
+        self.db = db or get_client()
+        self.layout = layout or config.ALERT_STORAGE_LAYOUT
+        self.writer = get_alert_writer(self.db)
+        # AlertEventBus notified of committed changes, for streaming clients
+        self.events = events
+    
+    def create(self, alert: Alert, wait: bool = False) -> Alert:
+        """
+        Create a new alert.
+        
+        The write is queued on the shared coalescer and committed with other alerts
+        in a batch shortly after, so this returns without waiting on Firestore
+        unless `wait` is set, in which case a failed commit is raised.
+        """
+        future = self.writer.submit(self._alert_writes(alert))
+        self._publish_when_committed(future, [alert])
+        if wait:
+            future.result()
         return alert
     
-    def get_by_id(self, alert_id: str) -> Optional[Alert]:
-        """Get an alert by ID."""
-        doc_ref = self.collection.document(alert_id)
+    def create_many(self, alerts: List[Alert], already_unread: Iterable[str] = (), wait: bool = False) -> List[Alert]:
+        """
+        Create (or overwrite, for alerts with an ID) alerts for many recipients at once.
+        
+        The writes are queued on the coalescer in submissions of up to one
+        batch each, so a large fan-out commits in a few batches instead of
+        one write per recipient.
+        
+        Args:
+            alerts: Alerts to write; those without an ID get a new one
+            already_unread: IDs of alerts being overwritten that were already
+                unread, so their owners' unread counters are not incremented again
+            wait: Block until every batch commits and raise the first failure
+        """
+        already_unread = set(already_unread)
+        return self._submit(alerts, lambda alert: self._alert_writes(alert, count_unread=alert.id not in already_unread),
+                            wait)
+    
+    def bump_thread_alerts(self, alerts: List[Alert], wait: bool = False) -> List[Alert]:
+        """
+        Fold new-message alerts into each recipient's thread alert, without reading it.
+        
+        Each alert is merged into the stored thread alert (see alert_key): the
+        latest preview and sender replace the old ones, it moves to the top and
+        becomes unread, and data.message_count is incremented on the server, so
+        concurrent messages never lose a count. The count is reset when the
+        alert is read; its owner's counter flags the thread rather than counting it.
+        """
+        return self._submit(alerts, self._thread_writes, wait)
+    
+    def create_if(self, alert: Alert, condition: Callable[[Any], bool]) -> bool:
+        """
+        Create (or overwrite) a keyed alert in a transaction, only if `condition` holds.
+        
+        `condition` is called with the transaction and may read other documents
+        through it (e.g. the activity the alert is about), so a concurrent change
+        to those documents cannot slip in between the check and the write. An
+        alert already written for the same outbox event (data.event_id) is left
+        alone, and an overwritten alert that was unread is not counted twice.
+        
+        Returns:
+            True if the alert exists afterwards, False if `condition` declined it.
+        """
+        doc_ref = self._doc(alert.id, alert.user_id)
+        self.writer.wait_for([doc_ref])
+        event_id = alert.data.get("event_id")
+        created = {}
+
+        @firestore.transactional
+        def create_in_transaction(transaction):
+            created.clear()
+            if not condition(transaction):
+                return False
+            doc = doc_ref.get(transaction=transaction)
+            existing = doc.to_dict() if doc.exists else None
+            if existing and event_id and (existing.get("data") or {}).get("event_id") == event_id:
+                return True
+            for write in self._alert_writes(alert, count_unread=not (existing and not existing.get("read"))):
+                transaction.set(write.reference, write.data, merge=write.merge)
+            created["alert"] = alert
+            return True
+
+        if not create_in_transaction(self.db.transaction()):
+            return False
+        if created:
+            self._publish(alert.user_id, "alert", alert.to_dict())
+        return True
+    
+    def _submit(self, alerts: List[Alert], writes_of: Callable[[Alert], List[PendingWrite]],
+                wait: bool = False) -> List[Alert]:
+        """Queue the writes of many alerts in submissions of up to one batch each."""
+        futures = []
+        chunk: List[PendingWrite] = []
+        chunk_alerts: List[Alert] = []
+        for alert in alerts:
+            writes = writes_of(alert)
+            if len(chunk) + len(writes) > self.writer.max_batch_writes:
+                futures.append(self.writer.submit(chunk))
+                self._publish_when_committed(futures[-1], chunk_alerts)
+                chunk, chunk_alerts = [], []
+            chunk.extend(writes)
+            chunk_alerts.append(alert)
+        if chunk:
+            futures.append(self.writer.submit(chunk))
+            self._publish_when_committed(futures[-1], chunk_alerts)
+        if wait:
+            for future in futures:
+                future.result()
+        return alerts
+    
+    def get_by_id(self, alert_id: str, user_id: Optional[str] = None) -> Optional[Alert]:
+        """Get an alert by ID (and owner, required in the per-user layout)."""
+        doc_ref = self._doc(alert_id, user_id)
         doc = doc_ref.get()
         if doc.exists:
             return Alert.from_dict(doc.id, doc.to_dict())
         return None
     
+    def get_many(self, alerts: List[Alert]) -> Dict[str, Alert]:
+        """Get the stored versions of alerts (by ID and owner) in one round trip, keyed by ID."""
+        if not alerts:
+            return {}
+        refs = [self._doc(alert.id, alert.user_id) for alert in alerts]
+        return {doc.id: Alert.from_dict(doc.id, doc.to_dict()) for doc in self.db.get_all(refs) if doc.exists}
+    
     def get_by_user(self, user_id: str, limit: int = 50, 
-                    unread_only: bool = False) -> List[Alert]:
-        """Get alerts for a specific user, sorted by created_at desc."""
-        query = self.collection.where("user_id", "==", user_id)
+                    unread_only: bool = False,
+                    before: Optional[str] = None,
+                    after: Optional[str] = None) -> AlertPage:
+        """
+        Get a page of a user's alerts, sorted by created_at desc.
+        
+        Alerts are ordered by (created_at, ID), so alerts sharing a timestamp
+        are neither skipped nor repeated across pages. Cursors come from
+        earlier pages: `before` pages back through older alerts, `after`
+        returns the alerts created since (the oldest `limit` of them, so a
+        client catching up never skips any).
+        
+        Raises:
+            ValueError: If both cursors are given or a cursor is malformed.
+        """
+        if before and after:
+            raise ValueError("Pass either before or after, not both")
+        query = self._query(user_id)
         
         if unread_only:
             query = query.where("read", "==", False)
+        
+        direction = firestore.Query.ASCENDING if after else firestore.Query.DESCENDING
+        query = query.order_by("created_at", direction=direction).order_by("__name__", direction=direction)
+        if before or after:
+            query = query.start_after(decode_alert_cursor(before or after))
+        
+        if limit:
+            # One extra document tells whether there is another page
+            query = query.limit(limit + 1)
             
-        query = query.order_by("created_at", direction=firestore.Query.DESCENDING)
+        shape = self._shape(NEWER_FOR_USER if after else BY_USER).variant(equality=("read",) if unread_only else ())
+        docs = run_query(query, shape)
+        has_more = bool(limit) and len(docs) > limit
+        alerts = [Alert.from_dict(doc.id, doc.to_dict()) for doc in docs[:limit or None]]
+        if after:
+            alerts.reverse()
+        
+        older = encode_alert_cursor(alerts[-1]) if alerts and has_more and not after else None
+        newest = encode_alert_cursor(alerts[0]) if alerts else after
+        return AlertPage(alerts, older, newest)
+    
+    def get_updated_since(self, user_id: str, since: datetime, limit: int = 50) -> List[Alert]:
+        """
+        Get a user's alerts created or changed after `since`, oldest change first.
         
+        updated_at is the server commit time, so passing the updated_at of the
+        last alert returned never skips a later write. Deleted alerts are not
+        reported; alerts written before updated_at existed appear once they change.
+        """
+        query = self._query(user_id).where("updated_at", ">", since).order_by("updated_at")
         if limit:
             query = query.limit(limit)
-            
-        docs = query.stream()
+        docs = run_query(query, self._shape(UPDATED_SINCE))
         return [Alert.from_dict(doc.id, doc.to_dict()) for doc in docs]
     
-    def mark_as_read(self, alert_id: str) -> bool:
+    def mark_as_read(self, alert_id: str, user_id: Optional[str] = None) -> bool:
         """Mark an alert as read."""
-        doc_ref = self.collection.document(alert_id)
-        doc_ref.update({"read": True})
-        return True
+        return self._change_alert(alert_id, {"read": True}, user_id)
     
-    def mark_all_as_read(self, user_id: str) -> int:
-        """Mark all alerts for a user as read, returns count of updated alerts."""
-        batch = self.db.batch()
-        unread_alerts = self.collection.where("user_id", "==", user_id).where("read", "==", False).stream()
+    def mark_all_as_read(self, user_id: str, parallelism: Optional[int] = None) -> BulkResult:
+        """
+        Mark all alerts for a user as read.
         
-        count = 0
-        for doc in unread_alerts:
-            batch.update(doc.reference, {"read": True})
-            count += 1
-            
-        if count > 0:
-            batch.commit()
-        return count
+        Unread alerts are streamed a page at a time and updated in parallel
+        batches of at most 500 writes, so any number of alerts can be handled.
+        
+        Returns:
+            BulkResult: count of updated alerts, commits and duration.
+        """
+        # Include alerts still waiting in the write coalescer
+        self.writer.flush()
+        query = self._query(user_id).where("read", "==", False)
+        now = datetime.now(timezone.utc)
+        releases: Dict[str, Dict[str, Any]] = {}
+
+        def mark_read(committer: BulkCommitter, doc) -> None:
+            alert_type = doc.to_dict().get("type")
+            release_unread(releases, user_id, doc.id, alert_type)
+            committer.update(doc.reference, read_updates(alert_type, now))
+
+        result = drain_query(self.db, query, self._shape(UNREAD), mark_read,
+                             parallelism=parallelism, fields=["type"])
+        if result.count:
+            adjust_unread_counts(self.db, releases)
+            self._publish(user_id, "read", {"all": True})
+        return result
     
-    def delete(self, alert_id: str) -> bool:
-        """Delete an alert."""
-        self.collection.document(alert_id).delete()
-        return True
+    def delete(self, alert_id: str, user_id: Optional[str] = None,
+               condition: Optional[Callable[[Any], bool]] = None) -> bool:
+        """Delete an alert (only if `condition`, checked in the transaction as in create_if, holds)."""
+        return self._change_alert(alert_id, None, user_id, condition)
     
-    def delete_all_for_user(self, user_id: str) -> int:
-        """Delete all alerts for a user, returns count of deleted alerts."""
-        batch = self.db.batch()
-        alerts = self.collection.where("user_id", "==", user_id).stream()
+    def delete_all_for_user(self, user_id: str, parallelism: Optional[int] = None) -> BulkResult:
+        """
+        Delete all alerts for a user.
         
-        count = 0
-        for doc in alerts:
-            batch.delete(doc.reference)
-            count += 1
-            
-        if count > 0:
-            batch.commit()
-        return count
+        Alerts are streamed a page at a time and deleted in parallel batches
+        of at most 500 writes, so any number of alerts can be handled.
+        
+        Returns:
+            BulkResult: count of deleted alerts, commits and duration.
+        """
+        # Include alerts still waiting in the write coalescer
+        self.writer.flush()
+        releases: Dict[str, Dict[str, Any]] = {}
+
+        def delete(committer: BulkCommitter, doc) -> None:
+            data = doc.to_dict()
+            if not data.get("read"):
+                release_unread(releases, user_id, doc.id, data.get("type"))
+            committer.delete(doc.reference)
+
+        result = drain_query(self.db, self._query(user_id), self._shape(ALL_FOR_USER), delete,
+                             parallelism=parallelism, fields=["read", "type"])
+        adjust_unread_counts(self.db, releases)
+        if result.count:
+            self._publish(user_id, "deleted", {"all": True})
+        return result
     
     def get_unread_count(self, user_id: str) -> int:
-        """Get count of unread alerts for a user."""
-        query = self.collection.where("user_id", "==", user_id).where("read", "==", False)
-        return len(list(query.stream()))
+        """
+        Get count of unread alerts for a user.
+        
+        Served from the user's counter document (one read). Until the counter
+        has been seeded, the count comes from a count() aggregation and is
+        written to the counter; reconcile_unread_counts() corrects any drift.
+        """
+        counter = self._counter(user_id).get()
+        data = counter.to_dict() if counter.exists else {}
+        if data.get("seeded"):
+            return unread_total(data)
+        return self._recount(user_id, counter)[0]
+    
+    def count_unread(self, user_id: str) -> int:
+        """Count unread alerts with a count() aggregation, bypassing the counter."""
+        return run_count(self._query(user_id).where("read", "==", False), self._shape(UNREAD))
+    
+    def _count_unread_by_kind(self, user_id: str) -> Tuple[int, List[str]]:
+        """Count a user's unread alerts other than thread alerts, and list the unread thread alerts."""
+        query = self._query(user_id).where("read", "==", False)\
+                                    .where("type", "==", AlertType.NEW_MESSAGE.value)\
+                                    .select([])
+        threads = [doc.id for doc in run_query(query, self._shape(UNREAD_THREADS))]
+        return self.count_unread(user_id) - len(threads), threads
+    
+    def reconcile_unread_counts(self, page_size: int = 200) -> Dict[str, Any]:
+        """
+        Recompute every counter from a count() aggregation and fix those that drifted.
+        
+        Counters can drift when a single alert and a bulk operation race on the
+        same alert. Each correction is conditional on the counter not having
+        changed since it was read (see _recount), so alerts created, read or
+        deleted during the count are not lost.
+        
+        Returns:
+            dict: counters checked, corrected, and duration.
+        """
+        started = datetime.now(timezone.utc)
+        counters = self.db.collection(COUNTER_COLLECTION)
+        checked = corrected = 0
+        last = None
+        while True:
+            query = counters.limit(page_size)
+            if last is not None:
+                query = query.start_after(last)
+            docs = run_query(query, ALL_COUNTERS)
+            for doc in docs:
+                _, was_corrected = self._recount(doc.id, doc)
+                corrected += was_corrected
+            checked += len(docs)
+            if len(docs) < page_size:
+                break
+            last = docs[-1]
+        duration = (datetime.now(timezone.utc) - started).total_seconds()
+        return {"checked": checked, "corrected": corrected, "duration_ms": round(duration * 1000, 1)}
     
-    def set_response_status(self, alert_id: str, status: str) -> bool:
+    def _recount(self, user_id: str, counter=None) -> Tuple[int, bool]:
+        """
+        Count a user's unread alerts and store the result on their counter if it differs.
+        
+        Every alert write that touches the counter commits in the same batch or
+        transaction as the alert, so the counter is written only if it has not
+        changed since it was read (before the count). If it has, the count may
+        have missed that change and is taken again.
+        
+        Args:
+            user_id: The counter's owner
+            counter: A snapshot of the counter read just now, to save a read
+        
+        Returns:
+            The unread total, and whether the counter was written.
+        """
+        ref = self._counter(user_id)
+        for _ in range(self.MAX_RECOUNT_ATTEMPTS):
+            counter = counter or ref.get()
+            data = counter.to_dict() if counter.exists else {}
+            unread, threads = self._count_unread_by_kind(user_id)
+            if data.get("seeded") and data.get("unread") == unread \
+                    and set(data.get("unread_threads") or {}) == set(threads):
+                return unread + len(threads), False
+            fields = {"unread": unread, "unread_threads": dict.fromkeys(threads, True),
+                      "seeded": True, "reconciled_at": datetime.now(timezone.utc)}
+            try:
+                if counter.exists:
+                    ref.update(fields, option=self.db.write_option(last_update_time=counter.update_time))
+                else:
+                    ref.create(fields)
+                return unread + len(threads), True
+            except (FailedPrecondition, AlreadyExists):
+                # An alert changed the counter during the count; count again
+                counter = None
+        # Leave the counter to the next reconcile rather than overwrite a change
+        return unread + len(threads), False
+    
+    def find_join_request(self, creator_id: str, requester_id: str, activity_id: str) -> Optional[Alert]:
+        """
+        Find the join request alert a requester sent to an activity's creator.
+        Looks it up by its natural key; alerts created before keyed IDs are found by query.
+        """
+        self.writer.flush()
+        alert = self.get_by_id(alert_key(AlertType.JOIN_REQUEST, activity_id, requester_id, creator_id), creator_id)
+        if alert:
+            return alert
+        return self._find_legacy_join_request(creator_id, requester_id, activity_id)
+    
+    def _find_legacy_join_request(self, creator_id: str, requester_id: str, activity_id: str) -> Optional[Alert]:
+        """Query for a join request alert stored under a random ID."""
+        query = self._query(creator_id).where("sender_id", "==", requester_id)\
+                                       .where("activity_id", "==", activity_id)\
+                                       .where("type", "==", AlertType.JOIN_REQUEST.value)\
+                                       .limit(1)
+        docs = run_query(query, self._shape(JOIN_REQUEST))
+        if not docs:
+            return None
+        return Alert.from_dict(docs[0].id, docs[0].to_dict())
+    
+    def set_response_status(self, alert_id: str, status: str, user_id: Optional[str] = None) -> bool:
         """
         Set the response status for an alert.
         
         Args:
             alert_id: The alert ID
             status: 'accepted' or 'rejected'
+            user_id: The alert's owner (required in the per-user layout)
             
         Returns:
             True if successful, False otherwise
         """
-        doc_ref = self.collection.document(alert_id)
-        doc_ref.update({
+        return self._change_alert(alert_id, {
             "response_status": status,
             "read": True
-        })
+        }, user_id)
+    
+    def _alert_writes(self, alert: Alert, count_unread: bool = True) -> List[PendingWrite]:
+        """Assign the alert an ID if it has none and return the writes that create it."""
+        if not alert.created_at:
+            alert.created_at = datetime.now()
+            
+        alert.id = alert.id or alert_key(alert.type, alert.activity_id, alert.sender_id, alert.user_id)
+        alerts = self._alerts(alert.user_id)
+        doc_ref = alerts.document(alert.id) if alert.id else alerts.document()
+        alert.id = doc_ref.id
+        alert.expire_at = alert_expire_at(alert.type, alert.read, alert.created_at)
+        writes = [PendingWrite("set", doc_ref, {**alert.to_dict(), "updated_at": firestore.SERVER_TIMESTAMP})]
+        if not alert.read and count_unread:
+            # Committed in the same batch as the alert, so the counter never runs ahead of it
+            writes.append(PendingWrite("set", self._counter(alert.user_id), counter_claim(alert), merge=True))
+        return writes
+    
+    def _thread_writes(self, alert: Alert) -> List[PendingWrite]:
+        """Writes that merge a new-message alert into its thread alert (see bump_thread_alerts)."""
+        alert.id = alert_key(alert.type, alert.activity_id, alert.sender_id, alert.user_id)
+        alert.read = False
+        alert.expire_at = alert_expire_at(alert.type, False, alert.created_at)
+        fields = {**alert.to_dict(), "data": {**alert.data, "message_count": firestore.Increment(1)},
+                  "updated_at": firestore.SERVER_TIMESTAMP}
+        return [PendingWrite("set", self._doc(alert.id, alert.user_id), fields, merge=True),
+                PendingWrite("set", self._counter(alert.user_id), counter_claim(alert), merge=True)]
+    
+    def respond_to_join_request(self, creator_id: str, requester_id: str, activity_id: str, status: str) -> bool:
+        """Record the creator's response ('accepted' or 'rejected') on a join request alert and mark it read."""
+        key = alert_key(AlertType.JOIN_REQUEST, activity_id, requester_id, creator_id)
+        if self.set_response_status(key, status, creator_id):
+            return True
+        legacy = self._find_legacy_join_request(creator_id, requester_id, activity_id)
+        return bool(legacy) and self.set_response_status(legacy.id, status, creator_id)
+    
+    def delete_join_request(self, creator_id: str, requester_id: str, activity_id: str,
+                            condition: Optional[Callable[[Any], bool]] = None) -> bool:
+        """
+        Delete a join request alert (only if `condition` holds, see create_if);
+        returns False if there was none or `condition` declined.
+        """
+        if self.delete(alert_key(AlertType.JOIN_REQUEST, activity_id, requester_id, creator_id), creator_id,
+                       condition):
+            return True
+        legacy = self._find_legacy_join_request(creator_id, requester_id, activity_id)
+        return bool(legacy) and self.delete(legacy.id, creator_id, condition)
+    
+    def compact(self, max_read_per_user: Optional[int] = None, page_size: int = 200) -> Dict[str, Any]:
+        """
+        Delete expired alerts and trim each user's read alerts to the newest few.
+        
+        Firestore TTL deletes expired alerts on its own, typically within a day;
+        deleting them here as well keeps emulators and the memory backend bounded
+        and catches anything TTL has not reached yet. Users are found through
+        their unread counter documents, and only users over the limit (checked
+        with a count() aggregation) have alerts read.
+        
+        Returns:
+            dict: expired and pruned alert counts, users checked and trimmed, and duration.
+        """
+        cap = config.ALERT_MAX_READ_PER_USER if max_read_per_user is None else max_read_per_user
+        started = datetime.now(timezone.utc)
+        self.writer.flush()
+
+        releases: Dict[str, Dict[str, Any]] = {}
+
+        def delete_expired(committer: BulkCommitter, doc) -> None:
+            data = doc.to_dict()
+            if not data.get("read"):
+                release_unread(releases, data.get("user_id"), doc.id, data.get("type"))
+            committer.delete(doc.reference)
+
+        expired = drain_query(self.db, all_alerts(self.db, self.layout).where("expireAt", "<", started),
+                              self._shape(EXPIRED),
+                              delete_expired, fields=["user_id", "read", "type"])
+        adjust_unread_counts(self.db, releases)
+        for user_id in releases:
+            self._publish(user_id, "unread_count")
+
+        checked = trimmed = pruned = 0
+        last = None
+        counters = self.db.collection(COUNTER_COLLECTION)
+        while True:
+            query = counters.select([]).limit(page_size)
+            if last is not None:
+                query = query.start_after(last)
+            docs = run_query(query, ALL_COUNTERS)
+            for doc in docs:
+                removed = self._trim_read(doc.id, cap)
+                trimmed += 1 if removed else 0
+                pruned += removed
+            checked += len(docs)
+            if len(docs) < page_size:
+                break
+            last = docs[-1]
+
+        return {
+            "expired": expired.count,
+            "pruned": pruned,
+            "users_checked": checked,
+            "users_trimmed": trimmed,
+            "duration_ms": round((datetime.now(timezone.utc) - started).total_seconds() * 1000, 1),
+        }
+    
+    def collection_stats(self) -> Dict[str, int]:
+        """Size of the alerts collection, counted with count() aggregations."""
+        alerts = all_alerts(self.db, self.layout)
+        total = run_count(alerts, self._shape(ALL_ALERTS))
+        read = run_count(alerts.where("read", "==", True), self._shape(ALL_ALERTS).variant(equality=("read",)))
+        return {
+            "alerts": total,
+            "read": read,
+            "unread": total - read,
+            "users": run_count(self.db.collection(COUNTER_COLLECTION), ALL_COUNTERS),
+        }
+
+    def migrate_layout(self, target: str, delete_source: bool = False, page_size: int = 500,
+                       dry_run: bool = False) -> Dict[str, Any]:
+        """
+        Copy every alert from the other storage layout into `target`, keeping its ID.
+
+        The source is read a page at a time in document order and each page is
+        written with parallel bulk commits. Alerts already in the target are left
+        alone (they may have been read or answered there since), so the migration
+        can be run again after the layout flag is flipped to pick up alerts written
+        in between. Unread counters are per user in both layouts and need no changes.
+
+        Args:
+            target: TOP_LEVEL or PER_USER.
+            delete_source: Delete each alert from the source once it is copied.
+            dry_run: Count what would be copied without writing.
+
+        Returns:
+            dict: Alerts copied, skipped (already in the target, or without an owner),
+            commits and duration.
+        """
+        if target not in (TOP_LEVEL, PER_USER):
+            raise ValueError(f"Unknown alert storage layout: {target}")
+        source = PER_USER if target == TOP_LEVEL else TOP_LEVEL
+        shape = layout_shape(ALL_ALERTS, source)
+        copied = skipped = 0
+        with BulkCommitter(self.db) as committer:
+            query = all_alerts(self.db, source).limit(page_size)
+            while True:
+                docs = run_query(query, shape)
+                targets = {
+                    doc.id: user_alerts(self.db, doc.get("user_id"), target).document(doc.id)
+                    for doc in docs if doc.get("user_id")
+                }
+                existing = {snapshot.reference.path for snapshot in self.db.get_all(list(targets.values()))
+                            if snapshot.exists}
+                for doc in docs:
+                    target_ref = targets.get(doc.id)
+                    # The collection group query also sees alerts already in the top-level collection
+                    if target_ref is None or target_ref.path == doc.reference.path:
+                        skipped += 1
+                        continue
+                    if target_ref.path in existing:
+                        skipped += 1
+                    else:
+                        copied += 1
+                        if not dry_run:
+                            committer.set(target_ref, doc.to_dict())
+                    if delete_source and not dry_run:
+                        committer.delete(doc.reference)
+                committer.flush()
+                if len(docs) < page_size:
+                    break
+                query = all_alerts(self.db, source).start_after(docs[-1]).limit(page_size)
+        result = committer.result()
+        return {"copied": copied, "skipped": skipped, **result.to_dict()}
+
+    def _trim_read(self, user_id: str, keep: int) -> int:
+        """Delete a user's read alerts beyond the newest `keep`; returns how many were deleted."""
+        query = self._query(user_id).where("read", "==", True)\
+                                    .order_by("created_at", direction=firestore.Query.DESCENDING)
+        shape = self._shape(BY_USER).variant(equality=("read",))
+        if run_count(query, shape) <= keep:
+            return 0
+        if keep:
+            kept = run_query(query.select(["created_at"]).limit(keep), shape)
+            query = query.start_after(kept[-1])
+        # Read alerts don't count towards the unread counter, so it needs no adjustment
+        return drain_query(self.db, query, shape, lambda committer, doc: committer.delete(doc.reference)).count
+    
+    def _publish(self, user_id: str, kind: str, data: Any = None) -> None:
+        if self.events:
+            self.events.publish(user_id, kind, data)
+    
+    def _publish_when_committed(self, future, alerts: List[Alert]) -> None:
+        """Publish new alerts once their batch commits; failed writes are not announced."""
+        if not self.events:
+            return
+
+        def publish(done) -> None:
+            if done.exception() is None:
+                for alert in alerts:
+                    self._publish(alert.user_id, "alert", alert.to_dict())
+
+        future.add_done_callback(publish)
+    
+    def _alerts(self, user_id: str):
+        return user_alerts(self.db, user_id, self.layout)
+    
+    def _query(self, user_id: str):
+        return user_alerts_query(self.db, user_id, self.layout)
+    
+    def _shape(self, shape: QueryShape) -> QueryShape:
+        return layout_shape(shape, self.layout)
+    
+    def _doc(self, alert_id: str, user_id: Optional[str]):
+        """Reference to an alert document; the per-user layout needs its owner to find it."""
+        if self.layout == PER_USER and not user_id:
+            raise ValueError("user_id is required to address an alert in the per-user layout")
+        return self._alerts(user_id).document(alert_id)
+    
+    def _counter(self, user_id: str):
+        return unread_counter_ref(self.db, user_id)
+    
+    def _change_alert(self, alert_id: str, updates: Optional[Dict], user_id: Optional[str] = None,
+                      condition: Optional[Callable[[Any], bool]] = None) -> bool:
+        """
+        Update (or, with updates=None, delete) an alert and take it off its
+        owner's unread counter if this takes it from unread to read or gone.
+        Runs in a transaction so concurrent calls decrement only once; an
+        optional `condition` is checked in the same transaction (see create_if).
+        """
+        doc_ref = self._doc(alert_id, user_id)
+        # Queued writes to this alert (its creation, a thread bump) must land first, or they would overwrite this change
+        self.writer.wait_for([doc_ref])
+        db = self.db
+        changed = {}
+
+        @firestore.transactional
+        def change_in_transaction(transaction):
+            if condition and not condition(transaction):
+                return False
+            doc = doc_ref.get(transaction=transaction)
+            if not doc.exists:
+                return False
+            data = doc.to_dict()
+            becomes_read = not data.get("read") and (updates is None or updates.get("read"))
+            changed.update(user_id=data.get("user_id"), becomes_read=becomes_read)
+            if becomes_read:
+                transaction.set(unread_counter_ref(db, data.get("user_id")),
+                                counter_release(alert_id, data.get("type")), merge=True)
+            if updates is None:
+                transaction.delete(doc_ref)
+            elif becomes_read:
+                transaction.update(doc_ref, {**updates, **read_updates(data.get("type"))})
+            else:
+                transaction.update(doc_ref, {**updates, "updated_at": firestore.SERVER_TIMESTAMP})
+            return True
+
+        if not change_in_transaction(self.db.transaction()):
+            return False
+        if updates is None:
+            self._publish(changed["user_id"], "deleted", {"ids": [alert_id]})
+        elif changed["becomes_read"]:
+            self._publish(changed["user_id"], "read", {"ids": [alert_id]})
         return True
\ No newline at end of file
@@ -1,64 +1,84 @@
-from firebase_admin import firestore, auth
 from typing import Optional, Dict, List
+from database.client import get_client
+from database.query_shapes import QueryShape, register_shape
+from database.telemetry import run_query
 from user.models.user import User
+from user.services.auth_service import AuthService
+from user.services.profile_cache import ProfileCache
 from fastapi import HTTPException
 
+# Query shapes emitted by this repository (see database.indexes)
+BY_USERNAME = register_shape(QueryShape("users.by_username", "users", equality=("username",)))
+BY_EMAIL = register_shape(QueryShape("users.by_email", "users", equality=("email",)))
+BY_PHONE = register_shape(QueryShape("users.by_phone", "users", equality=("phone",)))
+
 class UserRepository:
     """Repository for user data access operations"""
     
-    def __init__(self):
-        self.db = firestore.client()
+    def __init__(self, db=None, cache: Optional[ProfileCache] = None):
+        self.db = db or get_client()
         self.users_collection = self.db.collection('users')
+        self.cache = cache or ProfileCache()
     
     def get_by_id(self, user_id: str) -> Optional[User]:
+        """Get user by ID, served from the profile cache when possible"""
+        return self.cache.get(user_id, self.get_by_id_uncached)
+    
+    def get_by_id_uncached(self, user_id: str) -> Optional[User]:
         """Get user by ID from Firestore"""
         doc = self.users_collection.document(user_id).get()
         if not doc.exists:
             return None
         return User.from_dict(user_id, doc.to_dict())
     
+    def invalidate(self, user_id: str) -> None:
+        """Drop a user from the profile cache after a change made outside this repository"""
+        self.cache.invalidate(user_id)
+    
     def create(self, user_id: str, user_data: Dict) -> User:
         """Create new user in Firestore"""
         self.users_collection.document(user_id).set(user_data)
+        self.cache.invalidate(user_id)
         return User.from_dict(user_id, user_data)
     
     def update(self, user_id: str, data: Dict) -> bool:
         """Update user data in Firestore"""
         self.users_collection.document(user_id).update(data)
+        self.cache.invalidate(user_id)
         return True
     
     def delete(self, user_id: str) -> bool:
         """Delete user from Firestore and Auth"""
         self.users_collection.document(user_id).delete()
-        auth.delete_user(user_id)
+        self.cache.invalidate(user_id)
+        AuthService.delete_user(user_id)
         return True
     
     def check_username_exists(self, username: str) -> bool:
         """Check if username exists in database"""
         query = self.users_collection.where('username', '==', username).limit(1)
-        results = query.get()
+        results = run_query(query, BY_USERNAME)
         return len(results) > 0
     
     def check_email_exists(self, email: str) -> bool:
         """Check if email exists in database"""
         query = self.users_collection.where('email', '==', email).limit(1)
-        results = query.get()
+        results = run_query(query, BY_EMAIL)
         return len(results) > 0
     
     def check_phone_exists(self, phone: str) -> bool:
         """Check if phone exists in database"""
         query = self.users_collection.where('phone', '==', phone).limit(1)
-        results = query.get()
+        results = run_query(query, BY_PHONE)
         return len(results) > 0
         
     def get_preferences(self, user_id: str) -> Dict:
-        """Get user preferences from Firestore"""
-        doc = self.users_collection.document(user_id).get()
-        if not doc.exists:
+        """Get user preferences (from the profile cache when possible)"""
+        user = self.get_by_id(user_id)
+        if not user:
             return None
             
-        user_data = doc.to_dict()
-        return user_data.get('preferences', {})
+        return user.preferences
         
     def save_preferences(self, user_id: str, preferences: Dict) -> bool:
         """Save user preferences to Firestore"""
@@ -66,4 +86,5 @@ class UserRepository:
             'preferences': preferences,
             'preferences_set': True
         })
+        self.cache.invalidate(user_id)
         return True
\ No newline at end of file
@@ -1,51 +1,46 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Path, Body
-from typing import Dict
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Path, Body, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import Dict, Optional
+from datetime import datetime
 
 from user.services.auth_service import AuthService
 from user.controllers.user_controller import UserController
 from user.schemas import UserCreate, UserPreferences, UpdateProfileRequest
-from user.services.alert_service import AlertService
+from container import get_user_controller, get_alert_repository, get_alert_events
 from user.repositories.alert_repository import AlertRepository
+from user.services.alert_events import AlertEventBus, alert_event_stream
 from fastapi import APIRouter, HTTPException, Query
 
 
 # Create router
 router = APIRouter()
 
-# Initialize controller
-user_controller = UserController()
-
 # Authentication dependency
 get_current_user = AuthService.get_current_user
 
-
-# Alert service initialisation
-alert_service = AlertService()
-alert_repository = AlertRepository()
-
 @router.get("/check-username/{username}", summary="Check username availability")
-async def check_username(username: str):
+async def check_username(username: str, user_controller: UserController = Depends(get_user_controller)):
     """
     Check if a username already exists in the database.
     """
     return user_controller.check_username_availability(username)
 
 @router.get("/check-email/{email}", summary="Check email availability")
-async def check_email(email: str):
+async def check_email(email: str, user_controller: UserController = Depends(get_user_controller)):
     """
     Check if an email already exists in the database.
     """
     return user_controller.check_email_availability(email)
 
 @router.get("/check-phone/{phone}", summary="Check phone number availability")
-async def check_phone(phone: str):
+async def check_phone(phone: str, user_controller: UserController = Depends(get_user_controller)):
     """
     Check if a phone number already exists in the database.
     """
     return user_controller.check_phone_availability(phone)
 
 @router.get("/lookup", summary="Lookup user by username")
-async def lookup_user(username: str = Query(..., description="The username to look up")):
+async def lookup_user(username: str = Query(..., description="The username to look up"), user_controller: UserController = Depends(get_user_controller)):
     """
     Given a username, return the user's email (and possibly other fields).
     """
@@ -58,14 +53,14 @@ async def lookup_user(username: str = Query(..., description="The username to lo
     }
 
 @router.post("/create_user", summary="Create a new user")
-async def create_user(user_data: UserCreate, current_user: Dict = Depends(get_current_user)):
+async def create_user(user_data: UserCreate, current_user: Dict = Depends(get_current_user), user_controller: UserController = Depends(get_user_controller)):
     """
     Create a new user in Firestore with data from registration form.
     """
     return user_controller.create_user(current_user["uid"], current_user["email"], user_data.dict())
 
 @router.get("/current_user", summary="Get current user data")
-async def get_current_user_data(current_user: Dict = Depends(get_current_user)):
+async def get_current_user_data(current_user: Dict = Depends(get_current_user), user_controller: UserController = Depends(get_user_controller)):
     """
     Get the current user's data from Firestore.
     """
@@ -75,35 +70,35 @@ async def get_current_user_data(current_user: Dict = Depends(get_current_user)):
     return user_data
 
 @router.put("/update_profile", summary="Update user profile")
-async def update_profile(profile_data: UpdateProfileRequest, current_user: Dict = Depends(get_current_user)):
+async def update_profile(profile_data: UpdateProfileRequest, current_user: Dict = Depends(get_current_user), user_controller: UserController = Depends(get_user_controller)):
     """
     Update the user's profile information.
     """
     return user_controller.update_profile(current_user["uid"], profile_data)
 
 @router.delete("/delete_account", summary="Delete user account")
-async def delete_account(current_user: Dict = Depends(get_current_user)):
+async def delete_account(current_user: Dict = Depends(get_current_user), user_controller: UserController = Depends(get_user_controller)):
     """
     Delete the user's account from Firebase and Firestore.
     """
     return user_controller.delete_account(current_user["uid"])
 
 @router.post("/upload_profile_picture", summary="Upload profile picture")
-async def upload_profile_picture(file: UploadFile = File(...), current_user: Dict = Depends(get_current_user)):
+async def upload_profile_picture(file: UploadFile = File(...), current_user: Dict = Depends(get_current_user), user_controller: UserController = Depends(get_user_controller)):
     """
     Change the user's profile picture by uploading to Cloudinary and updating Firestore.
     """
     return await user_controller.upload_profile_picture(current_user["uid"], file)
 
 @router.post("/set_preferences", summary="Set user preferences")
-async def set_preferences(preferences: UserPreferences, current_user: Dict = Depends(get_current_user)):
+async def set_preferences(preferences: UserPreferences, current_user: Dict = Depends(get_current_user), user_controller: UserController = Depends(get_user_controller)):
     """
     Set the user's preferences in Firestore.
     """
     return user_controller.save_preferences(current_user["uid"], preferences)
 
 @router.get("/get_preferences", summary="Get user preferences")
-async def get_preferences(current_user: Dict = Depends(get_current_user)):
+async def get_preferences(current_user: Dict = Depends(get_current_user), user_controller: UserController = Depends(get_user_controller)):
     """
     Retrieve the user's preferences from Firestore.
     """
@@ -112,7 +107,8 @@ async def get_preferences(current_user: Dict = Depends(get_current_user)):
 @router.get("/public/{user_id}", summary="Get user's public profile", response_model=Dict)
 async def get_public_profile(
     user_id: str = Path(..., description="The user ID"),
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    user_controller: UserController = Depends(get_user_controller)
 ):
     """
     Retrieve basic public information about any user.
@@ -122,23 +118,50 @@ async def get_public_profile(
 
 @router.get("/alerts", summary="Get user alerts")
 async def get_alerts(
+    response: Response,
     limit: int = Query(50, description="Maximum number of alerts to return"),
     unread_only: bool = Query(False, description="Only return unread alerts"),
-    current_user: dict = Depends(AuthService.get_current_user)
+    before: Optional[str] = Query(None, description="Cursor: only alerts older than this page (next page)"),
+    after: Optional[str] = Query(None, description="Cursor: only alerts newer than this page"),
+    updated_since: Optional[datetime] = Query(None, description="Only alerts created or changed after this time"),
+    current_user: dict = Depends(AuthService.get_current_user),
+    alert_repository: AlertRepository = Depends(get_alert_repository)
 ):
     """
-    Get the current user's alerts/notifications.
+    Get the current user's alerts/notifications, newest first.
+    
+    The X-Before-Cursor header (absent once the oldest alert is reached) is
+    passed as `before` to load older alerts; X-After-Cursor is passed as
+    `after` to fetch only alerts created since this response.
+    
+    With `updated_since`, returns alerts created or changed (read, responded to)
+    since then, oldest change first, ignoring the other filters. Pass the
+    `updated_at` of the last alert returned to continue or for the next sync.
     """
-    alerts = alert_repository.get_by_user(
-        user_id=current_user["uid"],
-        limit=limit,
-        unread_only=unread_only
-    )
-    return [alert.to_dict() for alert in alerts]
+    if updated_since:
+        alerts = alert_repository.get_updated_since(current_user["uid"], updated_since, limit=limit)
+        return [alert.to_dict() for alert in alerts]
+    
+    try:
+        page = alert_repository.get_by_user(
+            user_id=current_user["uid"],
+            limit=limit,
+            unread_only=unread_only,
+            before=before,
+            after=after
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page.before:
+        response.headers["X-Before-Cursor"] = page.before
+    if page.after:
+        response.headers["X-After-Cursor"] = page.after
+    return [alert.to_dict() for alert in page.alerts]
 
 @router.get("/alerts/count", summary="Get unread alert count")
 async def get_unread_alert_count(
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    alert_repository: AlertRepository = Depends(get_alert_repository)
 ):
     """
     Get count of unread alerts for the current user.
@@ -146,76 +169,104 @@ async def get_unread_alert_count(
     count = alert_repository.get_unread_count(user_id=current_user["uid"])
     return {"unread_count": count}
 
+@router.get("/alerts/stream", summary="Stream alert changes")
+async def stream_alerts(
+    request: Request,
+    current_user: dict = Depends(AuthService.get_current_user),
+    alert_repository: AlertRepository = Depends(get_alert_repository),
+    alert_events: AlertEventBus = Depends(get_alert_events)
+):
+    """
+    Push the current user's alert changes as Server-Sent Events, replacing
+    polling of /alerts and /alerts/count.
+    
+    Events: `unread_count` ({"count"}) on connect and whenever it changes,
+    `alert` (a new or updated alert), `read` and `deleted` ({"ids"} or {"all"}),
+    and `resync` if the client fell behind and should refetch its alerts.
+    The server closes the stream periodically; clients should reconnect.
+    """
+    return StreamingResponse(
+        alert_event_stream(current_user["uid"], alert_events,
+                           alert_repository.get_unread_count, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.post("/alerts/{alert_id}/read", summary="Mark alert as read")
 async def mark_alert_as_read(
     alert_id: str = Path(..., description="The alert ID to mark as read"),
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    alert_repository: AlertRepository = Depends(get_alert_repository)
 ):
     """
     Mark an alert as read.
     """
     # First get the alert to verify it belongs to this user
-    alert = alert_repository.get_by_id(alert_id)
+    alert = alert_repository.get_by_id(alert_id, current_user["uid"])
     if not alert:
         raise HTTPException(status_code=404, detail="Alert not found")
     
     if alert.user_id != current_user["uid"]:
         raise HTTPException(status_code=403, detail="Not authorized to modify this alert")
     
-    alert_repository.mark_as_read(alert_id)
+    alert_repository.mark_as_read(alert_id, current_user["uid"])
     return {"message": "Alert marked as read"}
 
 @router.post("/alerts/read-all", summary="Mark all alerts as read")
 async def mark_all_alerts_as_read(
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    alert_repository: AlertRepository = Depends(get_alert_repository)
 ):
     """
     Mark all of the current user's alerts as read.
     """
-    count = alert_repository.mark_all_as_read(user_id=current_user["uid"])
-    return {"message": f"{count} alerts marked as read"}
+    result = alert_repository.mark_all_as_read(user_id=current_user["uid"])
+    return {"message": f"{result.count} alerts marked as read", **result.to_dict()}
 
 @router.delete("/alerts/{alert_id}", summary="Delete an alert")
 async def delete_alert(
     alert_id: str = Path(..., description="The alert ID to delete"),
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    alert_repository: AlertRepository = Depends(get_alert_repository)
 ):
     """
     Delete an alert.
     """
     # First get the alert to verify it belongs to this user
-    alert = alert_repository.get_by_id(alert_id)
+    alert = alert_repository.get_by_id(alert_id, current_user["uid"])
     if not alert:
         raise HTTPException(status_code=404, detail="Alert not found")
     
     if alert.user_id != current_user["uid"]:
         raise HTTPException(status_code=403, detail="Not authorized to delete this alert")
     
-    alert_repository.delete(alert_id)
+    alert_repository.delete(alert_id, current_user["uid"])
     return {"message": "Alert deleted"}
 
 @router.delete("/alerts", summary="Delete all alerts")
 async def delete_all_alerts(
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    alert_repository: AlertRepository = Depends(get_alert_repository)
 ):
     """
     Delete all of the current user's alerts.
     """
-    count = alert_repository.delete_all_for_user(user_id=current_user["uid"])
-    return {"message": f"{count} alerts deleted"}
+    result = alert_repository.delete_all_for_user(user_id=current_user["uid"])
+    return {"message": f"{result.count} alerts deleted", **result.to_dict()}
 
 
 @router.post("/alerts/{alert_id}/respond", summary="Set alert response status")
 async def set_alert_response_status(
     alert_id: str = Path(..., description="The alert ID to update"),
     status: str = Body(..., embed=True),
-    current_user: dict = Depends(AuthService.get_current_user)
+    current_user: dict = Depends(AuthService.get_current_user),
+    alert_repository: AlertRepository = Depends(get_alert_repository)
 ):
     """
     Set the response status for an alert (accepted/rejected).
     """
     # First get the alert to verify it belongs to this user
-    alert = alert_repository.get_by_id(alert_id)
+    alert = alert_repository.get_by_id(alert_id, current_user["uid"])
     if not alert:
         raise HTTPException(status_code=404, detail="Alert not found")
     
@@ -227,9 +278,9 @@ async def set_alert_response_status(
         raise HTTPException(status_code=400, detail="Status must be 'accepted' or 'rejected'")
     
     # Update the status
-    alert_repository.set_response_status(alert_id, status)
+    alert_repository.set_response_status(alert_id, status, current_user["uid"])
     
     # Also mark as read
-    alert_repository.mark_as_read(alert_id)
+    alert_repository.mark_as_read(alert_id, current_user["uid"])
     
     return {"message": f"Alert response status set to {status}"}
\ No newline at end of file
@@ -0,0 +1,287 @@
+"""
+In-process pub/sub of alert changes, streamed to clients by GET /user/alerts/stream.
+
+AlertRepository publishes to the bus once its writes are committed. On the
+Firestore backend an AlertSnapshotBridge also listens to the alerts and
+unread counter of every user connected to this worker, so changes written
+by other replicas reach the stream too.
+"""
+
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Set
+
+from fastapi.encoders import jsonable_encoder
+
+import config
+from database.query_shapes import QueryShape, ASCENDING
+from user.models.alert import Alert
+from user.repositories.alert_repository import COUNTER_COLLECTION, alert_shape, unread_total, user_alerts_query
+
+# Query the bridge listens to (see database.indexes)
+NEW_FOR_USER = alert_shape(QueryShape(
+    "alerts.stream", "alerts",
+    equality=("user_id",), range="created_at",
+    order_by=(("created_at", ASCENDING),)
+))
+
+# Event kinds
+ALERT = "alert"                # data: the alert, new or bumped (e.g. a thread alert)
+READ = "read"                  # data: {"ids": [...]} or {"all": True}
+DELETED = "deleted"            # data: {"ids": [...]} or {"all": True}
+UNREAD_COUNT = "unread_count"  # data: {"count": n}, or None when it has to be re-read
+RESYNC = "resync"              # sent when a client fell behind; it should refetch its alerts
+
+
+@dataclass
+class AlertEvent:
+    kind: str
+    data: Any = None
+
+
+class Subscription:
+    """One connected stream: a bounded queue of events on the event loop that created it."""
+
+    def __init__(self, user_id: str, maxsize: int):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def deliver(self, event: AlertEvent) -> None:
+        """Queue an event; must run on the subscription's loop."""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Drop everything queued and tell the client to refetch instead
+            self.overflowed = True
+
+    async def next(self, timeout: float) -> Optional[AlertEvent]:
+        """Wait up to `timeout` seconds for the next event."""
+        if self.overflowed:
+            self.overflowed = False
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            return AlertEvent(RESYNC)
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def pending(self) -> Optional[AlertEvent]:
+        """Return a queued event without waiting, if there is one."""
+        try:
+            return self.queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return None
+
+
+class AlertEventBus:
+    """
+    Routes alert events to the streams of the user they belong to.
+
+    publish() may be called from any thread (request threads, the write
+    coalescer, snapshot listeners); events are handed to each subscriber's
+    event loop. Nothing is kept for users with no open stream.
+    """
+
+    def __init__(self, queue_size: Optional[int] = None):
+        self.queue_size = queue_size or config.ALERT_STREAM_QUEUE_SIZE
+        self.bridge: Optional["AlertSnapshotBridge"] = None
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, user_id: str) -> Subscription:
+        """Open a subscription for a user; call from the event loop serving the stream."""
+        subscription = Subscription(user_id, self.queue_size)
+        with self._lock:
+            first = user_id not in self._subscribers
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        if first and self.bridge:
+            self.bridge.watch(user_id)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id, set())
+            subscribers.discard(subscription)
+            last = not subscribers
+            if last:
+                self._subscribers.pop(subscription.user_id, None)
+        if last and self.bridge:
+            self.bridge.unwatch(subscription.user_id)
+
+    def publish(self, user_id: str, kind: str, data: Any = None) -> None:
+        """Send an event to every open stream of a user. Thread-safe."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        if not subscribers:
+            return
+        self.published += 1
+        event = AlertEvent(kind, data)
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # The stream's loop has closed; it will unsubscribe itself
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "users": len(self._subscribers),
+                "connections": sum(len(s) for s in self._subscribers.values()),
+                "published": self.published,
+                "watched": self.bridge.watched() if self.bridge else 0,
+            }
+
+    def close(self) -> None:
+        if self.bridge:
+            self.bridge.close()
+
+
+class AlertSnapshotBridge:
+    """
+    Forwards alert changes made by other replicas to the local bus.
+
+    While a user has a stream open on this worker, two snapshot listeners run
+    for them: one on alerts created (or bumped) since the stream opened, and
+    one on their unread counter document. Alerts written by this worker arrive
+    both ways; streams drop the duplicate.
+    """
+
+    def __init__(self, db, bus: AlertEventBus):
+        self.db = db
+        self.bus = bus
+        self._watches: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def watch(self, user_id: str) -> None:
+        with self._lock:
+            if user_id in self._watches:
+                return
+            since = datetime.now(timezone.utc)
+            query = user_alerts_query(self.db, user_id).where("created_at", ">=", since)\
+                                                       .order_by("created_at")
+            self._watches[user_id] = [
+                query.on_snapshot(self._on_alerts(user_id)),
+                self.db.collection(COUNTER_COLLECTION).document(user_id).on_snapshot(self._on_counter(user_id)),
+            ]
+
+    def unwatch(self, user_id: str) -> None:
+        with self._lock:
+            watches = self._watches.pop(user_id, [])
+        for watch in watches:
+            watch.unsubscribe()
+
+    def watched(self) -> int:
+        with self._lock:
+            return len(self._watches)
+
+    def close(self) -> None:
+        with self._lock:
+            users = list(self._watches)
+        for user_id in users:
+            self.unwatch(user_id)
+
+    def _on_alerts(self, user_id: str) -> Callable:
+        def callback(snapshots, changes, read_time) -> None:
+            for change in changes:
+                if change.type.name in ("ADDED", "MODIFIED"):
+                    doc = change.document
+                    self.bus.publish(user_id, ALERT, Alert.from_dict(doc.id, doc.to_dict()).to_dict())
+        return callback
+
+    def _on_counter(self, user_id: str) -> Callable:
+        def callback(snapshots, changes, read_time) -> None:
+            for snapshot in snapshots:
+                data = snapshot.to_dict() or {}
+                count = unread_total(data) if data.get("seeded") else None
+                self.bus.publish(user_id, UNREAD_COUNT, {"count": count} if count is not None else None)
+        return callback
+
+
+def _format(kind: str, data: Any) -> str:
+    """Encode one Server-Sent Event."""
+    return f"event: {kind}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+def _alert_version(alert: Dict) -> str:
+    """Identifies one state of an alert, so the same change arriving twice is sent once."""
+    created_at = alert.get("created_at")
+    if isinstance(created_at, datetime):
+        # Firestore stores naive datetimes as UTC
+        created_at = (created_at if created_at.tzinfo else created_at.replace(tzinfo=timezone.utc)).timestamp()
+    return f"{alert.get('id')}@{created_at}"
+
+
+async def alert_event_stream(user_id: str, bus: AlertEventBus,
+                             unread_count: Callable[[str], int],
+                             is_disconnected: Callable[[], Any]) -> AsyncIterator[str]:
+    """
+    Yield a user's alert events as Server-Sent Events.
+
+    Opens with the current unread count, then forwards alert changes and sends
+    the count again whenever it may have changed (one counter read per burst of
+    events). Idle connections get a keep-alive comment every heartbeat, and the
+    stream ends after ALERT_STREAM_MAX_SECONDS so clients reconnect and spread
+    across replicas; EventSource reconnects on its own.
+
+    Args:
+        unread_count: Reads the user's unread count (called in a worker thread).
+        is_disconnected: Awaitable check for the client having gone away.
+    """
+    subscription = bus.subscribe(user_id)
+    sent_versions: "OrderedDict[str, None]" = OrderedDict()
+    last_count = None
+    deadline = time.monotonic() + config.ALERT_STREAM_MAX_SECONDS
+    try:
+        yield f"retry: {int(config.ALERT_STREAM_RETRY_MS)}\n\n"
+        last_count = await asyncio.to_thread(unread_count, user_id)
+        yield _format(UNREAD_COUNT, {"count": last_count})
+
+        while time.monotonic() < deadline:
+            event = await subscription.next(config.ALERT_STREAM_HEARTBEAT_SECONDS)
+            if await is_disconnected():
+                break
+            if event is None:
+                yield ": keep-alive\n\n"
+                continue
+
+            count_changed = False
+            count = None
+            # Drain the burst before re-reading the count
+            while event is not None:
+                if event.kind == ALERT:
+                    version = _alert_version(event.data)
+                    if version not in sent_versions:
+                        sent_versions[version] = None
+                        if len(sent_versions) > config.ALERT_STREAM_QUEUE_SIZE:
+                            sent_versions.popitem(last=False)
+                        yield _format(ALERT, event.data)
+                        count_changed = True
+                elif event.kind == UNREAD_COUNT:
+                    if event.data is None:
+                        count_changed = True
+                    else:
+                        count = event.data["count"]
+                else:
+                    yield _format(event.kind, event.data)
+                    count_changed = True
+                event = subscription.pending()
+
+            if count is None and count_changed:
+                count = await asyncio.to_thread(unread_count, user_id)
+            if count is not None and count != last_count:
+                last_count = count
+                yield _format(UNREAD_COUNT, {"count": count})
+    finally:
+        bus.unsubscribe(subscription)
@@ -1,25 +1,39 @@
-from typing import Dict, Optional
-from user.repositories.alert_repository import AlertRepository
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from user.repositories.alert_repository import AlertRepository, alert_key
 from user.repositories.user_repository import UserRepository
 from user.models.alert import Alert, AlertType
 
+# Message templates for alerts sent to many recipients at once. Formatted with
+# sender_name, activity_name and the alert's data fields.
+FAN_OUT_MESSAGES = {
+    AlertType.ACTIVITY_CANCELLED: "Activity '{activity_name}' has been cancelled by the organizer",
+    AlertType.ACTIVITY_UPDATED: "Activity '{activity_name}' details has been updated.",
+    AlertType.NEW_MESSAGE: "{sender_name} sent a message in {activity_name}: \"{message_preview}\"",
+}
+
 class AlertService:
     """Service for managing user alerts."""
     
-    def __init__(self):
-        self.repository = AlertRepository()
-        self.user_repository = UserRepository()
+    def __init__(self, repository: Optional[AlertRepository] = None, user_repository: Optional[UserRepository] = None):
+        self.repository = repository or AlertRepository()
+        self.user_repository = user_repository or UserRepository()
     
     def create_join_request_alert(
         self, 
         creator_id: str,
         requester_id: str,
         activity_id: str,
-        activity_name: str
-    ) -> Alert:
+        activity_name: str,
+        event_id: Optional[str] = None,
+        only_if: Optional[Callable[[Any], bool]] = None
+    ) -> Optional[Alert]:
         """
         Create an alert when a user requests to join an activity.
         Sent TO the activity creator FROM the requester.
+        
+        With `only_if`, the alert is written in a transaction together with
+        that check (see AlertRepository.create_if), and None is returned if
+        the check fails.
         """
         requester = self.user_repository.get_by_id(requester_id)
         if not requester:
@@ -39,7 +53,10 @@ class AlertService:
             sender_profile_pic=requester.profile_pic_url
         )
         
-        return self.repository.create(alert)
+        if only_if:
+            self._tag(alert, event_id)
+            return alert if self.repository.create_if(alert, only_if) else None
+        return self._create_many([alert], event_id)[0]
     
     def create_request_response_alert(
         self,
@@ -47,7 +64,8 @@ class AlertService:
         creator_id: str,
         activity_id: str,
         activity_name: str,
-        approved: bool
+        approved: bool,
+        event_id: Optional[str] = None
     ) -> Alert:
         """
         Create an alert when a join request is approved/rejected.
@@ -74,14 +92,15 @@ class AlertService:
             sender_profile_pic=creator.profile_pic_url
         )
         
-        return self.repository.create(alert)
+        return self._create_many([alert], event_id)[0]
     
     def create_user_left_alert(
         self,
         creator_id: str,
         user_id: str,
         activity_id: str,
-        activity_name: str
+        activity_name: str,
+        event_id: Optional[str] = None
     ) -> Alert:
         """
         Create an alert when a user leaves an activity.
@@ -105,7 +124,7 @@ class AlertService:
             sender_profile_pic=user.profile_pic_url
         )
         
-        return self.repository.create(alert)
+        return self._create_many([alert], event_id)[0]
     
     def create_activity_cancelled_alert(
         self,
@@ -118,25 +137,8 @@ class AlertService:
         Create an alert when an activity is cancelled.
         Sent TO all participants FROM the creator.
         """
-        creator = self.user_repository.get_by_id(creator_id)
-        if not creator:
-            raise ValueError(f"User {creator_id} not found")
-        
-        creator_name = f"{creator.first_name} {creator.last_name}"
-        
-        # Create alert for the participant
-        alert = Alert(
-            user_id=participant_id,
-            type=AlertType.ACTIVITY_CANCELLED,
-            message=f"Activity '{activity_name}' has been cancelled by the organizer",
-            activity_id=activity_id,
-            activity_name=activity_name,
-            sender_id=creator_id,
-            sender_name=creator_name,
-            sender_profile_pic=creator.profile_pic_url
-        )
-        
-        return self.repository.create(alert)
+        return self.fan_out(AlertType.ACTIVITY_CANCELLED, [participant_id], creator_id,
+                            activity_id, activity_name)[0]
     
     def create_activity_updated_alert(
         self,
@@ -149,67 +151,38 @@ class AlertService:
         Create an alert when an activity is updated.
         Sent TO all participants FROM the creator.
         """
-        creator = self.user_repository.get_by_id(creator_id)
-        if not creator:
-            raise ValueError(f"User {creator_id} not found")
-        
-        creator_name = f"{creator.first_name} {creator.last_name}"
-        
-        # Create alert for the participant
-        alert = Alert(
-            user_id=participant_id,
-            type=AlertType.ACTIVITY_UPDATED,
-            message=f"Activity '{activity_name}' details has been updated.",
-            activity_id=activity_id,
-            activity_name=activity_name,
-            sender_id=creator_id,
-            sender_name=creator_name,
-            sender_profile_pic=creator.profile_pic_url,
-        )
-        
-        return self.repository.create(alert)
+        return self.fan_out(AlertType.ACTIVITY_UPDATED, [participant_id], creator_id,
+                            activity_id, activity_name)[0]
     
     def delete_join_request_alert(
         self,
         creator_id: str,
         requester_id: str,
-        activity_id: str
+        activity_id: str,
+        only_if: Optional[Callable[[Any], bool]] = None
     ) -> bool:
         """
         Delete a join request alert when the request is cancelled.
-        This finds and removes alerts where a specific user requested to join a specific activity.
+        The alert is addressed by its key (see alert_key), without a query.
         
         Args:
             creator_id: ID of the activity creator who received the alert
             requester_id: ID of the user who sent the join request
             activity_id: ID of the activity the request was for
+            only_if: Check run in the deleting transaction (see AlertRepository.create_if)
             
         Returns:
             True if an alert was found and deleted, False otherwise
         """
-        # Find alerts matching these criteria
-        alerts_query = self.repository.collection.where("user_id", "==", creator_id)\
-                                            .where("sender_id", "==", requester_id)\
-                                            .where("activity_id", "==", activity_id)\
-                                            .where("type", "==", "join_request")\
-                                            .limit(1)
-        
-        alerts = list(alerts_query.stream())
-        if not alerts:
-            # No matching alert found
-            return False
-            
-        # Delete the found alert
-        alert_id = alerts[0].id
-        self.repository.delete(alert_id)
-        return True
+        return self.repository.delete_join_request(creator_id, requester_id, activity_id, only_if)
     
     def create_user_removed_alert(
         self,
         participant_id: str,
         creator_id: str,
         activity_id: str,
-        activity_name: str
+        activity_name: str,
+        event_id: Optional[str] = None
     ) -> Alert:
         """
         Create an alert when a user is removed from an activity by the creator.
@@ -233,7 +206,7 @@ class AlertService:
             sender_profile_pic=creator.profile_pic_url
         )
         
-        return self.repository.create(alert)
+        return self._create_many([alert], event_id)[0]
     
     def create_new_message_alert(
         self,
@@ -247,23 +220,96 @@ class AlertService:
         Create an alert when a new message is sent in an activity thread.
         Sent TO all participants FROM the message sender.
         """
+        return self.fan_out(AlertType.NEW_MESSAGE, [user_id], sender_id, activity_id, activity_name,
+                            data={"message_preview": message_preview})[0]
+    
+    def fan_out(
+        self,
+        alert_type: AlertType,
+        recipient_ids: Iterable[str],
+        sender_id: str,
+        activity_id: str,
+        activity_name: str,
+        data: Optional[Dict[str, Any]] = None,
+        event_id: Optional[str] = None
+    ) -> List[Alert]:
+        """
+        Send the same event to many recipients.
+        
+        The sender is looked up once, one alert is built per recipient (the
+        sender and duplicates are skipped) and all of them are queued for
+        batched commits, so the caller does not wait on a write per recipient.
+        NEW_MESSAGE events update each recipient's single thread alert instead
+        of adding a new one (see AlertRepository.bump_thread_alerts).
+        
+        Args:
+            alert_type: One of the types in FAN_OUT_MESSAGES
+            recipient_ids: Users to notify
+            sender_id: User who triggered the event
+            activity_id: Activity the event is about
+            activity_name: Name shown in the alert
+            data: Extra fields stored on each alert and available to the message template
+            event_id: Outbox event being delivered, which makes the call idempotent
+                (see _create_many); not supported for NEW_MESSAGE
+            
+        Returns:
+            The alerts created
+        """
+        recipients = [r for r in dict.fromkeys(recipient_ids) if r and r != sender_id]
+        if not recipients:
+            return []
+        
         sender = self.user_repository.get_by_id(sender_id)
         if not sender:
             raise ValueError(f"User {sender_id} not found")
         
         sender_name = f"{sender.first_name} {sender.last_name}"
+        data = data or {}
+        message = FAN_OUT_MESSAGES[alert_type].format(sender_name=sender_name, activity_name=activity_name, **data)
         
-        # Create alert for the recipient
-        alert = Alert(
-            user_id=user_id,
-            type=AlertType.NEW_MESSAGE,
-            message=f"{sender_name} sent a message in {activity_name}: \"{message_preview}\"",
-            activity_id=activity_id,
-            activity_name=activity_name,
-            sender_id=sender_id,
-            sender_name=sender_name,
-            sender_profile_pic=sender.profile_pic_url,
-            data={"message_preview": message_preview}
-        )
+        alerts = [
+            Alert(
+                user_id=recipient_id,
+                type=alert_type,
+                message=message,
+                activity_id=activity_id,
+                activity_name=activity_name,
+                sender_id=sender_id,
+                sender_name=sender_name,
+                sender_profile_pic=sender.profile_pic_url,
+                data=dict(data)
+            )
+            for recipient_id in recipients
+        ]
+        if alert_type == AlertType.NEW_MESSAGE:
+            return self.repository.bump_thread_alerts(alerts)
+        return self._create_many(alerts, event_id)
+    
+    def _create_many(self, alerts: List[Alert], event_id: Optional[str] = None) -> List[Alert]:
+        """
+        Write alerts. With an outbox event ID the write is idempotent and durable:
+        each alert gets an ID derived from the event (or its natural key), is
+        tagged with the event, and is skipped if a previous attempt of the same
+        event already wrote it; the call returns once the writes have committed.
+        """
+        if not event_id:
+            return self.repository.create_many(alerts)
         
-        return self.repository.create(alert)
\ No newline at end of file
+        for alert in alerts:
+            self._tag(alert, event_id)
+        
+        self.repository.writer.flush()
+        existing = self.repository.get_many(alerts)
+        pending = [alert for alert in alerts
+                   if alert.id not in existing or existing[alert.id].data.get("event_id") != event_id]
+        # A keyed alert from an earlier event is overwritten; don't count it as unread twice
+        already_unread = [alert.id for alert in pending if alert.id in existing and not existing[alert.id].read]
+        self.repository.create_many(pending, already_unread=already_unread, wait=True)
+        return alerts
+    
+    def _tag(self, alert: Alert, event_id: Optional[str]) -> None:
+        """Give an alert its natural key (or one derived from the outbox event) and tag it with the event."""
+        alert.id = alert_key(alert.type, alert.activity_id, alert.sender_id, alert.user_id) \
+            or (f"{event_id}:{alert.user_id}" if event_id else None)
+        if event_id:
+            alert.data["event_id"] = event_id
@@ -1,16 +1,51 @@
 from fastapi import Depends, HTTPException, Security
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from firebase_admin import auth
+import config
 
 security = HTTPBearer()
 
 class AuthService:
+    @staticmethod
+    def verify_id_token(token: str) -> dict:
+        """
+        Verify an ID token and return its decoded claims.
+        With AUTH_BACKEND=stub (memory data backend only) the token itself is
+        "<uid>" or "<uid>:<email>".
+        """
+        if config.AUTH_BACKEND == "stub":
+            if config.DATA_BACKEND != "memory":
+                raise ValueError("Stub tokens are only accepted with DATA_BACKEND=memory")
+            uid, _, email = token.partition(":")
+            if not uid:
+                raise ValueError("Stub token must contain a user ID")
+            return {"uid": uid, "email": email}
+        return auth.verify_id_token(token)
+
+    @staticmethod
+    def delete_user(user_id: str) -> None:
+        """Delete the user from the auth provider (no-op with the stub backend)."""
+        if config.AUTH_BACKEND == "stub":
+            return
+        auth.delete_user(user_id)
+
     @staticmethod
     async def get_current_user(credentials: HTTPAuthorizationCredentials = Security(security)):
         try:
             token = credentials.credentials
             # Firebase verification code here...
-            decoded_token = auth.verify_id_token(token)
+            decoded_token = AuthService.verify_id_token(token)
             return {"uid": decoded_token["uid"], "email": decoded_token.get("email", "")}
         except Exception as e:
-            raise HTTPException(status_code=401, detail=f"Invalid authentication token: {str(e)}")
\ No newline at end of file
+            raise HTTPException(status_code=401, detail=f"Invalid authentication token: {str(e)}")
+
+    @staticmethod
+    async def get_admin_user(credentials: HTTPAuthorizationCredentials = Security(security)):
+        """Current user, who must be listed in ADMIN_UIDS or carry the "admin" custom claim."""
+        try:
+            decoded_token = AuthService.verify_id_token(credentials.credentials)
+        except Exception as e:
+            raise HTTPException(status_code=401, detail=f"Invalid authentication token: {str(e)}")
+        if decoded_token["uid"] not in config.ADMIN_UIDS and decoded_token.get("admin") is not True:
+            raise HTTPException(status_code=403, detail="Admin access required")
+        return {"uid": decoded_token["uid"], "email": decoded_token.get("email", "")}
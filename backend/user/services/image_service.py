@@ -8,12 +8,23 @@ from dotenv import load_dotenv
 
 
 load_dotenv()
-cloudinary.config( 
-    cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key = os.getenv("CLOUDINARY_API_KEY"),
-    api_secret = os.getenv("CLOUDINARY_API_SECRET"),
-    secure = True
-)
+
+_cloudinary_configured = False
+
+
+def configure_cloudinary() -> None:
+    """Configure the Cloudinary SDK once per process."""
+    global _cloudinary_configured
+    if _cloudinary_configured:
+        return
+    cloudinary.config( 
+        cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME"),
+        api_key = os.getenv("CLOUDINARY_API_KEY"),
+        api_secret = os.getenv("CLOUDINARY_API_SECRET"),
+        secure = True
+    )
+    _cloudinary_configured = True
+
 
 class ImageService:
     """Service for image processing and storage"""
@@ -31,6 +42,7 @@ class ImageService:
                 temp_file_path = temp_file.name
             
             # Upload to Cloudinary with optimizations
+            configure_cloudinary()
             upload_result = cloudinary.uploader.upload(
                 temp_file_path,
                 public_id=f"profiles/{user_id}",
@@ -65,6 +77,7 @@ class ImageService:
                 temp_file_path = temp_file.name
             
             # Upload to Cloudinary with optimizations for banner images
+            configure_cloudinary()
             upload_result = cloudinary.uploader.upload(
                 temp_file_path,
                 public_id=f"banners/{user_id}_{int(time.time())}",  # unique ID for each banner
@@ -0,0 +1,69 @@
+"""
+Per-worker LRU + TTL cache of user profiles.
+"""
+
+import threading
+from typing import Callable, Dict, Optional
+
+from cachetools import TTLCache
+
+import config
+from user.models.user import User
+
+
+class ProfileCache:
+    """
+    Caches User objects by user ID in front of Firestore reads.
+    
+    Entries are evicted least-recently-used once `maxsize` is reached and
+    expire after `ttl` seconds, which bounds how stale a profile changed on
+    another worker can be. Writes on this worker invalidate immediately.
+    Cached users are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(self, maxsize: Optional[int] = None, ttl: Optional[float] = None):
+        self.maxsize = maxsize or config.PROFILE_CACHE_SIZE
+        self.ttl = ttl or config.PROFILE_CACHE_TTL_SECONDS
+        self._cache: TTLCache = TTLCache(maxsize=self.maxsize, ttl=self.ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, user_id: str, loader: Callable[[str], Optional[User]]) -> Optional[User]:
+        """Return the cached user, or load it with `loader` and cache it (missing users are not cached)."""
+        with self._lock:
+            user = self._cache.get(user_id)
+            if user is not None:
+                self.hits += 1
+                return user
+            self.misses += 1
+
+        user = loader(user_id)
+        if user is not None:
+            with self._lock:
+                self._cache[user_id] = user
+        return user
+
+    def invalidate(self, user_id: str) -> None:
+        """Drop a user so the next read goes to Firestore."""
+        with self._lock:
+            if self._cache.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._cache),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "invalidations": self.invalidations,
+            }
@@ -1,8 +1,11 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Depends
 import json
 import os
-from typing import List
-from firebase_admin import firestore
+from functools import lru_cache
+from typing import List, Dict
+from container import Container, get_container
+from database.telemetry import query_telemetry
+from user.services.auth_service import AuthService
 
 # Initialize the FastAPI router
 router = APIRouter(
@@ -10,23 +13,21 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
-# Initialize Firestore DB
-db = firestore.client()
-
 # Path to the GeoJSON file
 GEOJSON_PATH = os.path.join(
     os.path.dirname(__file__), 
     "SportSGSportFacilitiesGEOJSON.geojson"
 )
 
-# Load the GeoJSON file at startup
-try:
+
+@lru_cache(maxsize=1)
+def load_facilities_geojson() -> Dict:
+    """
+    Parse the GeoJSON file once and keep it in memory.
+    Called by the start-up warm-up; a failed load is retried on the next call.
+    """
     with open(GEOJSON_PATH, "r", encoding="utf-8") as f:
-        FACILITIES_GEOJSON = json.load(f)
-except Exception as e:
-    # If there's an error reading/parsing the file at startup
-    FACILITIES_GEOJSON = None
-    print(f"Error loading GeoJSON file: {e}")
+        return json.load(f)
 
 
 @router.get("/facilities_geojson", summary="Get facilities GeoJSON data")
@@ -43,14 +44,16 @@ def get_facilities_geojson():
     Raises:
     - **HTTPException (500)**: If the GeoJSON file could not be loaded.
     """
-    if not FACILITIES_GEOJSON:
-        # If the file was not loaded successfully, raise an error
+    try:
+        return load_facilities_geojson()
+    except Exception as e:
+        # If the file could not be read or parsed, raise an error
+        print(f"Error loading GeoJSON file: {e}")
         raise HTTPException(status_code=500, detail="GeoJSON data not available.")
-    return FACILITIES_GEOJSON
 
 
 @router.get("/sports_list", response_model=List[str], summary="Get list of sports")
-async def get_sports_list():
+async def get_sports_list(container: Container = Depends(get_container)):
     """
     Return a list of all sports from Firestore.
 
@@ -65,7 +68,7 @@ async def get_sports_list():
     """
     try:
         # Reference the 'types' document in the 'sports' collection
-        sports_doc_ref = db.collection('sports').document('types')
+        sports_doc_ref = container.db.collection('sports').document('types')
         sports_doc = sports_doc_ref.get()
         
         if not sports_doc.exists:
@@ -103,4 +106,93 @@ async def get_sports_list():
         raise HTTPException(
             status_code=500, 
             detail=f"Failed to retrieve sports list: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+
+@router.get("/query_stats", response_model=List[Dict], summary="Get query shape telemetry",
+            dependencies=[Depends(AuthService.get_admin_user)])
+def get_query_stats():
+    """
+    Return latency and result-count statistics for every query shape executed
+    by this worker since start-up, slowest total time first.
+
+    Each entry notes whether the shape needs a composite index, so slow or
+    unindexed shapes can be spotted before they reach production load.
+    """
+    return query_telemetry.snapshot()
+
+
+@router.get("/cache_stats", response_model=Dict, summary="Get profile cache statistics",
+            dependencies=[Depends(AuthService.get_admin_user)])
+def get_cache_stats(container: Container = Depends(get_container)):
+    """
+    Return size, hit rate and invalidation counts for this worker's user
+    profile cache.
+    """
+    return container.user_repository.cache.stats()
+
+
+@router.get("/jobs", response_model=List[Dict], summary="Get background job history",
+            dependencies=[Depends(AuthService.get_admin_user)])
+def get_job_history(request: Request):
+    """
+    Return each scheduled job with its recent runs and durations.
+
+    Runs skipped because another replica held the job's lease are listed with
+    status "skipped"; only runs executed by this worker have durations.
+    """
+    return request.app.state.scheduler.history()
+
+
+@router.get("/cascades/{job_id}", response_model=Dict, summary="Get clean-up job progress",
+            dependencies=[Depends(AuthService.get_admin_user)])
+def get_cascade_job(job_id: str, container: Container = Depends(get_container)):
+    """
+    Return the progress of a background clean-up started by deleting an
+    account or activity: its status, per-step counts and the last error, if any.
+
+    Raises:
+    - **HTTPException (404)**: If no such job exists.
+    """
+    job = container.cascade.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Clean-up job not found")
+    return job
+
+
+@router.get("/alert_stats", response_model=Dict, summary="Get alert collection size",
+            dependencies=[Depends(AuthService.get_admin_user)])
+def get_alert_stats(container: Container = Depends(get_container)):
+    """
+    Return the number of alerts stored (total, read and unread) and the number
+    of users with alerts, counted with aggregation queries.
+
+    Raises:
+    - **HTTPException (500)**: If the counts could not be read from Firestore.
+    """
+    try:
+        return container.alert_repository.collection_stats()
+    except Exception as e:
+        print(f"Error counting alerts: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to count alerts: {str(e)}")
+
+
+@router.get("/outbox_stats", response_model=Dict, summary="Get alert outbox backlog",
+            dependencies=[Depends(AuthService.get_admin_user)])
+def get_outbox_stats(container: Container = Depends(get_container)):
+    """
+    Return how many alert events are waiting for delivery and how many were
+    given up on after repeated failures.
+    """
+    return container.outbox.stats()
+
+
+@router.get("/stream_stats", response_model=Dict, summary="Get live connection statistics",
+            dependencies=[Depends(AuthService.get_admin_user)])
+def get_stream_stats(container: Container = Depends(get_container)):
+    """
+    Return this worker's open alert streams and chat sockets, the events
+    published to them and the threads and users watched through Firestore
+    listeners.
+    """
+    return {"alerts": container.alert_events.stats(), "chat": container.chat_hub.stats()}
@@ -0,0 +1,284 @@
+"""
+Background write coalescer that groups Firestore writes into batched commits.
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, wait
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+from google.api_core.exceptions import FailedPrecondition
+
+# Firestore rejects batches with more than 500 operations
+MAX_BATCH_WRITES = 500
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PendingWrite:
+    """
+    A single set/update/delete operation waiting to be committed.
+
+    Updates and deletes may carry a precondition (db.write_option(...)); one
+    that no longer holds at commit time drops the write and fails its future
+    with FailedPrecondition.
+    """
+    op: str
+    reference: Any
+    data: Optional[Dict] = None
+    merge: bool = False
+    option: Any = None
+
+
+@dataclass
+class _Submission:
+    """Writes that must land in the same commit, plus the caller's future."""
+    writes: List[PendingWrite]
+    future: Future = field(default_factory=Future)
+
+
+class _FlushMarker:
+    """Queue marker that forces a commit and signals the waiting caller."""
+    def __init__(self):
+        self.done = threading.Event()
+
+
+_STOP = object()
+
+
+class WriteCoalescer:
+    """
+    Accumulates writes from many callers and commits them as Firestore batches.
+
+    A batch is committed when it reaches max_batch_writes or when flush_interval
+    seconds have passed since its first write. Callers get a Future per submission;
+    if a batch fails, its submissions are retried one by one so an error is only
+    reported for the writes that actually caused it.
+    """
+
+    def __init__(self, db, max_batch_writes: int = MAX_BATCH_WRITES,
+                 flush_interval: float = 0.05, max_pending: int = 5000, name: str = "writes"):
+        self.db = db
+        self.max_batch_writes = min(max_batch_writes, MAX_BATCH_WRITES)
+        self.flush_interval = flush_interval
+        self.name = name
+        # Bounded queue: submit() blocks once max_pending submissions are waiting
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+        # Futures of queued submissions by the paths of the documents they write, for wait_for()
+        self._pending: Dict[str, List[Future]] = {}
+        self._stats = {"submitted": 0, "committed": 0, "failed": 0, "commits": 0}
+
+    def start(self) -> None:
+        """Start the background commit thread if it isn't running yet."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name=f"{self.name}-coalescer", daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, writes: List[PendingWrite], timeout: Optional[float] = None) -> Future:
+        """
+        Queue writes to be committed together.
+
+        Args:
+            writes: Operations that must be applied in the same commit.
+            timeout: Seconds to wait for queue space before raising queue.Full.
+
+        Returns:
+            Future resolved with None once committed, or with the commit error.
+        """
+        if self._closed:
+            raise RuntimeError(f"{self.name} coalescer is closed")
+        if len(writes) > self.max_batch_writes:
+            raise ValueError(f"Cannot commit {len(writes)} writes in one batch")
+
+        self.start()
+        submission = _Submission(writes=writes)
+        paths = {write.reference.path for write in writes}
+        with self._lock:
+            for path in paths:
+                self._pending.setdefault(path, []).append(submission.future)
+        submission.future.add_done_callback(lambda future: self._settled(paths, future))
+        try:
+            self._queue.put(submission, timeout=timeout)
+        except queue.Full as e:
+            submission.future.set_exception(e)
+            raise
+        with self._lock:
+            self._stats["submitted"] += 1
+        return submission.future
+
+    def set(self, reference, data: Dict, merge: bool = False) -> Future:
+        """Queue a single document set."""
+        return self.submit([PendingWrite("set", reference, data, merge)])
+
+    def update(self, reference, data: Dict) -> Future:
+        """Queue a single document update."""
+        return self.submit([PendingWrite("update", reference, data)])
+
+    def delete(self, reference) -> Future:
+        """Queue a single document delete."""
+        return self.submit([PendingWrite("delete", reference)])
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Commit everything queued so far; returns False if it timed out."""
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        marker = _FlushMarker()
+        self._queue.put(marker)
+        return marker.done.wait(timeout)
+
+    def wait_for(self, references: Iterable[Any], timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the writes queued so far on these documents have committed
+        or failed, without waiting on other writes queued after them.
+        Returns False if it timed out.
+        """
+        paths = {reference.path for reference in references}
+        with self._lock:
+            futures = [future for path in paths for future in self._pending.get(path, ())]
+        return not wait(futures, timeout).not_done
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Commit pending writes and stop the background thread."""
+        self._closed = True
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        """Counters for monitoring: submissions, committed/failed, and commit count."""
+        with self._lock:
+            return {**self._stats, "pending": self._queue.qsize()}
+
+    def _run(self) -> None:
+        carry = None
+        while True:
+            item = carry if carry is not None else self._queue.get()
+            carry = None
+
+            if item is _STOP:
+                return
+            if isinstance(item, _FlushMarker):
+                item.done.set()
+                continue
+
+            group = [item]
+            size = len(item.writes)
+            deadline = time.monotonic() + self.flush_interval
+            stop_after = False
+
+            while size < self.max_batch_writes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    nxt = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if nxt is _STOP:
+                    stop_after = True
+                    break
+                if isinstance(nxt, _FlushMarker):
+                    carry = nxt
+                    break
+                if size + len(nxt.writes) > self.max_batch_writes:
+                    carry = nxt
+                    break
+                group.append(nxt)
+                size += len(nxt.writes)
+
+            self._commit(group)
+            if stop_after:
+                return
+
+    def _commit(self, group: List[_Submission]) -> None:
+        try:
+            self._commit_batch(group)
+            for submission in group:
+                submission.future.set_result(None)
+            self._record(committed=len(group))
+            return
+        except Exception as e:
+            if len(group) == 1:
+                self._fail(group[0], e)
+                return
+
+        # One bad write fails the whole batch; retry individually to isolate it
+        for submission in group:
+            try:
+                self._commit_batch([submission])
+                submission.future.set_result(None)
+                self._record(committed=1)
+            except Exception as e:
+                self._fail(submission, e)
+
+    def _commit_batch(self, group: List[_Submission]) -> None:
+        batch = self.db.batch()
+        for submission in group:
+            for write in submission.writes:
+                if write.op == "set":
+                    batch.set(write.reference, write.data, merge=write.merge)
+                elif write.op == "update":
+                    batch.update(write.reference, write.data, option=write.option)
+                elif write.op == "delete":
+                    batch.delete(write.reference, option=write.option)
+                else:
+                    raise ValueError(f"Unknown write operation: {write.op}")
+        batch.commit()
+        with self._lock:
+            self._stats["commits"] += 1
+
+    def _settled(self, paths, future: Future) -> None:
+        with self._lock:
+            for path in paths:
+                futures = self._pending.get(path)
+                if futures and future in futures:
+                    futures.remove(future)
+                    if not futures:
+                        del self._pending[path]
+
+    def _record(self, committed: int = 0, failed: int = 0) -> None:
+        with self._lock:
+            self._stats["committed"] += committed
+            self._stats["failed"] += failed
+
+    def _fail(self, submission: _Submission, error: Exception) -> None:
+        paths = ", ".join(w.reference.path for w in submission.writes)
+        if isinstance(error, FailedPrecondition):
+            # Conditional writes are expected to lose to concurrent changes
+            logger.debug("Dropped conditional %s write (%s): %s", self.name, paths, error)
+        else:
+            logger.error("Error committing %s (%s): %s", self.name, paths, error)
+        submission.future.set_exception(error)
+        self._record(failed=1)
+
+
+# Process-wide coalescers by name, so every repository instance shares the same batches
+_coalescers: Dict[str, WriteCoalescer] = {}
+_registry_lock = threading.Lock()
+
+
+def get_coalescer(name: str, db, **kwargs) -> WriteCoalescer:
+    """Return the named coalescer, creating it with the given settings on first use."""
+    with _registry_lock:
+        if name not in _coalescers:
+            _coalescers[name] = WriteCoalescer(db, name=name, **kwargs)
+        return _coalescers[name]
+
+
+def shutdown_coalescers() -> None:
+    """Commit queued writes and stop every coalescer (called on app shutdown)."""
+    with _registry_lock:
+        coalescers = list(_coalescers.values())
+        _coalescers.clear()
+    for coalescer in coalescers:
+        coalescer.close()
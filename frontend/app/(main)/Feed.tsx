@@ -155,6 +155,9 @@ export default function Feed() {
   
       // Always filter for only available activities
       params.append("status", "available");
+
+      // Let the server drop activities the user has already joined
+      params.append("excludeJoined", "true");
       
       // Construct the final URL using API_URL
       const baseUrl = `${API_URL}/activity/search`;
@@ -183,7 +186,7 @@ export default function Feed() {
       
       if (currentUserId) {
         const now = new Date();
-        data = data.filter((activity: { dateTime: string | number | Date; status: string; participants: string | string[]; creator_id: string; }) => {
+        data = data.filter((activity: { dateTime: string | number | Date; status: string; creator_id: string; }) => {
           const activityDate = new Date(activity.dateTime);
           
           // Check if activity is in the future
@@ -192,13 +195,10 @@ export default function Feed() {
           // Check if activity is available (not cancelled)
           const isAvailable = activity.status === "available";
           
-          // Check if user is not already a participant
-          const isNotParticipant = !activity.participants?.includes(currentUserId);
-          
           // Check if user is not the creator
           const isNotCreator = activity.creator_id !== currentUserId;
           
-          return isUpcoming && isAvailable && isNotParticipant && isNotCreator;
+          return isUpcoming && isAvailable && isNotCreator;
         });
       }
       
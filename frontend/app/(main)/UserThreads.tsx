@@ -31,7 +31,7 @@ interface ActivityThread {
   sport: string;
   isCreator: boolean;
   placeName: string;
-  participants: number;
+  participantCount: number;
   maxParticipants: number;
 }
 
@@ -254,7 +254,7 @@ const UserThreads = () => {
             </Text>
             
             <Text style={[styles.activityInfo, { color: colors.smalltext }]}>
-    {Array.isArray(item.participants) ? item.participants.length : 0}/{item.maxParticipants} participants
+    {item.participantCount ?? 0}/{item.maxParticipants} participants
   </Text>
           </View>
         </View>
@@ -120,7 +120,7 @@ const ActivityCard = ({ activity }: ActivityCardProps) => {
   const status = getActivityStatus();
 
   // Get participant count
-  const participantCount = activity.participants?.length || 0;
+  const participantCount = activity.participantCount ?? activity.participants?.length ?? 0;
   const maxParticipants = activity.maxParticipants || "∞";
 
   const isCancelled = activity.status === "cancelled";
@@ -23,8 +23,10 @@ export interface Location {
     location: Location;
     placeName: string;  // Add the placeName field
     dateTime: string;
-    participants: string[];
-    joinRequests: string[];
+    // Full activity documents only; list endpoints return participantCount instead
+    participants?: string[];
+    joinRequests?: string[];
+    participantCount?: number;
     maxParticipants: number;
     status: string;
     unread_messages?: number;